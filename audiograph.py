@@ -1,12 +1,27 @@
-import sympy
-import libaudioverse
-import ui
+import sys
+
+# Service workers import this file again, and must not run any of it.
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        import service
+        sys.exit(service.main(sys.argv[2:]))
+
+    import ui
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--stdout":
+        # Run a script, or standard input, with the audio of .file - on standard output and everything else on standard error.
+        u = ui.Ui()
+        sys.stdout = sys.stderr
+        if len(sys.argv) > 2:
+            u.do_batch(sys.argv[2])
+        else:
+            u.run_batch([line.rstrip("\r\n") for line in sys.stdin])
+        sys.exit(0)
 
-with libaudioverse.InitializationManager():
     u = ui.Ui()
     print("""Welcome to audiograph.
 
-Enter equations on a line by themselves to heare them graphed.  Commands start with ".".  For a list of commands, type .help.
+Enter equations on a line by themselves to heare them graphed.  Separate several equations with ; to hear them together.  Commands start with ".".  For a list of commands, type .help.
 
 Type .quit to quit.""")
     u.run()
@@ -0,0 +1,163 @@
+"""Choosing a y range which fits a graph, so that it doesn't play as silence.
+
+f is first evaluated at evenly spaced points.  Then, a few times over, the intervals where it changes fastest or goes from defined to undefined are split and evaluated again, which finds peaks and the edges of gaps.
+Poles would stretch the range until the rest of the graph is flat, so the range starts from quantiles of y weighted by how much of the x range each point stands for.
+The highest and lowest values are then used too, if they're within reach of those quantiles or are the tops of smooth peaks.
+Around the top of a peak, f stays most of the way up and climbing toward the top settles, but around a pole |f| either falls back from the extreme or keeps climbing, so this keeps peaks and drops poles.
+The margin left above and below the curve never crosses zero when the curve doesn't, so that a curve which is positive everywhere gets a range which is too."""
+import numpy
+import sonifier
+
+# Points evaluated before refining.
+initial_points = 1024
+# Refinement rounds, the most intervals split in each, and how many pieces each is split into.
+rounds = 3
+refined_intervals = 256
+pieces = 8
+# An interval is steep if y changes across it by more than this many times the median change.
+steepness = 8.0
+# The fraction of the x range, from each end of the distribution of y, treated as possible outliers.
+tail = 0.05
+# Extremes are kept if they're no further past the quantiles than this many times the distance between the quantiles.
+reach = 1.0
+# An extreme is beside a pole if its nearest neighbors are further than this fraction of the way back to the quantile, or if f between them still goes past it by more than this fraction after rounds steps of climbing.
+drop = 0.25
+# Room left above and below the curve, as a fraction of the range.
+margin = 0.05
+
+def refine(x, y, defined):
+    """Returns new points to evaluate: inside the steepest intervals, and those with a defined point at one end only."""
+    gaps = numpy.diff(x)
+    usable = defined & numpy.isfinite(y)
+    with numpy.errstate(invalid = "ignore"):
+        change = numpy.abs(numpy.diff(numpy.where(usable, y, 0.0)))
+    both = usable[:-1] & usable[1:]
+    edges = usable[:-1] != usable[1:]
+    # Infinities are as steep as it gets.
+    change[defined[:-1] & defined[1:] & ~both] = numpy.inf
+    typical = numpy.median(change[both]) if both.any() else 0.0
+    steep = (defined[:-1] & defined[1:]) & (change > steepness*typical) & (gaps > 0)
+    score = numpy.where(edges, numpy.inf, numpy.where(steep, change, -1.0))
+    chosen = numpy.flatnonzero(score >= 0)
+    if len(chosen) > refined_intervals:
+        chosen = chosen[numpy.argsort(-score[chosen], kind = "stable")[:refined_intervals]]
+    fractions = numpy.arange(1, pieces)/pieces
+    return (x[chosen, None]+gaps[chosen, None]*fractions).ravel()
+
+def weighted_quantiles(x, y, quantiles):
+    """Quantiles of y, weighting each point by half the distance to its neighbors."""
+    order = numpy.argsort(y, kind = "stable")
+    padded = numpy.concatenate(([x[0]], x, [x[-1]]))
+    weights = (padded[2:]-padded[:-2])/2
+    cumulative = numpy.cumsum(weights[order])
+    total = cumulative[-1]
+    if total <= 0:
+        return [float(numpy.median(y))]*len(quantiles)
+    positions = numpy.searchsorted(cumulative, numpy.asarray(quantiles)*total)
+    return [float(y[order[min(p, len(y)-1)]]) for p in positions]
+
+def peak(f, x, y, defined, i, quantile):
+    """If y[i], an extreme past quantile, is at a smooth peak rather than beside a pole, returns the top of the peak; otherwise None.
+
+A neighbor must be most of the way up.  Then climb decides.
+Refinement can't be relied on to have closed in on a pole, because 1/x**2 climbs as steeply on either side of one, so the interval across it looks flat."""
+    if not defined[i] or not numpy.isfinite(y[i]):
+        return None
+    changes = [abs(y[j]-y[i]) for j in (i-1, i+1) if 0 <= j < len(y) and defined[j] and numpy.isfinite(y[j])]
+    if not changes or min(changes) > drop*abs(y[i]-quantile):
+        return None
+    return climb(f, x[max(i-1, 0):i+2], x[i], float(y[i]), quantile)
+
+def climb(f, points, top, value, reference):
+    """Returns the top of a smooth peak at (top, value), or None if there's a pole beside it.
+
+f is evaluated between top and the rest of points, climbing toward whatever is furthest from reference, up to rounds times.
+At a peak, that settles within reach of where it was, but beside a pole |f| keeps growing."""
+    fractions = numpy.arange(1, pieces)/pieces
+    for attempt in range(rounds):
+        between = numpy.concatenate([top+(point-top)*fractions for point in points if point != top])
+        ys, inside = sonifier.evaluate(f, between)
+        if numpy.any(inside & numpy.isinf(ys)):
+            return None
+        if not inside.any():
+            return value
+        distances = numpy.where(inside, numpy.abs(ys-reference), -1.0)
+        j = numpy.argmax(distances)
+        if distances[j] <= abs(value-reference):
+            return value
+        climbed = distances[j] > (1+drop)*abs(value-reference)
+        top, value = between[j], float(ys[j])
+        if not climbed:
+            return value
+        points = numpy.sort(numpy.concatenate((points, between)))
+        k = numpy.searchsorted(points, top)
+        points = points[max(k-1, 0):k+2]
+    return None
+
+def poles(f, x, y, defined):
+    """Returns the i of every interval from x[i] to x[i+1] with a pole in it, for y and defined from sonifier.evaluate(f, x).
+
+Candidates are the steep intervals, as refine finds them, and those beside a local extreme, since the interval across a pole of 1/x**2 looks flat.
+The refined_intervals furthest from the median are climbed across, from their end further from it; it's a pole if that never settles."""
+    usable = defined & numpy.isfinite(y)
+    both = usable[:-1] & usable[1:]
+    if not both.any():
+        return numpy.zeros(0, dtype = numpy.int64)
+    steps = numpy.diff(numpy.where(usable, y, 0.0))
+    change = numpy.abs(steps)
+    candidates = both & (change > steepness*numpy.median(change[both]))
+    turning = numpy.flatnonzero(numpy.sign(steps[:-1]) != numpy.sign(steps[1:]))
+    candidates[turning] = candidates[turning+1] = True
+    candidates &= both
+    reference = float(numpy.median(y[usable]))
+    distance = numpy.maximum(numpy.abs(y[:-1]-reference), numpy.abs(y[1:]-reference))
+    chosen = numpy.flatnonzero(candidates)
+    if len(chosen) > refined_intervals:
+        chosen = numpy.sort(chosen[numpy.argsort(-distance[chosen], kind = "stable")[:refined_intervals]])
+    found = []
+    for i in chosen:
+        start = i if abs(y[i]-reference) >= abs(y[i+1]-reference) else i+1
+        if climb(f, x[i:i+2], x[start], float(y[start]), reference) is None:
+            found.append(i)
+    return numpy.array(found, dtype = numpy.int64)
+
+def y_range(f, min_x, max_x):
+    """Returns (min_y, max_y) for graphing f from min_x to max_x, or None if f is undefined or infinite everywhere there.
+
+f can be a list of callables, for several curves graphed together.  The range then fits all of them."""
+    if isinstance(f, list):
+        ranges = [r for r in (y_range(i, min_x, max_x) for i in f) if r is not None]
+        if not ranges:
+            return None
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+    x = numpy.linspace(min_x, max_x, initial_points)
+    y, defined = sonifier.evaluate(f, x)
+    for i in range(rounds):
+        new_x = refine(x, y, defined)
+        if len(new_x) == 0:
+            break
+        new_y, new_defined = sonifier.evaluate(f, new_x)
+        x = numpy.concatenate((x, new_x))
+        y = numpy.concatenate((y, new_y))
+        defined = numpy.concatenate((defined, new_defined))
+        order = numpy.argsort(x, kind = "stable")
+        x, y, defined = x[order], y[order], defined[order]
+    # Infinities are left in, so that they count as outliers.
+    keep = defined & ~numpy.isnan(y)
+    if not keep.any():
+        return None
+    low, high = weighted_quantiles(x[keep], y[keep], [tail, 1-tail])
+    span = high-low
+    finite = numpy.flatnonzero(keep & numpy.isfinite(y))
+    if len(finite) == 0:
+        return None
+    lowest, highest = finite[numpy.argmin(y[finite])], finite[numpy.argmax(y[finite])]
+    bottom = float(y[lowest]) if y[lowest] >= low-reach*span else peak(f, x, y, defined, lowest, low)
+    top = float(y[highest]) if y[highest] <= high+reach*span else peak(f, x, y, defined, highest, high)
+    if bottom is not None:
+        low = bottom
+    if top is not None:
+        high = top
+    # The range must be strictly increasing, and a flat curve still needs some room.
+    room = (high-low)*margin or max(abs(high)*margin, 1.0)
+    return (max(low-room, 0.0) if low > 0 else low-room), (min(high+room, 0.0) if high < 0 else high+room)
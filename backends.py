@@ -0,0 +1,111 @@
+"""The ways a parsed equation can be compiled into a function of x.
+
+numpy: lambdify with NumPy, evaluating the whole graph in one call.  The default.
+cse: the same, but subexpressions which appear more than once are computed once, using sympy.cse.  Faster for big equations.
+math: lambdify with the math module, evaluating one point at a time.  Division by zero and overflow make points undefined, where NumPy gives infinities.
+lambdify's arithmetic would work on whole arrays, following NumPy's rules instead, so math functions refuse arrays.
+mpmath: lambdify with mpmath at extra precision, one point at a time.  Slow, but accurate where floats lose precision, such as next to singularities.
+
+auto compiles numpy and cse and keeps whichever evaluates a sample of points faster.  math and mpmath are never picked automatically, as they'd change what some graphs sound like.
+Whatever the backend, the function evaluate in sonifier receives gives back something it can check, as it does for numpy."""
+from time import perf_counter
+import numpy
+import sonifier
+
+names = ["numpy", "cse", "math", "mpmath"]
+# The ones auto chooses between.
+candidates = ["numpy", "cse"]
+# Decimal digits mpmath works with.
+mpmath_precision = 30
+# auto times each candidate evaluating this many points between these values.
+sample_points = 2048
+sample_range = (-10.0, 10.0)
+# lambdify names the functions it generates this.
+generated_name = "_lambdifygenerated"
+
+_namespaces = {}
+
+def module(name):
+    """The modules argument lambdify gets for a backend."""
+    return "numpy" if name == "cse" else name
+
+def namespace(name):
+    """The globals lambdify gives functions it generates for a backend."""
+    if name not in _namespaces:
+        import sympy
+        from sympy.utilities.lambdify import lambdify
+        _namespaces[name] = lambdify((sympy.Symbol("x"), ), 0, modules = module(name)).__globals__
+    return _namespaces[name]
+
+def generate(sym, x, name):
+    """Returns the raw function lambdify makes for sym, a function of the symbol x, with the named backend."""
+    from sympy.utilities.lambdify import lambdify
+    if name == "cse":
+        return lambdify((x, ), sym, modules = module(name), cse = True)
+    return lambdify((x, ), sym, modules = module(name))
+
+def has_common_subexpressions(sym):
+    import sympy
+    replacements, reduced = sympy.cse(sym)
+    return len(replacements) > 0
+
+def wrap(name, raw):
+    """Returns a function evaluate can use, from the raw function generate made for the named backend."""
+    if name == "math":
+        return MathFunction(raw)
+    if name == "mpmath":
+        return MpmathFunction(raw)
+    return raw
+
+class MathFunction:
+    """Calls a function lambdify made for math one point at a time, so that Python's float arithmetic decides what's undefined.
+
+Given an array, it raises TypeError, which makes evaluate fall back to calling it once per element."""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __call__(self, x):
+        if isinstance(x, numpy.ndarray):
+            raise TypeError("math evaluates one point at a time")
+        return self.raw(x)
+
+class MpmathFunction:
+    """Calls a function lambdify made for mpmath at mpmath_precision, converting to and from Python numbers.
+
+mpmath's numbers aren't registered as numbers.Real, so without this every point would be undefined.
+Complex results come back as complex, so that evaluate treats them like NumPy's."""
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def __call__(self, x):
+        if isinstance(x, numpy.ndarray):
+            raise TypeError("mpmath evaluates one point at a time")
+        import mpmath
+        with mpmath.workdps(mpmath_precision):
+            y = self.raw(mpmath.mpf(x))
+        if isinstance(y, mpmath.mpc):
+            return complex(y)
+        return float(y)
+
+def cost(f):
+    """Seconds per point f takes to evaluate."""
+    xs = numpy.linspace(*sample_range, sample_points)
+    start = perf_counter()
+    sonifier.evaluate(f, xs)
+    return (perf_counter()-start)/sample_points
+
+def choose(sym, x):
+    """Returns (name, raw) for the fastest candidate backend for sym.
+
+cse is only tried when sym has subexpressions to share; otherwise it's the same code as numpy."""
+    best = None
+    for name in candidates:
+        if name == "cse" and not has_common_subexpressions(sym):
+            continue
+        raw = generate(sym, x, name)
+        seconds = cost(wrap(name, raw))
+        if best is None or seconds < best[0]:
+            best = (seconds, name, raw)
+    return best[1], best[2]
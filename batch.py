@@ -0,0 +1,60 @@
+"""Parallel batch rendering.
+
+A batch script is mostly settings commands followed by .file lines.  We replay the settings in order on the Ui, take a snapshot of them for every .file line, and render the files on a pool of processes.
+Everything a line prints is reported in script order, regardless of which job finishes first."""
+import concurrent.futures
+import contextlib
+import io
+import traceback
+
+# The Ui used by a worker process.  Made by initialize_worker.
+worker_ui = None
+
+def initialize_worker():
+    global worker_ui
+    import ui
+    worker_ui = ui.Ui()
+
+def render(argument, settings):
+    """Run .file argument in a worker, with the settings snapshot from the script.  Returns everything it printed."""
+    worker_ui.restore(settings)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            worker_ui.do_file(argument)
+        except Exception:
+            fname = argument.partition(" ")[0]
+            if settings.get("debug"):
+                traceback.print_exc(file = output)
+            print("Couldn't render {}.".format(fname))
+    return output.getvalue()
+
+def streams(argument):
+    """Whether .file argument writes to standard output.  Those run in this process, in script order, since the workers can't share it."""
+    words = argument.split()
+    if words[:1] == ["auto"]:
+        words = words[1:]
+    return words[:1] == ["-"]
+
+def run(ui, lines, workers):
+    """Run a batch script on ui, sending .file lines to a pool of workers processes."""
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers, initializer = initialize_worker) as pool:
+        for line in lines:
+            word, sep, rest = line.partition(" ")
+            if word == ".file" and not streams(rest):
+                argument = rest.strip()
+                results.append((argument, pool.submit(render, argument, ui.settings())))
+                continue
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                ui.handle_command(line)
+            results.append((line, output.getvalue()))
+        for line, result in results:
+            if isinstance(result, concurrent.futures.Future):
+                try:
+                    result = result.result()
+                except Exception:
+                    # The worker itself died.
+                    result = "Couldn't render {}.\n".format(line.partition(" ")[0])
+            print(result, end = "")
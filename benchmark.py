@@ -0,0 +1,723 @@
+"""Benchmarks for audiograph.
+
+Usage:
+python benchmark.py callback [script]: compare the per-block cost of the block callback before and after precomputing the curve.
+python benchmark.py engines [script]: render with both the realtime and offline engines, report how much faster than realtime each is, and check that they agree.
+python benchmark.py startup [runs]: measure time to the prompt and time from entering the first equation to it being ready to play, in fresh processes.
+python benchmark.py multi [max curves]: render several curves on one server with multigraph.MultiSonifier, against one server per curve, and report the time each takes.
+python benchmark.py mixer [max sessions]: play a graph in each of n sessions on one mixer.Mixer, and report the CPU time each extra session adds, and how long adding and removing one takes.
+python benchmark.py progressive: compare how long graphs take to be ready to play with and without progressive evaluation, as f gets slower.
+python benchmark.py controls [script]: save each graph as a control file, and report how much smaller it is than the .wav and whether it renders to the same bytes.
+python benchmark.py stream [script]: render each graph with offline.Streamer and offline.Renderer, check they give the same bytes, and report peak memory and speed for each as the duration grows.
+python benchmark.py service [requests]: send .file lines to a render service through service.LocalClient, and report how long requests take, one at a time and all at once.
+python benchmark.py suite [results] [script]: measure everything which decides how fast graphs render, for the script's graphs and a generated corpus, and save the results as JSON, benchmark.json by default.  See measure for what's measured.
+python benchmark.py compare <old results> <new results> [threshold]: flag every measurement in the new results of suite which is worse than the old by more than threshold, 0.2 (20%) by default, averaged over each kind of graph and over all of them.  Exits with 1 if any are.
+
+Graphs are taken from the .file lines of a batch script, demos.txt by default.  Settings commands in the script are replayed, so every graph is benchmarked with the ranges and ticks it would be rendered with."""
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+import numpy
+import ui
+import sonifier
+import offline
+import service
+import backends
+import expression_cache
+
+class ScriptReader(ui.Ui):
+    """Replays a batch script, recording the settings for each .file line instead of rendering it."""
+
+    def __init__(self):
+        super().__init__()
+        self.graphs = []
+
+    def do_file(self, argument):
+        if argument.startswith("auto "):
+            argument = argument[len("auto "):].lstrip()
+        fname, sep, equation = argument.partition(" ")
+        self.graphs.append((equation, self.graph_settings()))
+
+    def do_default(self, argument):
+        pass
+
+def read_script(path):
+    """Returns a list of (equation, settings) for the .file lines of a batch script."""
+    reader = ScriptReader()
+    reader.do_batch(path)
+    return reader.graphs
+
+def legacy_block(state, f, x, settings):
+    """The work the block callback did per block before the curve was precomputed.
+
+Node property updates are the same before and after, so they're left out of both sides."""
+    min_y, max_y = settings["min_y"], settings["max_y"]
+    y = min_y+(max_y-min_y)/2
+    evaluated = False
+    try:
+        tmp = f(x)
+        if isinstance(tmp, float):
+            evaluated = True
+            y = tmp
+    except Exception:
+        pass
+    if y < min_y or y > max_y:
+        return
+    ticks = []
+    if evaluated:
+        main_freq = sonifier.compute_frequencies(y, min_y, max_y)
+    if settings["x_ticks"]:
+        if state["prev_x"]//settings["x_ticks"] != x//settings["x_ticks"]:
+            ticks.append("x")
+    state["prev_x"] = x
+    if evaluated:
+        if settings["y_ticks"]:
+            if state["prev_y"]//settings["y_ticks"] != y//settings["y_ticks"]:
+                ticks.append("y")
+        if y < 0: y_sign = -1
+        elif y == 0: y_sign = 0
+        else: y_sign = 1
+        if settings["zero_ticks"]:
+            if (state["prev_y_sign"] != 0 and y_sign == 0) or abs(state["prev_y_sign"]-y_sign) > 1:
+                ticks.append("zero")
+        state["prev_y_sign"] = y_sign
+        state["prev_y"] = y
+    return ticks
+
+def precomputed_block(curve, rows, state, time):
+    """The per-block work of the block callback now that the curve and its ticks are precomputed."""
+    times = curve.events.time_list
+    end = time+sonifier.block_duration
+    ticks = []
+    while state["next_event"] < len(times) and times[state["next_event"]] < end:
+        ticks.append(curve.events.kind_list[state["next_event"]])
+        state["next_event"] += 1
+    out_of_range, in_range, evaluated, y, main_freq = rows[curve.index(time)]
+    if out_of_range:
+        return
+    return ticks
+
+def bench_callback(equation, settings, u):
+    f = u.compile(equation)
+    settings = dict(settings)
+    # Panning and the block size don't change the math.
+    del settings["hrtf"]
+    del settings["block_size"]
+    start = time.perf_counter()
+    curve = sonifier.Curve(f, **settings)
+    rows = curve.rows()
+    precompute = time.perf_counter()-start
+    min_x, max_x, duration = settings["min_x"], settings["max_x"], settings["duration"]
+    state = {"prev_x": min_x}
+    state["prev_y"] = curve.y[0]
+    state["prev_y_sign"] = 1 if curve.y[0] > 0 else (-1 if curve.y[0] < 0 else 0)
+    start = time.perf_counter()
+    with numpy.errstate(all = "ignore"):
+        for t in curve.times:
+            x = min_x+(t/duration)*(max_x-min_x)
+            legacy_block(state, f, x, settings)
+    legacy = (time.perf_counter()-start)/curve.length
+    times = curve.times.tolist()
+    state = {"next_event": 0}
+    start = time.perf_counter()
+    for t in times:
+        precomputed_block(curve, rows, state, t)
+    precomputed = (time.perf_counter()-start)/curve.length
+    return precompute, legacy, precomputed
+
+def main_callback(args):
+    path = args[0] if args else "demos.txt"
+    u = ui.Ui()
+    deadline = sonifier.block_duration*1e6
+    print("Block deadline: {:.1f} us".format(deadline))
+    print("{:<16}{:>16}{:>16}{:>16}".format("equation", "precompute (ms)", "before (us)", "after (us)"))
+    for equation, settings in read_script(path):
+        precompute, legacy, precomputed = bench_callback(equation, settings, u)
+        print("{:<16}{:>16.2f}{:>16.2f}{:>16.2f}".format(equation, precompute*1e3, legacy*1e6, precomputed*1e6))
+
+def read_wav(path):
+    """Returns the contents of a PCM .wav file as a float array of shape (samples, channels)."""
+    with wave.open(path, "rb") as w:
+        width = w.getsampwidth()
+        data = numpy.frombuffer(w.readframes(w.getnframes()), dtype = "<i{}".format(width))
+        return data.reshape(-1, w.getnchannels())/float(2**(8*width-1))
+
+# Engines agree if their loudness envelopes correlate at least this well, and the pitch of the loudest partial is within this many semitones most of the time.
+envelope_agreement = 0.9
+pitch_agreement = 1.0
+analysis_frame = 2048
+
+def compare_audio(a, b):
+    """Compare two renders of the same graph.  Returns (envelope correlation, median pitch difference in semitones)."""
+    length = min(len(a), len(b))//analysis_frame*analysis_frame
+    frames_a = a[:length].sum(axis = 1).reshape(-1, analysis_frame)
+    frames_b = b[:length].sum(axis = 1).reshape(-1, analysis_frame)
+    rms_a = numpy.sqrt((frames_a**2).mean(axis = 1))
+    rms_b = numpy.sqrt((frames_b**2).mean(axis = 1))
+    if rms_a.std() == 0 or rms_b.std() == 0:
+        envelope = 1.0 if numpy.allclose(rms_a, rms_b, atol = 1e-3) else 0.0
+    else:
+        envelope = numpy.corrcoef(rms_a, rms_b)[0, 1]
+    window = numpy.hanning(analysis_frame)
+    bins = numpy.fft.rfftfreq(analysis_frame, 1/sonifier.sr)
+    peak_a = bins[numpy.abs(numpy.fft.rfft(frames_a*window)).argmax(axis = 1)]
+    peak_b = bins[numpy.abs(numpy.fft.rfft(frames_b*window)).argmax(axis = 1)]
+    loud = (rms_a > 0.01) & (rms_b > 0.01) & (peak_a > 0) & (peak_b > 0)
+    if not loud.any():
+        return envelope, 0.0
+    pitch = numpy.median(numpy.abs(12*numpy.log2(peak_a[loud]/peak_b[loud])))
+    return envelope, pitch
+
+def main_engines(args):
+    path = args[0] if args else "demos.txt"
+    u = ui.Ui()
+    failed = False
+    print("{:<16}{:>6}{:>16}{:>16}{:>12}{:>12}".format("equation", "hrtf", "realtime (x)", "offline (x)", "envelope", "pitch"))
+    with tempfile.TemporaryDirectory() as directory:
+        for equation, settings in read_script(path):
+            f = u.compile(equation)
+            realtime_path = os.path.join(directory, "realtime.wav")
+            offline_path = os.path.join(directory, "offline.wav")
+            length = settings["duration"]+0.5
+            start = time.perf_counter()
+            graph = sonifier.Sonifier(f = f, **settings)
+            graph.write_file(realtime_path)
+            graph.shutdown()
+            realtime = length/(time.perf_counter()-start)
+            start = time.perf_counter()
+            offline.Renderer(f = f, **settings).write_file(offline_path)
+            fast = length/(time.perf_counter()-start)
+            envelope, pitch = compare_audio(read_wav(realtime_path), read_wav(offline_path))
+            agree = envelope >= envelope_agreement and pitch <= pitch_agreement
+            failed = failed or not agree
+            print("{:<16}{:>6}{:>16.1f}{:>16.1f}{:>12.3f}{:>12.2f}{}".format(equation, "on" if settings["hrtf"] else "off",
+                realtime, fast, envelope, pitch, "" if agree else "  DISAGREE"))
+    if failed:
+        sys.exit(1)
+
+# Run in a fresh process to time the first graph.  Everything up to making the Ui is what happens before the prompt.
+first_sound_script = """
+import time
+import ui
+import sonifier
+u = ui.Ui()
+start = time.perf_counter()
+graph = u.make_graph({equation!r}, audio_engine = sonifier.AudioEngine())
+print(time.perf_counter()-start)
+"""
+
+def time_to_prompt():
+    """Start audiograph.py and time how long it takes to print the prompt."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", "audiograph.py"], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+    output = b""
+    while not output.endswith(ui.Ui.prompt.encode("utf-8")):
+        byte = process.stdout.read(1)
+        if not byte:
+            raise RuntimeError("audiograph.py exited before showing the prompt.")
+        output += byte
+    elapsed = time.perf_counter()-start
+    process.communicate(b".quit\n")
+    return elapsed
+
+def time_to_first_sound(equation):
+    output = subprocess.check_output([sys.executable, "-c", first_sound_script.format(equation = equation)])
+    return float(output.split()[-1])
+
+def main_startup(args):
+    runs = int(args[0]) if args else 5
+    print("Median of {} runs.".format(runs))
+    prompt = statistics.median(time_to_prompt() for i in range(runs))
+    print("Time to prompt: {:.0f} ms".format(prompt*1e3))
+    # The first equation fastpath handles; the second needs sympy.
+    for equation in ("x*ln(x)", "factorial(x)"):
+        first = statistics.median(time_to_first_sound(equation) for i in range(runs))
+        print("Time to first sound for {}: {:.0f} ms".format(equation, first*1e3))
+
+def main_multi(args):
+    import multigraph
+    most = int(args[0]) if args else 8
+    settings = dict(duration = 5.0, min_x = -5, max_x = 5, min_y = -2, max_y = 2, y_ticks = 0.5)
+    fs = [lambda x, k = k: numpy.sin(x+k) for k in range(most)]
+    print("Time to render a 5 second graph of n curves.  Callback is the average block callback.")
+    print("{:<4}{:>16}{:>16}{:>20}{:>20}".format("n", "one (ms)", "n servers (ms)", "one callback (us)", "n callbacks (us)"))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "multi.wav")
+        n = 1
+        while n <= most:
+            start = time.perf_counter()
+            graph = multigraph.MultiSonifier(fs[:n], **settings)
+            graph.write_file(path)
+            graph.shutdown()
+            one = time.perf_counter()-start
+            one_callback = graph.stats.callback_time/max(graph.stats.callbacks, 1)
+            start = time.perf_counter()
+            callbacks = 0.0
+            for f in fs[:n]:
+                graph = sonifier.Sonifier(f, **settings)
+                graph.write_file(path)
+                graph.shutdown()
+                callbacks += graph.stats.callback_time/max(graph.stats.callbacks, 1)
+            separate = time.perf_counter()-start
+            print("{:<4}{:>16.1f}{:>16.1f}{:>20.1f}{:>20.1f}".format(n, one*1e3, separate*1e3, one_callback*1e6, callbacks*1e6))
+            n *= 2
+
+def main_mixer(args):
+    import mixer
+    most = int(args[0]) if args else 32
+    duration = 5.0
+    settings = dict(duration = duration, min_x = -5, max_x = 5, min_y = -2, max_y = 2, y_ticks = 0.5)
+    print("CPU time to render {} seconds of n sessions on one mixer.  Extra is per session added since the last row, which should stay flat.".format(duration))
+    print("{:<6}{:>12}{:>20}{:>20}{:>24}".format("n", "CPU (ms)", "per session (ms)", "extra (ms)", "add and remove (us)"))
+    previous = None
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "mixer.wav")
+        n = 1
+        while n <= most:
+            m = mixer.Mixer()
+            graphs = []
+            for k in range(n):
+                channel = m.add(gain = 1/n, pan = -1+2*(k+0.5)/n)
+                graphs.append(sonifier.Sonifier(lambda x, k = k: numpy.sin(x+k), engine = channel, **settings))
+            start = time.process_time()
+            m.write_file(path, duration+0.5)
+            cpu = time.process_time()-start
+            # With n sessions on the mixer, and the removed channel going back to the idle list each time.
+            start = time.perf_counter()
+            for i in range(100):
+                m.remove(m.add())
+            churn = (time.perf_counter()-start)/100
+            for graph in graphs:
+                graph.shutdown()
+            m.shutdown()
+            extra = "" if previous is None else "{:.1f}".format((cpu-previous[1])/(n-previous[0])*1e3)
+            print("{:<6}{:>12.1f}{:>20.1f}{:>20}{:>24.1f}".format(n, cpu*1e3, cpu/n*1e3, extra, churn*1e6))
+            previous = (n, cpu)
+            n *= 2
+
+def slow(cost):
+    """A vectorized f which takes cost seconds per point, like a deep expression or a special function would."""
+    def f(x):
+        deadline = time.perf_counter()+cost*numpy.size(x)
+        while time.perf_counter() < deadline:
+            pass
+        return numpy.sin(x)
+    return f
+
+def main_progressive(args):
+    import progressive
+    settings = dict(duration = 5.0, min_x = 0, max_x = 10, min_y = -1, max_y = 1, y_ticks = 0.5)
+    # Warm up, so that the first row isn't charged for NumPy loading things on first use.
+    sonifier.Curve(numpy.sin, **settings)
+    progressive.ProgressiveCurve(numpy.sin, **settings)
+    print("Time until a 5 second graph is ready to play, by the cost of f per point.")
+    print("{:<12}{:>12}{:>20}{:>16}".format("cost (us)", "full (ms)", "progressive (ms)", "refined (ms)"))
+    for cost in (0, 1e-5, 1e-4):
+        start = time.perf_counter()
+        sonifier.Curve(slow(cost), **settings)
+        full = time.perf_counter()-start
+        start = time.perf_counter()
+        curve = progressive.ProgressiveCurve(slow(cost), **settings)
+        ready = time.perf_counter()-start
+        curve.start()
+        curve.refined.wait()
+        refined = time.perf_counter()-start
+        print("{:<12.0f}{:>12.1f}{:>20.1f}{:>16.1f}".format(cost*1e6, full*1e3, ready*1e3, refined*1e3))
+
+def main_controls(args):
+    import controlfile
+    graphs = read_script(args[0] if args else "demos.txt")
+    print("{:<24}{:>12}{:>12}{:>10}{:>12}".format("equation", "wav (KB)", "agc (KB)", "ratio", "identical"))
+    u = ui.Ui()
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        wav_path = os.path.join(directory, "graph.wav")
+        agc_path = os.path.join(directory, "graph"+controlfile.extension)
+        played_path = os.path.join(directory, "played.wav")
+        for equation, settings in graphs:
+            f = u.compile(equation)
+            offline.Renderer(f, **settings).write_file(wav_path)
+            offline.Renderer(f, **settings).write_file(agc_path)
+            controlfile.load(agc_path).write_file(played_path)
+            with open(wav_path, "rb") as a, open(played_path, "rb") as b:
+                identical = a.read() == b.read()
+            failed = failed or not identical
+            wav_size, agc_size = os.path.getsize(wav_path), os.path.getsize(agc_path)
+            print("{:<24}{:>12.1f}{:>12.1f}{:>10.0f}{:>12}".format(equation, wav_size/1024, agc_size/1024, wav_size/agc_size, "yes" if identical else "NO"))
+    if failed:
+        sys.exit(1)
+
+def peak_memory(render):
+    """Returns (what render returns, the most memory in bytes Python allocated while running it)."""
+    tracemalloc.start()
+    try:
+        result = render()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def main_stream(args):
+    graphs = read_script(args[0] if args else "demos.txt")
+    u = ui.Ui()
+    failed = False
+    print("{:<24}{:>12}".format("equation", "identical"))
+    for equation, settings in graphs:
+        f = u.compile(equation)
+        whole = b"".join(offline.to_pcm16(chunk) for chunk in offline.Renderer(f, **settings).chunks())
+        streamed = b"".join(offline.Streamer(f, **settings).pcm())
+        failed = failed or whole != streamed
+        print("{:<24}{:>12}".format(equation, "yes" if whole == streamed else "NO"))
+    f = u.compile("sin(x)")
+    print()
+    # Speeds are timed apart from the memory measurements, since tracemalloc slows everything down several times over.
+    print("{:>14}{:>16}{:>16}{:>14}{:>14}".format("duration (s)", "renderer (MB)", "streamer (MB)", "renderer (x)", "streamer (x)"))
+    for duration in (10, 60, 300, 1200):
+        settings = dict(duration = duration, min_x = -duration, max_x = duration, min_y = -1, max_y = 1, x_ticks = 1, y_ticks = 0.5)
+        render = lambda engine: sum(len(piece) for piece in engine(f, **settings).pcm())
+        if duration <= 300:
+            size, renderer_peak = peak_memory(lambda: render(offline.Renderer))
+            start = time.perf_counter()
+            render(offline.Renderer)
+            renderer_speed = duration/(time.perf_counter()-start)
+        else:
+            renderer_peak = renderer_speed = None
+        size, streamer_peak = peak_memory(lambda: render(offline.Streamer))
+        start = time.perf_counter()
+        render(offline.Streamer)
+        streamer_speed = duration/(time.perf_counter()-start)
+        renderer = ("{:.1f}".format(renderer_peak/1024**2), "{:.1f}".format(renderer_speed)) if renderer_peak is not None else ("-", "-")
+        print("{:>14}{:>16}{:>16.1f}{:>14}{:>14.1f}".format(duration, renderer[0], streamer_peak/1024**2, renderer[1], streamer_speed))
+    if failed:
+        sys.exit(1)
+
+def script_requests(path = "demos.txt"):
+    """JSON render requests for the .file lines of a batch script, with the settings it would render them with."""
+    requests = []
+    for equation, settings in read_script(path):
+        request = {name: settings[name] for name in service.parameters if name in settings}
+        request["equation"] = equation
+        requests.append(request)
+    return requests
+
+def main_service(args):
+    import asyncio
+    count = int(args[0]) if args else 8
+    requests = script_requests()
+    requests = [requests[i%len(requests)] for i in range(count)]
+    s = service.Service()
+    s.warm()
+    client = service.LocalClient(s)
+    async def run():
+        times = []
+        for request in requests:
+            start = time.perf_counter()
+            status, content_type, data = await client.render(**request)
+            times.append(time.perf_counter()-start)
+            if status != 200:
+                print("{}: {} {}".format(request["equation"], status, data.decode("utf-8")))
+        print("One at a time: median {:.0f} ms per request.".format(statistics.median(times)*1e3))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(client.render(**request) for request in requests))
+        elapsed = time.perf_counter()-start
+        rejected = sum(1 for status, content_type, data in results if status == 503)
+        print("All at once: {:.0f} ms for {} requests, {} turned away.".format(elapsed*1e3, len(requests), rejected))
+        print(await client.status())
+    try:
+        asyncio.run(run())
+    finally:
+        s.close()
+
+# What suite measures, and how its results are laid out.  Bump this whenever either changes; compare refuses to compare different versions.
+suite_version = 1
+# Times are the best of this many runs.  Callback latencies and memory are from one run.
+suite_repeats = 3
+# Seconds.  See best_time.
+suite_batch = 0.02
+# compare flags a measurement as a regression when it's this much worse, as a fraction.
+regression_threshold = 0.2
+# Settings for the generated corpus.  Every kind of tick is on, so that finding crossings is measured too.
+corpus_settings = dict(duration = 5.0, min_x = -10, max_x = 10, min_y = -10, max_y = 10, hrtf = False, x_ticks = 1, y_ticks = 1, zero_ticks = True,
+    block_size = sonifier.block_size, control_interval = sonifier.block_size)
+# How many equations corpus makes of each kind.
+corpus_size = 6
+# The percentiles of block callback latency suite records.
+latency_percentiles = (50, 90, 99)
+
+def corpus():
+    """Returns a list of (category, equation) for a corpus of equations of every kind audiograph is likely to see.  It's the same every time."""
+    rng = random.Random(0)
+    def number():
+        return rng.randint(1, 5)
+    equations = []
+    for degree in (1, 2, 3, 5, 8, 12)[:corpus_size]:
+        terms = "".join("{:+.2f}*x**{}".format(rng.uniform(-1, 1), power) for power in range(degree, 0, -1))
+        equations.append(("polynomial", "({})/{}".format(terms, 10**(degree-1))))
+    templates = {
+        "trig": ["sin({a}*x)", "{a}*cos({b}*x)+sin(x)", "sin(x)*cos({a}*x)", "sin(x)**2-cos(x)**{b}", "asin(x/{c}0)*{a}", "{c}*sin({a}*x+{b})"],
+        "log": ["ln(x)", "ln(Abs(x)+{a})", "log(x, {b}+1)", "x*ln(x)", "{b}*ln(x**2+{a})", "exp(x/{c})*ln(Abs(x)+1)"],
+        "pole": ["1/x", "1/(x-{a})", "{a}/(x**2-{b})", "tan(x)", "1/sin(x)", "(x**2+1)/(x-{a})"],
+        "piecewise": ["Piecewise((x, x < 0), (x**2/10, True))", "Abs(x)-{a}", "floor(x)", "sign(sin(x))*{a}", "Max(x, {a})",
+            "Piecewise((-{a}, x < -{b}), ({a}, x > {b}), (x, True))"],
+    }
+    for category, forms in templates.items():
+        for form in forms[:corpus_size]:
+            equations.append((category, form.format(a = number(), b = number(), c = number())))
+    wrappers = ["sin({})", "cos({})", "({})*{a}/5", "{}+x/{a}", "sqrt(Abs({})+1)"]
+    for depth in (2, 4, 8, 12, 16, 24)[:corpus_size]:
+        equation = "x"
+        for i in range(depth):
+            equation = rng.choice(wrappers).format(equation, a = number())
+        equations.append(("nested", equation))
+    return equations
+
+def suite_cases(script):
+    """Returns a list of (name, category, equation, settings) for everything suite measures: the graphs of script, then the corpus."""
+    cases = [("{}:{} {}".format(script, i+1, equation), "script", equation, settings) for i, (equation, settings) in enumerate(read_script(script))]
+    counts = {}
+    for category, equation in corpus():
+        counts[category] = counts.get(category, 0)+1
+        cases.append(("corpus/{}/{}".format(category, counts[category]), category, equation, dict(corpus_settings)))
+    return cases
+
+def best_time(work, repeats = suite_repeats):
+    """The shortest time work takes to run, of repeats runs.
+
+Work quicker than suite_batch is run enough times in a row to take about that long, and timed per call, since timing one call of it is mostly noise."""
+    start = time.perf_counter()
+    work()
+    calls = max(1, int(suite_batch/max(time.perf_counter()-start, 1e-9)))
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        for j in range(calls):
+            work()
+        times.append((time.perf_counter()-start)/calls)
+    return min(times)
+
+def percentiles(latencies, prefix):
+    """Metrics for the latency_percentiles of a list of latencies in seconds, named prefix_p50_us and so on."""
+    values = numpy.percentile(latencies, latency_percentiles)
+    return {"{}_p{}_us".format(prefix, p): value*1e6 for p, value in zip(latency_percentiles, values.tolist())}
+
+def offline_callback_latencies(f, settings):
+    """How long the offline engine's version of the block callback takes for each block of a graph.  See offline.Renderer.plan_blocks."""
+    renderer = offline.Renderer(f, **settings)
+    curve = renderer.curve
+    rows = curve.rows()
+    renderer.restart()
+    latencies = []
+    for i in range(renderer.blocks):
+        start = time.perf_counter()
+        renderer.plan_blocks(i, i+1, rows, 0, curve.length, curve.step)
+        latencies.append(time.perf_counter()-start)
+    return latencies
+
+def realtime_callback_latencies(f, settings, path):
+    """How long Sonifier.model_update takes for each block of a graph, rendered to path."""
+    graph = sonifier.Sonifier(f, **settings)
+    latencies = []
+    def timed(server, block_time):
+        start = time.perf_counter()
+        graph.model_update(server, block_time)
+        latencies.append(time.perf_counter()-start)
+    graph.engine.set_block_callback(timed)
+    graph.write_file(path)
+    graph.shutdown()
+    return latencies
+
+def calibrate():
+    """Milliseconds a fixed mix of Python and NumPy work takes, to tell how fast the machine is running.  See main_compare."""
+    xs = numpy.linspace(-10, 10, 100000)
+    def work():
+        numpy.sin(xs)*numpy.exp(-xs*xs)
+        total = 0.0
+        for i in range(20000):
+            total += i*0.5
+    return best_time(work)*1e3
+
+def have_libaudioverse():
+    try:
+        sonifier.initialize()
+    except ImportError:
+        return False
+    return True
+
+def measure(u, equation, settings, directory, realtime):
+    """Returns the metrics for one graph.  Names end in their unit; x_realtime is how many times faster than realtime, and higher is better.
+
+Compiling is from scratch, as for an equation typed for the first time: parsing with sympy, lambdify, and the whole of Ui.compiled, which tries fastpath first.
+realtime says whether Libaudioverse is available, to measure the realtime engine as well as the offline one."""
+    metrics = {}
+    metrics["parse_ms"] = best_time(lambda: u.expression(equation))*1e3
+    sym = u.expression(equation)
+    metrics["lambdify_ms"] = best_time(lambda: backends.generate(sym, u.x_symbol, "numpy"))*1e3
+    def compile_fresh():
+        u.expressions = expression_cache.ExpressionCache()
+        return u.compiled(equation)
+    metrics["compile_ms"] = best_time(compile_fresh)*1e3
+    f = compile_fresh().f
+    curve = sonifier.Curve(f, duration = settings["duration"], min_x = settings["min_x"], max_x = settings["max_x"],
+        min_y = settings["min_y"], max_y = settings["max_y"], control_interval = settings["control_interval"])
+    metrics["evaluate_ns_per_sample"] = best_time(lambda: sonifier.evaluate(f, curve.x))/len(curve.x)*1e9
+    metrics.update(percentiles(offline_callback_latencies(f, settings), "callback_offline"))
+    path = os.path.join(directory, "suite.wav")
+    audio = offline.Renderer(f, **settings).length/sonifier.sr
+    metrics["render_offline_x_realtime"] = audio/best_time(lambda: offline.Renderer(f, **settings).write_file(path))
+    tracemalloc.start()
+    try:
+        offline.Renderer(f, **settings).write_file(path)
+        metrics["render_offline_peak_mb"] = tracemalloc.get_traced_memory()[1]/1024**2
+    finally:
+        tracemalloc.stop()
+    if realtime:
+        metrics.update(percentiles(realtime_callback_latencies(f, settings, path), "callback_realtime"))
+        def render():
+            graph = sonifier.Sonifier(f, **settings)
+            graph.write_file(path)
+            graph.shutdown()
+        metrics["render_realtime_x_realtime"] = (settings["duration"]+0.5)/best_time(render)
+    return metrics
+
+def higher_is_better(metric):
+    return metric.endswith("_x_realtime")
+
+def geometric_means(cases):
+    """The geometric mean of each metric over cases, for a summary which one slow graph doesn't dominate."""
+    values = {}
+    for case in cases:
+        for metric, value in case["metrics"].items():
+            if value > 0:
+                values.setdefault(metric, []).append(value)
+    return {metric: math.exp(statistics.fmean(math.log(value) for value in found)) for metric, found in values.items()}
+
+def main_suite(args):
+    output = args[0] if args else "benchmark.json"
+    script = args[1] if len(args) > 1 else "demos.txt"
+    realtime = have_libaudioverse()
+    if not realtime:
+        print("Libaudioverse isn't available, so only the offline engine is measured.")
+    u = ui.Ui()
+    cases = []
+    # The first run is slow while caches warm up.
+    calibrate()
+    calibration = [calibrate()]
+    with tempfile.TemporaryDirectory() as directory, numpy.errstate(all = "ignore"):
+        for name, category, equation, settings in suite_cases(script):
+            metrics = measure(u, equation, settings, directory, realtime)
+            cases.append({"name": name, "category": category, "equation": equation, "settings": settings, "metrics": metrics})
+            print("{:<40}{:>10.2f} ms to compile{:>10.1f} ns/sample{:>10.1f}x realtime".format(name, metrics["compile_ms"],
+                metrics["evaluate_ns_per_sample"], metrics["render_offline_x_realtime"]))
+    calibration.append(calibrate())
+    results = {
+        "version": suite_version,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(),
+            "numpy": numpy.__version__, "sympy": __import__("sympy").__version__, "libaudioverse": realtime},
+        "repeats": suite_repeats,
+        # Before and after measuring everything.
+        "calibration_ms": calibration,
+        "cases": cases,
+        "summary": {"all": geometric_means(cases),
+            "by_category": {category: geometric_means([case for case in cases if case["category"] == category])
+                for category in sorted({case["category"] for case in cases})}},
+    }
+    with open(output, "w") as f:
+        json.dump(results, f, indent = 1)
+    print("Results saved to {}.".format(output))
+
+def worse(metric, before, after):
+    """How much worse after is than before, as a fraction.  Negative if it's better."""
+    if before <= 0 or after <= 0:
+        return 0.0
+    return before/after-1 if higher_is_better(metric) else after/before-1
+
+def regressed(old, new, threshold):
+    """Returns a list of (metric, old value, new value, how much worse) for every metric in both dicts which is worse by more than threshold."""
+    found = []
+    for metric in sorted(set(old) & set(new)):
+        change = worse(metric, old[metric], new[metric])
+        if change > threshold:
+            found.append((metric, old[metric], new[metric], change))
+    return found
+
+def main_compare(args):
+    """Regressions are judged on geometric means, which one noisy graph can't swing on its own.
+Both results record how long a fixed workload took before and after, and if the machine's speed changed by more than half the threshold, there's a warning that the timings can't be trusted."""
+    if len(args) not in (2, 3):
+        print(__doc__)
+        sys.exit(1)
+    with open(args[0]) as f:
+        old = json.load(f)
+    with open(args[1]) as f:
+        new = json.load(f)
+    threshold = float(args[2]) if len(args) == 3 else regression_threshold
+    if old["version"] != new["version"]:
+        print("The results are from versions {} and {} of the suite, which measure different things.".format(old["version"], new["version"]))
+        sys.exit(1)
+    # Timings move with the speed of the machine as well as with the code, such as when other work is running.
+    for label, results in (("old", old), ("new", new)):
+        start, end = results["calibration_ms"]
+        if abs(worse("calibration_ms", start, end)) > threshold/2:
+            print("Warning: the machine's speed changed by {:.0%} while the {} results were measured, so they're unreliable.".format(end/start-1, label))
+    speed = worse("calibration_ms", min(old["calibration_ms"]), min(new["calibration_ms"]))
+    if abs(speed) > threshold/2:
+        print("Warning: the machine ran {:.0%} {} for the new results, so timings aren't comparable.".format(abs(speed), "slower" if speed > 0 else "faster"))
+    old_cases = {case["name"]: case for case in old["cases"]}
+    missing = sorted(set(old_cases)-{case["name"] for case in new["cases"]})
+    if missing:
+        print("Only in the old results: "+", ".join(missing))
+    # Single graphs are too noisy to judge on their own, so regressions are judged on the means over each category and over everything.
+    # The graphs behind each one are listed with it.
+    summaries = [("overall", old["summary"]["all"], new["summary"]["all"], None)]
+    for category, means in sorted(new["summary"]["by_category"].items()):
+        if category in old["summary"]["by_category"]:
+            summaries.append((category, old["summary"]["by_category"][category], means, category))
+    regressions = 0
+    for name, before, after, category in summaries:
+        for metric, old_value, new_value, change in regressed(before, after, threshold):
+            regressions += 1
+            print("{}: {} went from {:.4g} to {:.4g}, {:.0%} worse.".format(name, metric, old_value, new_value, change))
+            if category is None:
+                continue
+            for case in new["cases"]:
+                if case["category"] != category or case["name"] not in old_cases:
+                    continue
+                previous = old_cases[case["name"]]["metrics"]
+                if metric in previous and metric in case["metrics"]:
+                    case_change = worse(metric, previous[metric], case["metrics"][metric])
+                    if case_change > threshold:
+                        print("  {}: {:.4g} to {:.4g}, {:.0%} worse.".format(case["name"], previous[metric], case["metrics"][metric], case_change))
+    if regressions:
+        print("{} regressions of more than {:.0%}.".format(regressions, threshold))
+        sys.exit(1)
+    print("No regressions of more than {:.0%}.".format(threshold))
+
+commands = {
+    "callback": main_callback,
+    "engines": main_engines,
+    "startup": main_startup,
+    "multi": main_multi,
+    "mixer": main_mixer,
+    "progressive": main_progressive,
+    "controls": main_controls,
+    "service": main_service,
+    "stream": main_stream,
+    "suite": main_suite,
+    "compare": main_compare,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__)
+        sys.exit(1)
+    commands[sys.argv[1]](sys.argv[2:])
@@ -1,4 +1,7 @@
+import asyncio
+import os
 import sys
+import threading
 import traceback
 
 class CommandParserBase:
@@ -14,17 +17,64 @@ This class implements a .help command for you. You can override it by overriding
 This class also implements a .quit, overridable by implementing do_quit.
 To quit without using the quit command, call quit().
 
-This class does not provide an intro message."""
+This class does not provide an intro message.
+
+The command loop runs on asyncio, reading lines on a separate thread, so subclasses can schedule background work on the event loop while waiting for input.
+Override run_async to set such work up and wait for it to finish.  Ctrl-C cancels run_async's task, then calls quit_hook and ends the process."""
 
     def __init__(self):
         self._running = True
 
     def run(self):
+        try:
+            asyncio.run(self.run_async())
+        except KeyboardInterrupt:
+            print()
+            self.quit_hook()
+            # The reader thread is stuck in input, holding stdin's lock, which would crash the interpreter as it shuts down.
+            # quit_hook has cleaned up, so end the process here instead.
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(130)
+
+    async def run_async(self):
         self._running = True
         while self._running:
-            line = input(self.prompt)
+            try:
+                line = await self.read_line()
+            except EOFError:
+                # The end of piped input.
+                self.do_quit("")
+                break
             self.handle_command(line)
 
+    async def read_line(self):
+        """input(self.prompt), without blocking the event loop.
+
+input can't be interrupted, so it runs on a daemon thread, which the process doesn't wait for if it quits while a line is being read."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        def finish(result, exception):
+            if future.done():
+                return
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        def read():
+            result, exception = None, None
+            try:
+                result = input(self.prompt)
+            except Exception as e:
+                exception = e
+            try:
+                loop.call_soon_threadsafe(finish, result, exception)
+            except RuntimeError:
+                # The loop closed while we were waiting.
+                pass
+        threading.Thread(target = read, daemon = True).start()
+        return await future
+
     def handle_command(self, line):
         if len(line) == 0:
             return
@@ -92,6 +142,11 @@ The syntax of <file> is the same as what you'd type at the terminal, one command
         except FileNotFoundError:
             print("File not found.")
             return
-        for l in f:
-            l = l.replace("\r", "").replace("\n", "")
+        with f:
+            lines = [l.replace("\r", "").replace("\n", "") for l in f]
+        self.run_batch(lines)
+
+    def run_batch(self, lines):
+        """Run the lines of a batch script.  Override to change how scripts are run."""
+        for l in lines:
             self.handle_command(l)
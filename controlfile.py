@@ -0,0 +1,97 @@
+"""Saving graphs as the control events which make them, rather than as audio.
+
+A graph is a few numbers per control update: the tone's frequency and gain, the noise's gain, the panning, and where fades go, plus the ticks.
+That's all offline.Synthesizer needs to make the audio, so a file of those renders exactly the .wav the offline engine writes, at a small fraction of the size.
+
+Usage: python controlfile.py <file.agc> <file.wav>: render a control file to audio.
+
+The format, all little-endian:
+magic, then a 4-byte header length and a JSON header with the settings and the name, count and type of every array, then each array as a 4-byte length and the encoded bytes.
+Arrays are encoded by taking differences between successive elements' bytes as unsigned integers, shuffling the bytes so that all the first bytes come first and so on, and compressing with zlib.
+Controls barely change from one update to the next, so most of the shuffled bytes are zero and compress away.  Decoding reverses each step exactly, so nothing is lost.
+The azimuth is stored as the number of the update which last set it, from which offline.Synthesizer.azimuths works it out again.
+Its angles change smoothly, but their low bytes don't, and wouldn't compress.
+
+Files are only loaded by the version of the offline engine which saved them, since another might render them differently."""
+import json
+import struct
+import sys
+import zlib
+import numpy
+import offline
+
+extension = ".agc"
+magic = b"AGCE"
+# Bump this whenever the format changes.  Files of other versions aren't loaded.
+version = 2
+update_names = ["frequency", "tone_gain", "noise_gain", "azimuth_source", "fade_gain"]
+tick_names = ["sample", "kind", "frequency"]
+unsigned = {1: numpy.uint8, 2: numpy.uint16, 4: numpy.uint32, 8: numpy.uint64}
+
+def encode(array):
+    array = numpy.ascontiguousarray(array, dtype = array.dtype.newbyteorder("<"))
+    bits = array.view(unsigned[array.itemsize])
+    # Unsigned subtraction wraps, so this is undone exactly by a cumulative sum.
+    deltas = numpy.diff(bits, prepend = bits.dtype.type(0))
+    shuffled = deltas.view(numpy.uint8).reshape(-1, array.itemsize).T
+    return zlib.compress(shuffled.tobytes(), 9)
+
+def decode(data, dtype, count):
+    dtype = numpy.dtype(dtype).newbyteorder("<")
+    shuffled = numpy.frombuffer(zlib.decompress(data), dtype = numpy.uint8).reshape(dtype.itemsize, count)
+    deltas = numpy.ascontiguousarray(shuffled.T).view(unsigned[dtype.itemsize]).ravel()
+    return numpy.cumsum(deltas, dtype = deltas.dtype).view(dtype)
+
+def save(synthesizer, file):
+    """Write the control events of an offline.Synthesizer, normally an offline.Renderer, to file."""
+    arrays = [("updates", name, synthesizer.updates[name]) for name in update_names]
+    arrays += [("ticks", name, synthesizer.tick_events[name]) for name in tick_names]
+    header = {"version": version, "offline_version": offline.version,
+        "duration": synthesizer.duration, "block_size": synthesizer.block_size, "control_interval": synthesizer.control_interval,
+        "hrtf": synthesizer.hrtf, "seed": synthesizer.seed, "end_block": synthesizer.end_block,
+        "arrays": [[group, name, array.dtype.str, len(array)] for group, name, array in arrays]}
+    header = json.dumps(header).encode("utf-8")
+    with open(file, "wb") as f:
+        f.write(magic)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        for group, name, array in arrays:
+            data = encode(array)
+            f.write(struct.pack("<I", len(data)))
+            f.write(data)
+
+def load(file):
+    """Returns an offline.Synthesizer ready to render the control file at file.  Raises ValueError if it isn't one we can read."""
+    with open(file, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("{} isn't an audiograph control file.".format(file))
+        length, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length).decode("utf-8"))
+        if header["version"] != version:
+            raise ValueError("{} is version {} of the format, but only version {} can be read.".format(file, header["version"], version))
+        if header["offline_version"] != offline.version:
+            raise ValueError("{} was saved by version {} of the offline engine, but this is version {}.".format(file, header["offline_version"], offline.version))
+        groups = {"updates": {}, "ticks": {}}
+        for group, name, dtype, count in header["arrays"]:
+            length, = struct.unpack("<I", f.read(4))
+            groups[group][name] = decode(f.read(length), dtype, count)
+    synthesizer = offline.Synthesizer(header["duration"], header["block_size"], header["control_interval"], header["hrtf"], header["seed"])
+    updates = groups["updates"]
+    updates["azimuth"] = synthesizer.azimuths(updates["azimuth_source"])
+    synthesizer.prepare(updates, groups["ticks"], header["end_block"])
+    return synthesizer
+
+def main(args):
+    if len(args) != 2:
+        print(__doc__.split("\n\n")[1])
+        return 1
+    try:
+        synthesizer = load(args[0])
+    except (OSError, ValueError, struct.error, zlib.error) as e:
+        print("Couldn't load {}: {}".format(args[0], e))
+        return 1
+    synthesizer.write_file(args[1])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,215 @@
+"""Recorded data, graphed in place of an equation.
+
+Data files can be far bigger than memory, so they're memory-mapped and never read whole.
+Once per file, we build a pyramid of minimums and maximums over blocks of branching samples, then blocks of branching**2, and so on, and save it next to the file.
+NaN values are undefined points.  They're left out of minimums and maximums, so a block is NaN only when all of its values are.
+Graphing a million points over 5 seconds only needs a few thousand values, and the pyramid gives each of them from a level only a few times finer than that.
+
+Supported files:
+.npy: a one-dimensional NumPy array.
+.f32, .f64: raw little-endian float32 or float64 values.
+.csv, .txt: one row per point.  A column is converted to a .f64 file next to the original on first use, a chunk at a time."""
+import csv
+import os
+import tempfile
+import numpy
+
+# Each level of the pyramid summarizes this many entries of the level below it.
+branching = 16
+# Rows of a CSV file converted at a time, and values of a level processed at a time while building the pyramid.
+chunk_size = 1<<20
+# Bump this whenever what a pyramid holds changes, so that saved ones are rebuilt.
+pyramid_version = 2
+raw_types = {".f32": "<f4", ".f64": "<f8"}
+
+def sidecar(path, suffix):
+    """Where to keep something derived from path: next to it if we can write there, otherwise the temporary directory."""
+    path = os.path.abspath(path)
+    directory = os.path.dirname(path)
+    if not os.access(directory, os.W_OK):
+        directory = tempfile.gettempdir()
+    return os.path.join(directory, os.path.basename(path)+suffix)
+
+def up_to_date(derived, path):
+    return os.path.exists(derived) and os.path.getmtime(derived) >= os.path.getmtime(path)
+
+def convert_csv(path, column = -1):
+    """Convert one column of a CSV file to raw float64, returning the new file's path.  Rows which don't parse, such as headers, are skipped."""
+    destination = sidecar(path, ".{}.f64".format(column))
+    if up_to_date(destination, path):
+        return destination
+    directory = os.path.dirname(destination)
+    fd, temporary = tempfile.mkstemp(prefix = ".", dir = directory)
+    with os.fdopen(fd, "wb") as out, open(path, newline = "") as f:
+        values = []
+        for row in csv.reader(f):
+            try:
+                values.append(float(row[column]))
+            except (ValueError, IndexError):
+                continue
+            if len(values) == chunk_size:
+                out.write(numpy.array(values, dtype = "<f8").tobytes())
+                values = []
+        out.write(numpy.array(values, dtype = "<f8").tobytes())
+    # mkstemp makes files only we can read.
+    os.chmod(temporary, 0o644)
+    os.replace(temporary, destination)
+    return destination
+
+def open_values(path, column = -1):
+    """Memory-map the values in a data file, as a one-dimensional array."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        values = numpy.load(path, mmap_mode = "r")
+    elif extension in raw_types:
+        values = numpy.memmap(path, dtype = raw_types[extension], mode = "r")
+    elif extension in {".csv", ".txt"}:
+        converted = convert_csv(path, column)
+        if os.path.getsize(converted) == 0:
+            raise ValueError("There are no numbers in column {}.".format(column))
+        values = numpy.memmap(converted, dtype = "<f8", mode = "r")
+    else:
+        raise ValueError("Data files must be .npy, .f32, .f64, .csv or .txt.")
+    if values.ndim != 1:
+        raise ValueError("Data must be one-dimensional.")
+    if len(values) == 0:
+        raise ValueError("There's no data.")
+    return values
+
+def level_sizes(count):
+    """The number of entries in each level of the pyramid for count values, finest first."""
+    sizes = []
+    while count > 1:
+        count = -(-count//branching)
+        sizes.append(count)
+    return sizes
+
+class Pyramid:
+    """Minimums and maximums of values, over blocks of branching**level values for every level from 1 up.
+
+The levels are stored one after another in a single (entries, 2) array, memory-mapped from a .pyramid<version>.npy file which is rebuilt if values' file changes.
+levels[i] is the view for blocks of branching**(i+1) values."""
+
+    def __init__(self, values, path):
+        sizes = level_sizes(len(values))
+        total = max(sum(sizes), 1)
+        location = sidecar(path, ".pyramid{}.npy".format(pyramid_version))
+        data = None
+        if up_to_date(location, path):
+            try:
+                data = numpy.load(location, mmap_mode = "r")
+            except ValueError:
+                pass
+            if data is not None and data.shape != (total, 2):
+                data = None
+        if data is None:
+            data = self.build(values, sizes, total, location)
+        self.levels = []
+        offset = 0
+        for size in sizes:
+            self.levels.append(data[offset:offset+size])
+            offset += size
+
+    def build(self, values, sizes, total, location):
+        directory = os.path.dirname(location)
+        fd, temporary = tempfile.mkstemp(prefix = ".", suffix = ".npy", dir = directory)
+        os.close(fd)
+        data = numpy.lib.format.open_memmap(temporary, mode = "w+", dtype = values.dtype, shape = (total, 2))
+        below_min = below_max = values
+        offset = 0
+        for size in sizes:
+            level = data[offset:offset+size]
+            step = chunk_size-chunk_size%branching
+            for start in range(0, len(below_min), step):
+                low = numpy.asarray(below_min[start:start+step])
+                high = numpy.asarray(below_max[start:start+step])
+                blocks = numpy.arange(0, len(low), branching)
+                first = start//branching
+                level[first:first+len(blocks), 0] = numpy.fmin.reduceat(low, blocks)
+                level[first:first+len(blocks), 1] = numpy.fmax.reduceat(high, blocks)
+            below_min, below_max = level[:, 0], level[:, 1]
+            offset += size
+        data.flush()
+        del data
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, location)
+        return numpy.load(location, mmap_mode = "r")
+
+class DataSource:
+    """A data file, usable anywhere an equation's f is.
+
+x is the index of a value, from 0 to count-1.  Between values, f interpolates linearly; outside them, f is undefined.
+When f is asked for many evenly spaced points at once, as sonifier.Curve does, and they're further apart than the values,
+each point gets the middle of the range of the values nearest it, read from the coarsest level of the pyramid which is still fine enough.
+A point is undefined (NaN) when the values nearest it are, or, between values, when either neighbour is."""
+
+    def __init__(self, path, column = -1):
+        self.path = path
+        self.column = column
+        self.values = open_values(path, column)
+        self.count = len(self.values)
+        # For CSV files, this is the converted file.
+        self.pyramid = Pyramid(self.values, self.values.filename)
+        if self.pyramid.levels:
+            top = self.pyramid.levels[-1]
+            self.min, self.max = float(top[0, 0]), float(top[0, 1])
+        else:
+            self.min = self.max = float(self.values[0])
+
+    def __call__(self, x):
+        x = numpy.asarray(x, dtype = float)
+        if x.ndim == 0:
+            return self.interpolate(x.reshape(1))[0]
+        spacing = self.spacing(x)
+        if spacing > 1:
+            low, high = self.ranges(x, spacing)
+            return (low+high)/2
+        return self.interpolate(x)
+
+    def spacing(self, x):
+        """The distance between the points of x if they're evenly spaced and increasing, otherwise 0."""
+        if len(x) < 2:
+            return 0
+        steps = numpy.diff(x)
+        spacing = (x[-1]-x[0])/(len(x)-1)
+        if spacing <= 0 or not numpy.allclose(steps, spacing, rtol = 1e-6, atol = 0):
+            return 0
+        return spacing
+
+    def interpolate(self, x):
+        out = numpy.full(len(x), numpy.nan)
+        inside = (x >= 0) & (x <= self.count-1)
+        position = x[inside]
+        below = numpy.minimum(numpy.floor(position).astype(numpy.int64), self.count-1)
+        above = numpy.minimum(below+1, self.count-1)
+        fraction = position-below
+        # Fancy indexing a memmap only reads the pages it touches.
+        low, high = self.values[below].astype(float), self.values[above].astype(float)
+        out[inside] = low+(high-low)*fraction
+        return out
+
+    def ranges(self, x, spacing):
+        """The minimum and maximum of the values within spacing/2 of each point in x, which are evenly spaced and increasing."""
+        low = numpy.full(len(x), numpy.nan)
+        high = numpy.full(len(x), numpy.nan)
+        starts = numpy.clip(numpy.ceil(x-spacing/2), 0, self.count)
+        stops = numpy.clip(numpy.floor(x+spacing/2)+1, 0, self.count)
+        inside = stops > starts
+        if not inside.any():
+            return low, high
+        starts, stops = starts[inside].astype(numpy.int64), stops[inside].astype(numpy.int64)
+        # The coarsest level whose blocks fit in a bucket.  Bucket edges are rounded down to whole blocks, moving them by less than a block.
+        level = 0
+        while level < len(self.pyramid.levels) and branching**(level+1) <= spacing:
+            level += 1
+        if level == 0:
+            minimums = maximums = self.values
+        else:
+            entries = self.pyramid.levels[level-1]
+            minimums, maximums = entries[:, 0], entries[:, 1]
+        block = branching**level
+        first, last = starts[0]//block, -(-stops[-1]//block)
+        edges = starts//block-first
+        low[inside] = numpy.fmin.reduceat(numpy.asarray(minimums[first:last], dtype = float), edges)
+        high[inside] = numpy.fmax.reduceat(numpy.asarray(maximums[first:last], dtype = float), edges)
+        return low, high
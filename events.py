@@ -0,0 +1,131 @@
+"""Exact times for ticks.
+
+Checking for ticks once per block puts them on a grid of block_duration, about 3 milliseconds.
+Instead, we find where the curve crosses each tick before playback: x ticks are known exactly, since x moves linearly with time,
+and y and zero crossings are bracketed between samples of the curve and then refined by bisection.
+The result is a timeline which the renderers play at the exact sample it calls for."""
+import numpy
+
+x_tick = 0
+y_tick = 1
+zero_tick = 2
+# Bisection halves the bracket this many times.  Brackets start a block wide, so this is far below a sample.
+refinements = 40
+
+def x_crossings(x, x_ticks):
+    """The first multiple of x_ticks in each interval (x[i], x[i+1]] between the increasing samples x, wherever there is one.
+
+Like every ticker, x ticks at most once per control update: a spacing finer than that ticks once per update, rather than once per multiple."""
+    cells = numpy.floor(x/x_ticks)
+    crossed = cells[1:] != cells[:-1]
+    return (cells[:-1][crossed]+1)*x_ticks
+
+def refine(f, low, high, level, evaluate):
+    """Find where f crosses level between low and high, for arrays of brackets at once.
+
+f(low)-level and f(high)-level must have opposite signs, or one must be 0.
+Returns (x, found).  found is False where the bracket turned out to hold a pole or an undefined region rather than a crossing."""
+    y_low, defined = evaluate(f, low)
+    y_high, defined_high = evaluate(f, high)
+    start_error = numpy.maximum(numpy.abs(y_low-level), numpy.abs(y_high-level))
+    low_sign = numpy.sign(y_low-level)
+    ok = defined & defined_high
+    for i in range(refinements):
+        middle = (low+high)/2
+        y, defined = evaluate(f, middle)
+        ok &= defined
+        same = numpy.sign(y-level) == low_sign
+        low = numpy.where(same, middle, low)
+        high = numpy.where(same, high, middle)
+    x = (low+high)/2
+    y, defined = evaluate(f, x)
+    # At a pole, the curve changes sign without crossing, and the error grows instead of shrinking.
+    found = ok & defined & (numpy.abs(y-level) <= start_error)
+    return x, found
+
+def level_crossings(f, x, y, defined, step, evaluate):
+    """Find where the sampled curve crosses multiples of step (or zero, if step is None).
+
+Returns (x of each crossing, the level crossed).  There's at most one crossing between each pair of samples: the first level crossed."""
+    usable = defined[:-1] & defined[1:] & numpy.isfinite(y[:-1]) & numpy.isfinite(y[1:])
+    y0, y1 = y[:-1], y[1:]
+    if step is None:
+        s0, s1 = numpy.sign(y0), numpy.sign(y1)
+        touched = usable & (s0 != 0) & (s1 == 0)
+        crossed = usable & (numpy.abs(s0-s1) > 1)
+        levels = numpy.zeros(crossed.sum())
+    else:
+        with numpy.errstate(invalid = "ignore"):
+            cell0, cell1 = y0//step, y1//step
+        touched = numpy.zeros(len(y0), dtype = bool)
+        crossed = usable & (cell0 != cell1)
+        # The first boundary crossed, leaving the cell y0 is in.
+        levels = numpy.where(y1 > y0, (cell0+1)*step, cell0*step)[crossed]
+    positions = [x[1:][touched]]
+    found_levels = [numpy.zeros(touched.sum())]
+    if crossed.any():
+        roots, found = refine(f, x[:-1][crossed], x[1:][crossed], levels, evaluate)
+        positions.append(roots[found])
+        found_levels.append(levels[found])
+    return numpy.concatenate(positions), numpy.concatenate(found_levels)
+
+class Timeline:
+    """Ticks sorted by time.
+
+times: seconds from the start of the graph.
+kinds: x_tick, y_tick or zero_tick.
+levels: the value of y at the tick, for y and zero ticks.
+frequencies: the pitch of the tick.
+
+The same data is also available as plain lists (time_list and so on) for the block callback, which is faster than indexing arrays."""
+
+    def __init__(self, times, kinds, levels, frequencies):
+        order = numpy.argsort(times, kind = "stable")
+        self.times = times[order]
+        self.kinds = kinds[order]
+        self.levels = levels[order]
+        self.frequencies = frequencies[order]
+        self.time_list = self.times.tolist()
+        self.kind_list = self.kinds.tolist()
+        self.level_list = self.levels.tolist()
+        self.frequency_list = self.frequencies.tolist()
+
+    def __len__(self):
+        return len(self.times)
+
+def timeline(f, curve, duration, min_x, max_x, min_y, max_y, x_ticks, y_ticks, zero_ticks, evaluate, frequency, crossings = None):
+    """Build the Timeline for a curve.  evaluate is sonifier.evaluate, or a wrapper recording stats.
+frequency maps an array of levels to the pitches of their ticks.
+crossings, if given, is a dict of level crossings already found, by (kind, step).  Missing ones are found and added to it.
+
+Ticks whose level is outside [min_y, max_y] are dropped: the graph is silent there."""
+    end = curve.x[-1]
+    times, kinds, levels = [], [], []
+    def add(xs, kind, ys):
+        times.append((xs-min_x)/(max_x-min_x)*duration)
+        kinds.append(numpy.full(len(xs), kind))
+        levels.append(ys)
+    if x_ticks:
+        xs = x_crossings(curve.x, x_ticks)
+        add(xs, x_tick, numpy.zeros(len(xs)))
+    for kind, enabled, step in ((y_tick, y_ticks, y_ticks), (zero_tick, zero_ticks, None)):
+        if not enabled:
+            continue
+        if crossings is not None and (kind, step) in crossings:
+            xs, ys = crossings[kind, step]
+        else:
+            xs, ys = level_crossings(f, curve.x, curve.y, curve.defined, step, evaluate)
+            if crossings is not None:
+                crossings[kind, step] = (xs, ys)
+        # Crossings from a curve which went further are cut off at the end of this one.
+        audible = (min_y <= ys) & (ys <= max_y) & (xs <= end)
+        add(xs[audible], kind, ys[audible])
+    if not times:
+        return Timeline(numpy.zeros(0), numpy.zeros(0, dtype = int), numpy.zeros(0), numpy.zeros(0))
+    levels = numpy.concatenate(levels)
+    return Timeline(numpy.concatenate(times), numpy.concatenate(kinds), levels, frequency(levels))
+
+def merge(timelines):
+    """Combine several Timelines into one."""
+    return Timeline(numpy.concatenate([t.times for t in timelines]), numpy.concatenate([t.kinds for t in timelines]),
+        numpy.concatenate([t.levels for t in timelines]), numpy.concatenate([t.frequencies for t in timelines]))
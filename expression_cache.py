@@ -0,0 +1,146 @@
+"""A cache of compiled equations.
+
+Parsing with sympy and lambdifying can take hundreds of milliseconds for larger expressions.  We remember the result by the equation as typed,
+and by the canonical form of the parsed expression so that different spellings of the same thing share one compiled function.
+
+The cache can be saved to disk between sessions as the source code lambdify generated, which is recompiled on first use."""
+import collections
+import inspect
+import json
+import os
+import tempfile
+import backends
+import fastpath
+
+default_size = 256
+generated_name = backends.generated_name
+
+def default_path():
+    """$AUDIOGRAPH_EXPRESSIONS if set, otherwise .cache/audiograph_expressions.json in the home directory."""
+    path = os.environ.get("AUDIOGRAPH_EXPRESSIONS")
+    if path:
+        return path
+    return os.path.join(os.path.expanduser("~"), ".cache", "audiograph_expressions.json")
+
+class Compiled:
+    """A compiled equation.
+
+form: the srepr of the parsed sympy expression, prefixed with the backend if one was asked for.  See Ui.compiled.
+raw: the function lambdify generated.
+source: the source code of raw, if we have it.
+backend: the name of the backend in backends which raw was generated for."""
+
+    def __init__(self, form, raw = None, source = None, backend = "numpy"):
+        self.form = form
+        self._raw = raw
+        self._source = source
+        self.backend = backend
+        self._f = None
+
+    @property
+    def f(self):
+        """The callable, ready for sonifier.evaluate."""
+        if self._f is None:
+            self._f = backends.wrap(self.backend, self.raw)
+        return self._f
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            if self.form.startswith(fastpath.prefix):
+                code = dict(fastpath.namespace)
+            else:
+                code = dict(backends.namespace(self.backend))
+            exec(self._source, code)
+            self._raw = code[generated_name]
+        return self._raw
+
+    @property
+    def source(self):
+        if self._source is None:
+            self._source = inspect.getsource(self._raw)
+        return self._source
+
+class ExpressionCache:
+    """An LRU cache of Compiled, holding at most size equations and size canonical forms."""
+
+    def __init__(self, size = default_size):
+        self.size = size
+        self.equations = collections.OrderedDict()
+        self.forms = collections.OrderedDict()
+        self.hits = 0
+        self.form_hits = 0
+        self.misses = 0
+
+    def get(self, equation):
+        """Returns the Compiled for an equation as typed, or None."""
+        compiled = self.equations.get(equation)
+        if compiled is None:
+            return
+        self.hits += 1
+        self.equations.move_to_end(equation)
+        if compiled.form in self.forms:
+            self.forms.move_to_end(compiled.form)
+        return compiled
+
+    def get_form(self, form):
+        """Returns the Compiled for a canonical form, or None.  Call this after get misses."""
+        compiled = self.forms.get(form)
+        if compiled is None:
+            self.misses += 1
+            return
+        self.form_hits += 1
+        self.forms.move_to_end(form)
+        return compiled
+
+    def put(self, equation, compiled):
+        self.equations[equation] = compiled
+        self.equations.move_to_end(equation)
+        self.forms[compiled.form] = compiled
+        self.forms.move_to_end(compiled.form)
+        self.trim()
+
+    def trim(self):
+        while len(self.equations) > self.size:
+            self.equations.popitem(last = False)
+        while len(self.forms) > self.size:
+            self.forms.popitem(last = False)
+
+    def clear(self):
+        self.equations.clear()
+        self.forms.clear()
+
+    def save(self, path):
+        """Write the cache to path, atomically."""
+        data = {"version": 2,
+            "equations": {equation: compiled.form for equation, compiled in self.equations.items()},
+            "forms": {form: [compiled.backend, compiled.source] for form, compiled in self.forms.items()}}
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok = True)
+        fd, temporary = tempfile.mkstemp(prefix = ".", dir = directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        """Add everything saved at path.  A missing or unreadable file is ignored."""
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        version = data.get("version")
+        if version == 1:
+            # Everything was compiled for NumPy.
+            forms = {form: Compiled(form, source = source) for form, source in data["forms"].items()}
+        elif version == 2:
+            forms = {form: Compiled(form, source = source, backend = backend) for form, (backend, source) in data["forms"].items()}
+        else:
+            return
+        for form, compiled in forms.items():
+            if form not in self.forms:
+                self.forms[form] = compiled
+        for equation, form in data["equations"].items():
+            if equation not in self.equations and form in self.forms:
+                self.equations[equation] = self.forms[form]
+        self.trim()
@@ -0,0 +1,294 @@
+"""A compiler for common equations which doesn't need sympy.
+
+Importing sympy takes seconds on a cold start, and parsing with it isn't quick either.
+Most equations people type only use numbers, x, pi, E, arithmetic, ** and a few functions, so we parse those ourselves and generate a NumPy function directly.
+Anything else makes compile return None, and the caller falls back to sympy.
+
+The grammar follows Python, and so sympy's parser, including implicit multiplication: 2x, 2(x+1), (x+1)(x-1), x sin(x).
+Function exponentiation (sin**2(x)), ^ and anything else sympy would treat specially aren't handled here.
+
+sympy also simplifies as it builds expressions, which can change where a graph is defined: x/x is 1 even at 0, sqrt(x)**2 and exp(ln(x)) are x even where x is negative.
+So that graphs sound the same either way, equations where that could happen go to sympy too:
+a power of a power or of sqrt, or of a product with one in it, a function of its inverse, such as exp(ln(x)) or sin(atan(x)), exp or E to the power of anything with a log as a factor, such as exp(2ln(x)),
+and a product or sum with a base or term which appears more than once, such as x/x, x/sqrt(x), exp(x)*exp(-x) or 1/x-1/x."""
+import math
+import re
+import numpy
+
+# Compiled forms start with this, so they're never confused with sympy's srepr.
+prefix = "fast:"
+# The same name lambdify uses, so that expression_cache can treat our source like lambdify's.
+generated_name = "_lambdifygenerated"
+functions = {
+    "sin": "sin", "cos": "cos", "tan": "tan",
+    "asin": "arcsin", "acos": "arccos", "atan": "arctan",
+    "sinh": "sinh", "cosh": "cosh", "tanh": "tanh",
+    "asinh": "arcsinh", "acosh": "arccosh", "atanh": "arctanh",
+    "exp": "exp", "ln": "log", "log": "log", "sqrt": "sqrt",
+    "abs": "absolute", "Abs": "absolute",
+}
+constants = {"pi": repr(math.pi), "E": repr(math.e)}
+# sympy simplifies functions applied straight to their inverses, and trigonometric functions of any inverse in the same family: sin(atan(x)) is x/sqrt(x**2+1).
+circular = {"arcsin", "arccos", "arctan"}
+hyperbolic = {"arcsinh", "arccosh", "arctanh"}
+inverses = {"exp": {"log"}, "sin": circular, "cos": circular, "tan": circular, "sinh": hyperbolic, "cosh": hyperbolic, "tanh": hyperbolic}
+namespace = {name: getattr(numpy, name) for name in set(functions.values())}
+token_pattern = re.compile(r"\s*(?:(?P<number>\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|(?P<name>[A-Za-z_][A-Za-z0-9_]*)|(?P<operator>\*\*|[-+*/()]))")
+
+class Unsupported(Exception):
+    """The equation is outside what we handle.  Not an error: sympy gets a turn."""
+    pass
+
+def tokenize(equation):
+    tokens = []
+    position = 0
+    equation = equation.rstrip()
+    while position < len(equation):
+        match = token_pattern.match(equation, position)
+        if match is None:
+            raise Unsupported(equation[position:])
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+class Parser:
+    """Recursive descent, producing Python source for the expression.
+
+expression := term (("+" | "-") term)*
+term := unary (("*" | "/" | implicit) unary)*
+unary := ("+" | "-") unary | power
+power := primary ("**" unary)?
+primary := number | "x" | constant | function "(" expression ")" | "(" expression ")"
+
+Implicit multiplication happens whenever a primary directly follows another one."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        # What sympy would make of the pieces of source made so far, for spotting what it would simplify.  See like.
+        # The function each call calls and its argument, what each negation and power is of, and which sources are powers and numbers.
+        self.calls = {}
+        self.arguments = {}
+        self.negations = {}
+        self.bases = {}
+        self.powers = set()
+        self.numbers = set()
+        # For each term, its factors as like gives them and as they are, each with whether it divides.  For each sum, its terms, each as its factors as they are.
+        self.factors = {}
+        self.monomials = {}
+        self.terms = {}
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, value = None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise Unsupported(value)
+        self.position += 1
+        return token
+
+    def starts_primary(self):
+        kind, value = self.peek()
+        return kind in {"number", "name"} or value == "("
+
+    def parse(self):
+        source = self.expression()
+        if self.position != len(self.tokens):
+            raise Unsupported(self.peek()[1])
+        return source
+
+    def like(self, source):
+        """What sympy would collect source with, as a factor of a product: the thing it's a power of, leaving out negation, with sqrt and exp counting as powers.
+
+Numbers and powers of numbers which don't involve x give None, since sympy combining those doesn't change where anything is defined."""
+        while True:
+            if source in self.negations:
+                source = self.negations[source]
+            elif source in self.bases:
+                source = self.bases[source]
+            elif self.calls.get(source) == "sqrt":
+                source = self.arguments[source]
+            else:
+                break
+        if source in self.numbers:
+            return
+        if self.calls.get(source) == "exp" or source == constants["E"]:
+            return "exp"
+        return source
+
+    def expression(self):
+        source = self.term()
+        terms = self.sum_terms(source)
+        while self.peek()[1] in {"+", "-"}:
+            operator = self.take()[1]
+            term = self.term()
+            terms += self.sum_terms(term)
+            source = "({}{}{})".format(source, operator, term)
+        # sympy adds like terms, leaving out their numbers: 2/x-1/x is 1/x, so it's infinite at 0 rather than undefined.
+        terms = [term for term in terms if term]
+        if len(set(terms)) < len(terms):
+            raise Unsupported(source)
+        self.terms[source] = terms
+        if not terms:
+            self.numbers.add(source)
+        return source
+
+    def sum_terms(self, term):
+        """The terms sympy would see term as in a sum, each as its factors other than numbers: several if it's a parenthesized sum, which sympy flattens."""
+        factors = self.monomials[term]
+        if len(factors) == 1 and not factors[0][1] and factors[0][0] in self.terms:
+            return list(self.terms[factors[0][0]])
+        return [factors]
+
+    def term(self):
+        source = self.unary()
+        factors = self.term_factors(source, False)
+        monomial = self.monomial_factors(source, False)
+        while True:
+            if self.peek()[1] in {"*", "/"}:
+                operator = self.take()[1]
+            elif self.starts_primary():
+                operator = "*"
+            else:
+                break
+            operand = self.unary()
+            # Python's float division raises for 0, where sympy's gives complex infinity.
+            if operator == "/" and operand in self.numbers and self.value(operand) == 0:
+                raise Unsupported(operand)
+            factors += self.term_factors(operand, operator == "/")
+            monomial += self.monomial_factors(operand, operator == "/")
+            source = "({}{}{})".format(source, operator, operand)
+        # sympy collects like factors: x/x is 1, and sqrt(x)*sqrt(x) is x.
+        bases = [base for base, divides in factors]
+        if len(set(bases)) < len(bases):
+            raise Unsupported(source)
+        self.factors[source] = tuple(sorted(factors))
+        self.monomials[source] = tuple(sorted(monomial))
+        if not monomial:
+            self.numbers.add(source)
+        return source
+
+    def term_factors(self, operand, divides):
+        """The factors sympy would see operand as in a product, with whether each divides: several if it's a parenthesized product, which sympy flattens."""
+        base = self.like(operand)
+        if base is None:
+            return []
+        if base in self.factors:
+            return [(factor, inner != divides) for factor, inner in self.factors[base]]
+        return [(base, divides)]
+
+    def monomial_factors(self, operand, divides):
+        """The same as term_factors, but leaving powers and sqrt as they are, for telling like terms of a sum apart."""
+        while operand in self.negations:
+            operand = self.negations[operand]
+        if operand in self.numbers:
+            return []
+        if operand in self.monomials:
+            return [(factor, inner != divides) for factor, inner in self.monomials[operand]]
+        return [(operand, divides)]
+
+    def value(self, source):
+        """The value of source, which doesn't involve x.  Raises Unsupported unless it's finite, as for 0**-1 or 10**400, which Python's floats raise for and sympy doesn't."""
+        try:
+            with numpy.errstate(all = "ignore"):
+                value = eval(source, dict(namespace))
+        except ArithmeticError:
+            raise Unsupported(source)
+        if not numpy.isfinite(value):
+            raise Unsupported(source)
+        return value
+
+    def has_log(self, exponent):
+        """Whether exponent has a log as a factor of it, or of one of its terms: sympy takes those out of exp, so exp(2*ln(x)) is x**2."""
+        terms = self.terms.get(exponent) or [self.monomial_factors(exponent, False)]
+        return any(self.calls.get(factor) == "log" for term in terms for factor, divides in term)
+
+    def unary(self):
+        if self.peek()[1] in {"+", "-"}:
+            operator = self.take()[1]
+            operand = self.unary()
+            source = "({}{})".format(operator, operand)
+            self.negations[source] = operand
+            if operand in self.numbers:
+                self.numbers.add(source)
+            return source
+        return self.power()
+
+    def power(self):
+        source = self.primary()
+        if self.peek()[1] == "**":
+            # sympy multiplies the exponents of a power of a power, and sqrt is a power.  It also raises each factor of a product to an integer power.
+            factors = [source]+[factor for factor, divides in self.monomial_factors(source, False)]
+            if any(factor in self.powers or self.calls.get(factor) == "sqrt" for factor in factors):
+                raise Unsupported("**")
+            self.take()
+            exponent = self.unary()
+            if source == constants["E"] and self.has_log(exponent):
+                raise Unsupported(exponent)
+            base = source
+            source = "({}**{})".format(base, exponent)
+            self.powers.add(source)
+            if base in self.numbers and exponent in self.numbers:
+                self.value(source)
+                self.numbers.add(source)
+            elif base not in self.numbers:
+                self.bases[source] = base
+        return source
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == "number":
+            source = repr(float(value))
+            self.numbers.add(source)
+            return source
+        if kind == "name":
+            if value == "x":
+                return "x"
+            if value in constants:
+                source = constants[value]
+                if value != "E":
+                    self.numbers.add(source)
+                return source
+            if value in functions:
+                self.take("(")
+                argument = self.expression()
+                self.take(")")
+                # sympy's exp(log(x)) is x, and its sin(atan(x)) is x/sqrt(x**2+1).
+                if self.calls.get(argument) in inverses.get(functions[value], ()) or (functions[value] == "exp" and self.has_log(argument)):
+                    raise Unsupported(value)
+                source = "{}({})".format(functions[value], argument)
+                self.calls[source] = functions[value]
+                self.arguments[source] = argument
+                if argument in self.numbers:
+                    self.value(source)
+                    self.numbers.add(source)
+                return source
+            raise Unsupported(value)
+        if value == "(":
+            source = self.expression()
+            self.take(")")
+            return source
+        raise Unsupported(value)
+
+def source(equation):
+    """Returns the Python source for a function computing equation, or None if we can't handle it."""
+    try:
+        body = Parser(tokenize(equation)).parse()
+    except (Unsupported, RecursionError):
+        return
+    return "def {}(x):\n    return {}\n".format(generated_name, body)
+
+def compile(equation):
+    """Returns (form, source, f) for equation, or None if it needs sympy.
+
+form identifies the expression for caching; equations which differ only in spacing share it."""
+    code = source(equation)
+    if code is None:
+        return
+    scope = dict(namespace)
+    exec(code, scope)
+    return prefix+code.partition("return ")[2].strip(), code, scope[generated_name]
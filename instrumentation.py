@@ -0,0 +1,112 @@
+"""Timing for graphs: how long the block callback takes against its deadline, how long evaluating f takes, and what f raised.
+
+This is cheap enough to leave on all the time.  Recording a callback is two clock reads, a bisect and a few additions."""
+import bisect
+import collections
+import time
+
+# Upper edges of the histogram buckets, in seconds.  Anything slower lands in a final overflow bucket.
+bucket_edges = [float("{}e{}".format(i, e)) for e in range(-6, -1) for i in (1, 2, 5)]
+
+def format_duration(seconds):
+    if seconds < 1e-3:
+        return "{:.0f} us".format(seconds*1e6)
+    return "{:.2f} ms".format(seconds*1e3)
+
+class Stats:
+    """Counters for one graph.
+
+deadline is the time the block callback has per block, normally sonifier.block_duration."""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.callbacks = 0
+        self.callback_time = 0.0
+        self.slowest = 0.0
+        self.overruns = 0
+        self.histogram = [0]*(len(bucket_edges)+1)
+        self.evaluation_time = 0.0
+        self.evaluations = 0
+        self.precompute_time = 0.0
+        self.render_time = 0.0
+        self.exceptions = collections.Counter()
+
+    def record_callback(self, elapsed):
+        self.callbacks += 1
+        self.callback_time += elapsed
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+        if elapsed > self.deadline:
+            self.overruns += 1
+        self.histogram[bisect.bisect_left(bucket_edges, elapsed)] += 1
+
+    def record_exception(self, exception):
+        """Note an exception from f which we swallowed."""
+        self.exceptions[type(exception).__name__] += 1
+
+    def evaluation_share(self):
+        """The fraction of all the time spent computing the graph which was spent in f."""
+        total = self.precompute_time+self.callback_time+self.render_time
+        if total == 0:
+            return 0.0
+        return self.evaluation_time/total
+
+    def to_dict(self):
+        """Everything, in a form suitable for json."""
+        return {
+            "deadline": self.deadline,
+            "callbacks": self.callbacks,
+            "callback_time": self.callback_time,
+            "slowest_callback": self.slowest,
+            "overruns": self.overruns,
+            "histogram": {"edges": bucket_edges, "counts": self.histogram},
+            "evaluations": self.evaluations,
+            "evaluation_time": self.evaluation_time,
+            "precompute_time": self.precompute_time,
+            "render_time": self.render_time,
+            "evaluation_share": self.evaluation_share(),
+            "exceptions": dict(self.exceptions),
+        }
+
+    def report(self):
+        """A description for people, as a list of lines."""
+        lines = []
+        lines.append("Evaluated f at {} points in {}, of {} spent precomputing.".format(self.evaluations,
+            format_duration(self.evaluation_time), format_duration(self.precompute_time)))
+        if self.render_time:
+            lines.append("Rendering took {}.".format(format_duration(self.render_time)))
+        if self.callbacks:
+            lines.append("{} block callbacks, averaging {} and at most {}.  The deadline is {}.".format(self.callbacks,
+                format_duration(self.callback_time/self.callbacks), format_duration(self.slowest), format_duration(self.deadline)))
+            lines.append("{} callbacks missed the deadline.".format(self.overruns))
+            previous = 0.0
+            for edge, count in zip(bucket_edges+[None], self.histogram):
+                if count:
+                    if edge is None:
+                        lines.append("  over {}: {}".format(format_duration(previous), count))
+                    else:
+                        lines.append("  {} to {}: {}".format(format_duration(previous), format_duration(edge), count))
+                if edge is not None:
+                    previous = edge
+        lines.append("{:.0%} of the time was spent in f.".format(self.evaluation_share()))
+        if self.exceptions:
+            lines.append("f raised: "+", ".join("{} ({})".format(name, count) for name, count in sorted(self.exceptions.items())))
+        return lines
+
+class Timer:
+    """A context manager which adds the time spent in it to an attribute of a Stats.
+
+with Timer(stats, "evaluation_time"): ..."""
+
+    def __init__(self, stats, attribute):
+        self.stats = stats
+        self.attribute = attribute
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.stats is not None:
+            elapsed = time.perf_counter()-self.start
+            setattr(self.stats, self.attribute, getattr(self.stats, self.attribute)+elapsed)
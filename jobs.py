@@ -0,0 +1,133 @@
+"""A queue of background jobs, for rendering files without blocking the prompt.
+
+The queue lives on the command loop's asyncio event loop.  Jobs run on threads from the loop's default executor, at most workers at a time, and report back to the loop when they finish.
+Rendering is mostly NumPy or Libaudioverse, which release the GIL, so the prompt and playback stay responsive."""
+import asyncio
+import collections
+
+class Job:
+    """One job.
+
+id: the number .cancel uses.
+description: what the job is, normally the file it writes.
+work: a callable which does the job.  It's given the Job, and should call attach with the graph it renders so that progress and cancel reach it.
+If work raises, the job failed.  Reporting why is up to work.
+state: "queued", "running", "done", "failed" or "cancelled"."""
+
+    def __init__(self, id, description, work):
+        self.id = id
+        self.description = description
+        self.work = work
+        self.state = "queued"
+        self.cancelled = False
+        self.graph = None
+
+    def attach(self, graph):
+        """Called by work with the graph it's about to render."""
+        self.graph = graph
+        if self.cancelled:
+            graph.cancel()
+
+    def progress(self):
+        """How far along the job is, from 0 to 1."""
+        if self.state == "done":
+            return 1.0
+        if self.graph is None:
+            return 0.0
+        return self.graph.progress()
+
+    def cancel(self):
+        self.cancelled = True
+        if self.graph is not None:
+            self.graph.cancel()
+
+    def run(self):
+        self.work(self)
+
+class JobQueue:
+    """Runs jobs in the background, at most workers at once.  Every method must be called from the event loop's thread."""
+
+    def __init__(self, workers = 1):
+        self.workers = workers
+        self.jobs = collections.OrderedDict()
+        self.queued = collections.deque()
+        self.running = 0
+        self.next_id = 1
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def submit(self, description, work):
+        """Queue work, returning its Job."""
+        job = Job(self.next_id, description, work)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        self.queued.append(job)
+        self.idle.clear()
+        print("Job {}: {}".format(job.id, description))
+        self.pump()
+        return job
+
+    def set_workers(self, workers):
+        self.workers = workers
+        self.pump()
+
+    def pump(self):
+        """Start queued jobs while there are free workers."""
+        loop = asyncio.get_running_loop()
+        while self.running < self.workers and self.queued:
+            job = self.queued.popleft()
+            job.state = "running"
+            self.running += 1
+            future = loop.run_in_executor(None, job.run)
+            future.add_done_callback(lambda future, job = job: self.finished(job, future))
+        if self.running == 0 and not self.queued:
+            self.idle.set()
+
+    def finished(self, job, future):
+        self.running -= 1
+        exception = future.exception()
+        if job.cancelled:
+            job.state = "cancelled"
+            print("Job {} cancelled: {}".format(job.id, job.description))
+        elif exception is not None:
+            job.state = "failed"
+            print("Job {} failed: {}".format(job.id, job.description))
+        else:
+            job.state = "done"
+            print("Job {} done: {}".format(job.id, job.description))
+        self.pump()
+
+    def cancel(self, id):
+        """Cancel a job.  Returns False if there's no such job or it already finished.
+
+Queued jobs never start.  Running jobs stop at their next chance, and throw away what they rendered."""
+        job = self.jobs.get(id)
+        if job is None or job.state not in {"queued", "running"}:
+            return False
+        job.cancel()
+        if job.state == "queued":
+            self.queued.remove(job)
+            job.state = "cancelled"
+            self.pump()
+        return True
+
+    def clear(self):
+        """Forget finished jobs."""
+        for id, job in list(self.jobs.items()):
+            if job.state not in {"queued", "running"}:
+                del self.jobs[id]
+
+    def report(self):
+        """A description of every job, as a list of lines."""
+        lines = []
+        for job in self.jobs.values():
+            if job.state == "running":
+                state = "running, {:.0%}".format(job.progress())
+            else:
+                state = job.state
+            lines.append("{}: {} ({})".format(job.id, job.description, state))
+        return lines
+
+    async def wait(self):
+        """Wait until every job has finished."""
+        await self.idle.wait()
@@ -0,0 +1,129 @@
+"""Many graphs playing at once through one server and one audio device.
+
+Every sonifier.Sonifier normally has an AudioEngine of its own, with its own Libaudioverse server, threads and audio device.
+When several people or scripts play graphs at once on one machine, that multiplies all of them.
+A Mixer has one server, and opens the device once.  Each session is a Channel on it: an AudioEngine whose nodes play into a gain on the shared server,
+which a Sonifier or multigraph.MultiSonifier plays through like any other engine.
+
+The server has one block callback, which calls the callback of every channel playing a graph.
+Adding and removing a channel doesn't touch the others, and takes the same time however many there are:
+removed channels are muted and kept to be handed out again, rather than having their nodes deleted.
+
+Typical use:
+mixer = Mixer()
+channel = mixer.add(gain = 0.5, pan = -0.5)
+graph = sonifier.Sonifier(f, engine = channel, ...)
+mixer.to_audio_device()
+...
+graph.shutdown()
+mixer.remove(channel)"""
+import sonifier
+
+class Channel(sonifier.AudioEngine):
+    """A session on a Mixer.  Made by Mixer.add.
+
+gain multiplies everything the session plays.
+pan is where the session plays, from -1 at the left to 1 at the right.
+Graphs sweep across the part of the stereo field around it, narrower the further pan is from the center, so that sessions panned apart don't overlap."""
+
+    def __init__(self, mixer, gain, pan):
+        self.mixer = mixer
+        super().__init__(block_size = mixer.block_size, server = mixer.server)
+        self.set_gain(gain)
+        self.set_pan(pan)
+
+    def setup(self):
+        # Everything the channel plays goes through this, for the gain.
+        self.output = sonifier.libaudioverse.GainNode(self.server, 2)
+        self.output.connect(0, self.server)
+        super().setup()
+
+    def connect_output(self, node):
+        node.connect(0, self.output, 0)
+
+    def set_block_callback(self, callback):
+        if callback is None:
+            self.mixer.callbacks.pop(self, None)
+        else:
+            self.mixer.callbacks[self] = callback
+
+    def spread(self, position):
+        return self.pan+position*(1-abs(self.pan))
+
+    def set_gain(self, gain):
+        if gain < 0:
+            raise ValueError("The gain can't be negative.")
+        self.gain = gain
+        self.output.mul = gain
+
+    def set_pan(self, pan):
+        if not -1 <= pan <= 1:
+            raise ValueError("The pan must be from -1 to 1.")
+        self.pan = pan
+
+    def to_audio_device(self):
+        self.mixer.to_audio_device()
+
+    def shutdown(self):
+        """Stop the current graph.  The server and device belong to the mixer; see Mixer.remove."""
+        self.release()
+
+class Mixer:
+    """One Libaudioverse server and audio device, shared by any number of Channels.
+
+Every graph played on the mixer must use its block_size."""
+
+    def __init__(self, block_size = sonifier.block_size):
+        sonifier.initialize()
+        self.block_size = block_size
+        self.server = sonifier.libaudioverse.Server(block_size = block_size, sample_rate = sonifier.sr)
+        # The block callback of every channel playing a graph, by channel.
+        self.callbacks = {}
+        # The channels added and not yet removed, and removed ones waiting to be handed out again.
+        self.channels = set()
+        self.idle = []
+        self.playing = False
+        self.server.set_block_callback(self.model_update)
+
+    def model_update(self, server, time):
+        # Channels come and go from other threads, so iterate over a snapshot.
+        for callback in tuple(self.callbacks.values()):
+            callback(server, time)
+
+    def add(self, gain = 1.0, pan = 0.0):
+        """Returns a new Channel with the given gain and pan.  See Channel."""
+        if self.idle:
+            channel = self.idle.pop()
+            channel.set_gain(gain)
+            channel.set_pan(pan)
+        else:
+            channel = Channel(self, gain, pan)
+        self.channels.add(channel)
+        return channel
+
+    def remove(self, channel):
+        """Stop whatever channel is playing and silence it.  It mustn't be used afterward."""
+        self.channels.remove(channel)
+        channel.release()
+        channel.output.mul = 0
+        self.idle.append(channel)
+
+    def __len__(self):
+        return len(self.channels)
+
+    def to_audio_device(self):
+        if not self.playing:
+            self.server.set_output_device(channels = 2, mixahead = 10)
+            self.playing = True
+
+    def write_file(self, file, duration):
+        """Render duration seconds of every channel together to a file, .wav or .ogg, without a sound card."""
+        self.server.write_file(path = file, channels = 2, duration = duration)
+
+    def shutdown(self):
+        if self.playing:
+            self.server.clear_output_device()
+            self.playing = False
+        # the following is necessary to avoid a circular reference.
+        self.callbacks.clear()
+        self.server.set_block_callback(None)
@@ -0,0 +1,107 @@
+"""Graphing several equations at once, such as a function and its derivative.
+
+All the curves play on one server, from one block callback, so adding a curve costs a few more nodes and a few more property updates per block rather than another server.
+Each curve has its own timbre, in the order of sonifier.timbres, and its own fixed place in the stereo field, from left to right in the order the equations were given.
+Ticks are shared: x ticks once for the graph, and y and zero ticks for every curve on the same tickers, at the pitch of the curve that crossed."""
+import events
+import sonifier
+
+def azimuths(count):
+    """Where to pan count curves: spread evenly from left to right, or centered if there's only one."""
+    return [-90+180*(i+0.5)/count for i in range(count)]
+
+class MultiSonifier(sonifier.Sonifier):
+    """Sonify several graphs together.
+
+Parameters are the same as for sonifier.Sonifier, except that fs is a list of callables, one per curve.
+Each curve reuses whichever of previous is of its f, if any.
+hrtf is ignored: curves are told apart by panning, which HRTF's panning over time would undo.  progressive isn't supported."""
+
+    def __init__(self, fs, duration, min_x, max_x, min_y, max_y, x_ticks = None, y_ticks = None, zero_ticks = False, hrtf = False, axis_ticks = False,
+        block_size = sonifier.block_size, control_interval = None, engine = None, previous = None):
+        control_interval = self.attach(engine, block_size, control_interval, False)
+        self.voices = self.engine.voices(len(fs))
+        # Keep the total loudness about the same however many curves there are.
+        self.volume = sonifier.main_volume/len(fs)
+        self.noise_volume = sonifier.undefined_noise_volume/len(fs)
+        for voice, azimuth in zip(self.voices, azimuths(len(fs))):
+            voice.tone.frequency = sonifier.main_start_frequency
+            voice.tone.mul = self.volume
+            voice.panner.azimuth = 90*self.engine.spread(azimuth/90)
+            voice.panner.mul = 1.0
+        # The main tone's panner stays up for the tickers, centered.
+        self.main_tone.mul = 0
+        self.panner.azimuth = 90*self.engine.spread(0)
+        # Only the first curve does x ticks, since they're the same for all of them.
+        self.curves = [sonifier.Curve(f, duration = duration, min_x = min_x, max_x = max_x, min_y = min_y, max_y = max_y,
+            x_ticks = x_ticks if i == 0 else None, y_ticks = y_ticks, zero_ticks = zero_ticks, control_interval = control_interval, stats = self.stats,
+            previous = sonifier.reusable(previous, f, min_x, max_x))
+            for i, f in enumerate(fs)]
+        self.curve = self.curves[0]
+        self.curve_rows = [curve.rows() for curve in self.curves]
+        self.timeline = events.merge([curve.events for curve in self.curves])
+        self.events = self.timeline
+        self.next_event = 0
+        self.updates_per_block = block_size//control_interval
+        self.faded = [False]*len(fs)
+        self.progressive = False
+        self.fs = fs
+        self.duration = duration
+        self.min_x, self.max_x = min_x, max_x
+        self.min_y, self.max_y = min_y, max_y
+        self.hrtf = False
+        self.finished = False
+        self.elapsed = 0.0
+        self.cancelled = False
+        self.engine.set_block_callback(self.model_update)
+
+    def current_events(self):
+        return self.timeline
+
+    def update(self, time):
+        """The work of the block callback, for the block starting at time."""
+        if self.start_time is None:
+            self.start_time = time
+        time -= self.start_time
+        self.elapsed = time
+        if self.cancelled:
+            for voice in self.voices:
+                voice.panner.mul.linear_ramp_to_value(sonifier.fade_duration, 0.0)
+            self.panner.mul.linear_ramp_to_value(sonifier.fade_duration, 0.0)
+            self.engine.set_block_callback(None)
+            return
+        if time/self.duration >= 1.0:
+            for voice in self.voices:
+                voice.panner.mul.linear_ramp_to_value(0.2, 0.0)
+            self.panner.mul.linear_ramp_to_value(0.2, 0.0)
+            self.engine.set_block_callback(None)
+            self.finished = True
+        self.schedule_events(time)
+        first = self.curve.index(time)
+        last = self.curve.length-1
+        for i in range(self.updates_per_block):
+            offset = i*self.curve.step
+            index = min(first+i, last)
+            for j, rows in enumerate(self.curve_rows):
+                self.update_voice(j, rows[index], offset)
+
+    def update_voice(self, j, row, offset):
+        """Apply one control update to the voice for curve j.  This is Sonifier.update_controls, with a fade per voice."""
+        out_of_range, in_range, evaluated, y, main_freq = row
+        voice = self.voices[j]
+        if out_of_range and not self.faded[j]:
+            self.fade(voice.panner, offset, 1.0, 0.0)
+            self.faded[j] = True
+            return
+        elif out_of_range:
+            return
+        elif in_range and self.faded[j]:
+            self.fade(voice.panner, offset, 0.0, 1.0)
+            self.faded[j] = False
+        if evaluated:
+            sonifier.set_at(voice.tone, "frequency", offset, main_freq)
+            sonifier.set_at(voice.noise, "mul", offset, 0)
+            sonifier.set_at(voice.tone, "mul", offset, self.volume)
+        else:
+            sonifier.set_at(voice.noise, "mul", offset, self.noise_volume)
+            sonifier.set_at(voice.tone, "mul", offset, 0)
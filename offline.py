@@ -0,0 +1,478 @@
+"""An offline renderer which produces the same graph as sonifier.Sonifier, but directly with NumPy.
+
+Libaudioverse renders files by simulating the realtime server one block at a time, calling the block callback for every block.
+Here, the block callback's decisions are made in one quick pass over the precomputed curve, and the audio is synthesized in large chunks.
+
+The decisions can also be saved on their own as a control file, which renders to exactly the same audio.  See controlfile.
+
+This is an approximation of Libaudioverse's nodes, not a bit-exact copy:
+the additive oscillators are limited to max_harmonics partials, panning is linear amplitude panning, and HRTF graphs are panned by the direction to the HRTF source instead of being run through HRTF filters."""
+import math
+import time
+import wave
+import numpy
+import events
+import instrumentation
+import sonifier
+
+# Bump this whenever a change alters what the offline engine renders, so that cached renders are thrown out.
+version = 3
+# Partials per additive oscillator.  Everything above the 19th harmonic of a triangle is below -50 dB.
+max_harmonics = 10
+# How many samples we synthesize at a time, about a second.
+chunk_samples = 44032
+# Frames per piece Synthesizer.pcm yields by default.
+stream_frames = 4096
+# How many samples Streamer evaluates and plans at a time.  Each window has a fixed cost, mostly finding ticks, so this is several chunks, which is still little memory.
+window_samples = 16*chunk_samples
+final_fade_duration = 0.2
+# Ticks, as (attack, release, peak).  Release is measured from the start of the tick.
+x_tick_envelope = (0.005, 0.05, 0.5)
+y_tick_envelope = (0.005, 0.05, 0.5)
+zero_tick_envelope = (0.05, 0.1, 0.7)
+zero_tick_glide = 0.07
+x_tick_frequency = 115
+
+def triangle_partials(count):
+    """(harmonic numbers, amplitudes) of a band-limited triangle wave."""
+    k = numpy.arange(count)*2+1
+    return k, 8/math.pi**2*(-1.0)**((k-1)//2)/k**2
+
+def square_partials(count):
+    k = numpy.arange(count)*2+1
+    return k, 4/math.pi/k
+
+def saw_partials(count):
+    k = numpy.arange(count)+1
+    return k, 2/math.pi*(-1.0)**(k+1)/k
+
+def additive(phase, frequency, partials):
+    """Sum the partials at phase, measured in cycles.  Partials at or above Nyquist are dropped per sample.
+
+The harmonic numbers must be evenly spaced starting at 1, so that we can use the Chebyshev recurrence instead of calling sin for every partial."""
+    k, amplitudes = partials
+    step = k[1]-k[0] if len(k) > 1 else 1
+    theta = 2*math.pi*phase
+    current = numpy.sin(theta)
+    previous = numpy.sin((1-step)*theta)
+    multiplier = 2*numpy.cos(step*theta)
+    out = numpy.zeros(len(phase))
+    for harmonic, amplitude in zip(k, amplitudes):
+        out += numpy.where(harmonic*frequency < sonifier.sr/2, amplitude, 0.0)*current
+        current, previous = multiplier*current-previous, current
+    return out
+
+def breakpoints(samples, values, steps):
+    """Turn control updates into breakpoints for numpy.interp.
+
+values[i] takes effect at samples[i].  Where steps[i] is True it jumps there, as a property set at the start of a block does.
+Elsewhere it ramps from the previous update, as automation scheduled inside a block does."""
+    previous = numpy.concatenate((values[:1], values[:-1]))
+    xp = numpy.stack((samples-0.5, samples), axis = 1)
+    fp = numpy.stack((previous, values), axis = 1)
+    keep = numpy.stack((steps, numpy.ones(len(steps), dtype = bool)), axis = 1)
+    return xp[keep], fp[keep]
+
+def pink_noise(rng, count, rows = 16):
+    """Voss-McCartney pink noise, normalized to about [-1, 1]."""
+    out = numpy.zeros(count)
+    for row in range(rows):
+        period = 2**row
+        values = rng.uniform(-1, 1, count//period+1)
+        out += numpy.repeat(values, period)[:count]
+    return out/rows*2
+
+class Tick:
+    """One tick of one of the tickers, starting at sample start.
+
+If glide is set, frequency ramps linearly to glide over zero_tick_glide seconds."""
+
+    def __init__(self, start, frequency, envelope, partials, glide = None):
+        self.start = start
+        self.frequency = frequency
+        self.envelope = envelope
+        self.partials = partials
+        self.glide = glide
+        self.end = start+int(envelope[1]*sonifier.sr)
+
+    def render(self, offset, count):
+        """Render count samples, beginning offset samples after the tick starts."""
+        t = (numpy.arange(count)+offset)/sonifier.sr
+        attack, release, peak = self.envelope
+        gain = numpy.where(t < attack, peak*t/attack, peak*(release-t)/(release-attack))
+        gain = numpy.clip(gain, 0, peak)
+        if self.glide is None:
+            frequency = numpy.full(count, self.frequency)
+            phase = self.frequency*t
+        else:
+            rate = (self.glide-self.frequency)/zero_tick_glide
+            gliding = numpy.minimum(t, zero_tick_glide)
+            frequency = self.frequency+rate*gliding
+            phase = self.frequency*gliding+rate*gliding**2/2+self.glide*(t-gliding)
+        return gain*additive(phase, frequency, self.partials)
+
+class Synthesizer:
+    """Synthesizes a graph from the block callback's decisions, which Renderer makes from a curve, and controlfile loads from a file.
+
+Call prepare with the decisions before rendering.
+The other parameters are the same as for sonifier.Sonifier.__init__, except that control_interval must be given, plus seed for the noise generators."""
+
+    def __init__(self, duration, block_size, control_interval, hrtf, seed):
+        self.block_size = block_size
+        self.block_duration = block_size/sonifier.sr
+        self.control_interval = control_interval
+        self.updates_per_block = block_size//control_interval
+        # Seconds between control updates.
+        self.step = control_interval/sonifier.sr
+        # There's no block callback, but the deadline still says how close to realtime we are.
+        self.stats = instrumentation.Stats(self.block_duration)
+        self.duration = duration
+        self.hrtf = hrtf
+        self.seed = seed
+        # Libaudioverse's write_file renders half a second past the end, so that the final fade completes.
+        self.length = int((duration+0.5)*sonifier.sr)
+        self.blocks = -(-self.length//block_size)
+        # Samples rendered so far, and whether to stop early.  See progress and cancel.
+        self.rendered = 0
+        self.cancelled = False
+
+    def prepare(self, updates, ticks, end_block):
+        """Set up to render.
+
+updates is a dict of arrays with an entry per control update: frequency, tone_gain, noise_gain and azimuth, and fade_gain, the gain each fade ramps to.
+It may also have azimuth_source, from which azimuth was made; see azimuths.
+ticks is a dict of arrays with an entry per tick: sample, where it starts; kind, from events; and frequency, its pitch for y and zero ticks.
+end_block is the block the graph's final fade starts at.
+
+The results are breakpoints for numpy.interp in self.controls and for the fade gain in self.fade, and the Ticks for each ticker in self.ticks.
+Each ticker ticks at most once per control update, as the block callback's tickers do at most once per block."""
+        self.updates = updates
+        self.tick_events = ticks
+        self.end_block = end_block
+        samples = numpy.arange(len(updates["frequency"]))*self.control_interval
+        self.controls = control_breakpoints(samples, updates, self.block_size)
+        xp, fp = fade_breakpoints(samples, updates["fade_gain"], 1.0)
+        self.fade = (numpy.concatenate(([0], xp)), numpy.concatenate(([1.0], fp)))
+        self.ticks = {"x": [], "y": [], "zero": []}
+        add_ticks(self.ticks, ticks, self.control_interval)
+        self.tick_bounds = tick_bounds(self.ticks)
+
+    def azimuths(self, sources):
+        """Returns the azimuth at every control update, from sources: for each, the number of the update which last set it, or -1 if none has.
+
+The block callback sets the azimuth from the time of the update, so that's all a control file needs to store to get it back exactly."""
+        blocks, offsets = numpy.divmod(sources, self.updates_per_block)
+        normalized_time = (blocks*self.block_duration+offsets*self.step)/self.duration
+        if self.hrtf:
+            # The direction from the listener to the HRTF source.
+            azimuth = numpy.degrees(numpy.arctan2(normalized_time-0.5, sonifier.hrtf_listener_offset))
+        else:
+            azimuth = -(180/2)+normalized_time*180
+        return numpy.where(sources < 0, 0.0, azimuth)
+
+    def window(self, start, stop):
+        """Returns (control breakpoints, fade breakpoints, tick_bounds of the tickers) covering the samples from start to stop.  See prepare."""
+        return self.controls, self.fade, self.tick_bounds
+
+    def chunks(self):
+        """Yields the rendered audio, as float arrays of shape (samples, 2), about a second at a time."""
+        rng = numpy.random.default_rng(self.seed)
+        phase = 0.0
+        for start in range(0, self.length, chunk_samples):
+            if self.cancelled:
+                return
+            started = time.perf_counter()
+            stop = min(start+chunk_samples, self.length)
+            count = stop-start
+            controls, fade_points, ticks = self.window(start, stop)
+            n = numpy.arange(start, stop)
+            def control(name):
+                return numpy.interp(n, *controls[name])
+            frequency = control("frequency")
+            phases = phase+numpy.cumsum(frequency/sonifier.sr)-frequency/sonifier.sr
+            phase = (phases[-1]+frequency[-1]/sonifier.sr)%1.0
+            mono = control("tone_gain")*additive(phases%1.0, frequency, triangle_partials(max_harmonics))
+            noise_gain = control("noise_gain")
+            if noise_gain.any():
+                mono += noise_gain*pink_noise(rng, count)
+            if self.hrtf:
+                mono += 0.005*rng.uniform(-1, 1, count)
+            for ticker, starts, ends in ticks.values():
+                first = numpy.searchsorted(ends, start, side = "right")
+                last = numpy.searchsorted(starts, stop)
+                for tick in ticker[first:last]:
+                    a, b = max(tick.start, start), min(tick.end, stop)
+                    mono[a-start:b-start] += tick.render(a-tick.start, b-a)
+            fade = numpy.interp(n, *fade_points)
+            t = (n-self.end_block*self.block_size)/sonifier.sr
+            fade *= numpy.clip(1-t/final_fade_duration, 0, 1)
+            pan = (control("azimuth")+90)/180
+            out = numpy.empty((count, 2))
+            out[:, 0] = mono*fade*(1-pan)
+            out[:, 1] = mono*fade*pan
+            self.stats.render_time += time.perf_counter()-started
+            self.rendered = stop
+            yield out
+
+    def pcm(self, frames = stream_frames):
+        """Yields the rendered audio as 16-bit stereo PCM, frames frames at a time.  Only the last piece may be shorter."""
+        size = frames*4
+        pending = b""
+        for chunk in self.chunks():
+            pending += to_pcm16(chunk)
+            whole = len(pending)-len(pending)%size
+            for i in range(0, whole, size):
+                yield pending[i:i+size]
+            pending = pending[whole:]
+        if pending:
+            yield pending
+
+    def write_file(self, file):
+        """Output to a .wav file, one chunk at a time, or save the control events to a control file.  See controlfile.
+
+file can also be a binary file object, such as sys.stdout.buffer, to write a .wav to.  It doesn't have to be seekable."""
+        import controlfile
+        if not isinstance(file, str):
+            self.write_wav(file)
+            return
+        if file.lower().endswith(controlfile.extension):
+            controlfile.save(self, file)
+            return
+        if not file.lower().endswith(".wav"):
+            raise ValueError("The offline engine can only write .wav and {} files.".format(controlfile.extension))
+        with open(file, "wb") as f:
+            self.write_wav(f)
+
+    def write_wav(self, file):
+        with wave.open(file, "wb") as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(sonifier.sr)
+            # Declaring the length up front means the header never has to be patched, so the file needn't be seekable.
+            w.setnframes(self.length)
+            for piece in self.pcm():
+                w.writeframesraw(piece)
+
+    def progress(self):
+        """How much of the file has been rendered, from 0 to 1."""
+        return self.rendered/self.length
+
+    def cancel(self):
+        """Stop rendering after the current chunk.  The file is left incomplete, and the caller should throw it away."""
+        self.cancelled = True
+
+    def shutdown(self):
+        """There's no server to shut down.  This exists so that renderers and sonifiers can be used interchangeably."""
+        pass
+
+def control_breakpoints(samples, updates, block_size):
+    """Breakpoints for numpy.interp for each control, from updates at samples.  See breakpoints."""
+    steps = samples%block_size == 0
+    return {name: breakpoints(samples, updates[name], steps) for name in ("frequency", "tone_gain", "noise_gain", "azimuth")}
+
+def fade_breakpoints(samples, fade_gain, before):
+    """Breakpoints for numpy.interp for the fades which updates at samples start, ramping to fade_gain.  before is the fade gain before the first update.
+
+Fades start at their update and take sonifier.fade_samples."""
+    previous = numpy.concatenate(([before], fade_gain[:-1]))
+    changed = fade_gain != previous
+    xp = numpy.stack((samples[changed], samples[changed]+sonifier.fade_samples), axis = 1).ravel()
+    fp = numpy.stack((previous[changed], fade_gain[changed]), axis = 1).ravel()
+    return xp, fp
+
+def add_ticks(tickers, ticks, control_interval):
+    """Add Ticks for the tick events in ticks, which come after any already in tickers, to the lists in tickers.  See Synthesizer.prepare.
+
+A tick in the same control update as the one before it on its ticker is dropped."""
+    for sample, kind, tick_frequency in zip(ticks["sample"].tolist(), ticks["kind"].tolist(), ticks["frequency"].tolist()):
+        if kind == events.x_tick:
+            ticker, tick = "x", Tick(sample, x_tick_frequency, x_tick_envelope, square_partials(max_harmonics))
+        elif kind == events.y_tick:
+            ticker, tick = "y", Tick(sample, tick_frequency, y_tick_envelope, saw_partials(max_harmonics))
+        else:
+            ticker, tick = "zero", Tick(sample, tick_frequency, zero_tick_envelope, saw_partials(max_harmonics), glide = tick_frequency**sonifier.semitone)
+        # A new tick on a ticker cuts off the previous one.
+        if tickers[ticker]:
+            previous = tickers[ticker][-1]
+            if previous.start//control_interval == tick.start//control_interval:
+                continue
+            previous.end = min(previous.end, tick.start)
+        tickers[ticker].append(tick)
+
+def tick_bounds(tickers):
+    """Returns a dict of (Ticks, where they start, where they end) for each ticker's list of Ticks.
+
+Ticks on a ticker start in order and end in order, so numpy.searchsorted finds those sounding in a chunk without going through them all."""
+    return {name: (ticks, numpy.array([tick.start for tick in ticks], dtype = numpy.int64), numpy.array([tick.end for tick in ticks], dtype = numpy.int64))
+        for name, ticks in tickers.items()}
+
+class Renderer(Synthesizer):
+    """Render a graph to audio without a Libaudioverse server.
+
+The parameters are the same as for sonifier.Sonifier.__init__, plus seed for the noise generators."""
+
+    def __init__(self, f, duration, min_x, max_x, min_y, max_y, x_ticks = None, y_ticks = None, zero_ticks = False, hrtf = False, axis_ticks = False,
+        block_size = sonifier.block_size, control_interval = None, seed = 0):
+        if control_interval is None:
+            control_interval = block_size
+        sonifier.check_resolution(block_size, control_interval)
+        super().__init__(duration, block_size, control_interval, hrtf, seed)
+        self.f = f
+        self.curve_settings = dict(duration = duration, min_x = min_x, max_x = max_x, min_y = min_y, max_y = max_y,
+            x_ticks = x_ticks, y_ticks = y_ticks, zero_ticks = zero_ticks, control_interval = control_interval)
+        self.restart()
+        self.plan()
+
+    def restart(self):
+        """Forget what the block callback remembers from one block to the next, so that plan_blocks can start again from the first block."""
+        # The azimuth is kept as the number of the update which set it.  See azimuths.
+        self.current = (sonifier.main_start_frequency, sonifier.main_volume, 0.0, -1)
+        self.fade_state = (1.0, False)
+        self.end_block = self.blocks
+
+    def plan(self):
+        """Make the block callback's decisions for every control update, and prepare to render them."""
+        self.curve = curve = sonifier.Curve(self.f, stats = self.stats, **self.curve_settings)
+        updates = self.plan_blocks(0, self.blocks, curve.rows(), 0, curve.length, curve.step)
+        self.prepare(updates, self.tick_events_before_end(curve.events), self.end_block)
+
+    def plan_blocks(self, first_block, end, rows, offset, length, step):
+        """Make the block callback's decisions for the blocks from first_block up to end, which must follow the last ones planned.
+
+rows are the curve's rows, starting from update offset.  length and step are the curve's.
+Returns the updates for those blocks, as for Synthesizer.prepare.
+
+This mirrors Sonifier.model_update, including which properties it leaves alone when the graph is out of range."""
+        per_block = self.updates_per_block
+        updates = (end-first_block)*per_block
+        frequency = numpy.zeros(updates)
+        tone_gain = numpy.zeros(updates)
+        noise_gain = numpy.zeros(updates)
+        azimuth_source = numpy.zeros(updates, dtype = numpy.int64)
+        # The fade gain each update ramps to.
+        fade_gain = numpy.zeros(updates)
+        current_frequency, current_tone, current_noise, current_source = self.current
+        fade, faded_out = self.fade_state
+        for i in range(first_block, end):
+            if i < self.end_block:
+                block_time = i*self.block_duration
+                if block_time/self.duration >= 1.0:
+                    self.end_block = i
+                first = min(int(round(block_time/step)), length-1)
+            for j in range(per_block):
+                k = (i-first_block)*per_block+j
+                if i <= self.end_block:
+                    out_of_range, in_range, evaluated, y, main_freq = rows[min(first+j, length-1)-offset]
+                    if out_of_range and not faded_out:
+                        fade, faded_out = 0.0, True
+                    elif out_of_range:
+                        pass
+                    else:
+                        if in_range and faded_out:
+                            fade, faded_out = 1.0, False
+                        if evaluated:
+                            current_frequency, current_tone, current_noise = main_freq, sonifier.main_volume, 0.0
+                        else:
+                            current_tone, current_noise = 0.0, sonifier.undefined_noise_volume
+                        current_source = i*per_block+j
+                frequency[k] = current_frequency
+                tone_gain[k] = current_tone
+                noise_gain[k] = current_noise
+                azimuth_source[k] = current_source
+                fade_gain[k] = fade
+        self.current = (current_frequency, current_tone, current_noise, current_source)
+        self.fade_state = (fade, faded_out)
+        return {"frequency": frequency, "tone_gain": tone_gain, "noise_gain": noise_gain, "azimuth": self.azimuths(azimuth_source),
+            "azimuth_source": azimuth_source, "fade_gain": fade_gain}
+
+    def tick_events_before_end(self, timeline):
+        """The ticks of timeline as arrays for Synthesizer.prepare, leaving out those after the block callback stops.
+
+It stops after the block at end_block, scheduling the ticks in it first."""
+        end_time = (self.end_block+1)*self.block_duration
+        count = numpy.searchsorted(timeline.times, end_time)
+        return {"sample": numpy.round(timeline.times[:count]*sonifier.sr).astype(numpy.int64),
+            "kind": timeline.kinds[:count].astype(numpy.uint8), "frequency": timeline.frequencies[:count]}
+
+class Streamer(Renderer):
+    """A Renderer which evaluates and plans the graph a window at a time, as it's synthesized, so that memory use doesn't grow with the duration.
+
+It renders exactly the same audio as Renderer.  It can't save control files, since they need the whole graph at once.
+Parameters are the same as for Renderer."""
+
+    def plan(self):
+        # Planned updates not yet synthesized, starting at update self.base.  The one before is kept for ramping from.
+        self.base = 0
+        self.planned_blocks = 0
+        self.pending = None
+        # The fade breakpoints so far.  Only the last two before the current chunk are kept.
+        self.fade_points = (numpy.zeros(1), numpy.ones(1))
+        self.last_fade = 1.0
+        self.ticks = {"x": [], "y": [], "zero": []}
+        # The curve's last row, for blocks after its end.
+        self.last_row = None
+        # The length of the whole curve, as sonifier.Curve works it out.
+        self.curve_length = int(numpy.ceil(self.duration/self.step))+1
+
+    def plan_window(self):
+        """Evaluate and plan the next window of blocks."""
+        first_block = self.planned_blocks
+        end = min(first_block+max(window_samples//self.block_size, 1), self.blocks)
+        per_block = self.updates_per_block
+        k0, k1 = first_block*per_block, end*per_block
+        length = self.curve_length
+        if k0 < length:
+            # One update of overlap with the previous window, so that ticks between the two are found.
+            first = max(k0-1, 0)
+            curve = sonifier.Curve(self.f, stats = self.stats, first = first, count = min(k1, length)-first, **self.curve_settings)
+            rows, offset = curve.rows(), first
+            self.last_row = rows[-1]
+            timeline = curve.events
+        else:
+            rows, offset = [self.last_row], length-1
+            timeline = None
+        updates = self.plan_blocks(first_block, end, rows, offset, length, self.step)
+        self.planned_blocks = end
+        samples = numpy.arange(k0, k1)*self.control_interval
+        xp, fp = fade_breakpoints(samples, updates["fade_gain"], self.last_fade)
+        self.last_fade = updates["fade_gain"][-1]
+        self.fade_points = (numpy.concatenate((self.fade_points[0], xp)), numpy.concatenate((self.fade_points[1], fp)))
+        if timeline is not None:
+            add_ticks(self.ticks, self.tick_events_before_end(timeline), self.control_interval)
+        if self.pending is None:
+            self.pending = updates
+        else:
+            self.pending = {name: numpy.concatenate((self.pending[name], updates[name])) for name in updates}
+
+    def window(self, start, stop):
+        per_block = self.updates_per_block
+        total = self.blocks*per_block
+        # Ramps into the chunk start from the update before it, and run on to the one after it.
+        low = max(start//self.control_interval-1, 0)
+        high = min(stop//self.control_interval+2, total)
+        while self.base+len(self.pending["frequency"] if self.pending is not None else ()) < high:
+            self.plan_window()
+        drop = low-self.base
+        self.pending = {name: values[drop:] for name, values in self.pending.items()}
+        self.base = low
+        count = high-low
+        samples = numpy.arange(low, high)*self.control_interval
+        controls = control_breakpoints(samples, {name: values[:count] for name, values in self.pending.items()}, self.block_size)
+        # The last fade breakpoint at or before start, and the one before it, decide the fade up to the next one.
+        xp, fp = self.fade_points
+        keep = max(numpy.searchsorted(xp, start, side = "right")-2, 0)
+        self.fade_points = (xp[keep:], fp[keep:])
+        for name, ticker in self.ticks.items():
+            # Keep the last tick which has ended, since the next one planned may need to be dropped for being in the same update.
+            ended = sum(1 for tick in ticker[:-1] if tick.end <= start)
+            self.ticks[name] = ticker[ended:]
+        return controls, self.fade_points, tick_bounds(self.ticks)
+
+    def write_file(self, file):
+        if isinstance(file, str) and not file.lower().endswith(".wav"):
+            raise ValueError("Streaming can only write .wav files.")
+        super().write_file(file)
+
+def to_pcm16(chunk):
+    """Convert float audio to interleaved 16-bit PCM bytes."""
+    return (numpy.clip(chunk, -1, 1)*32767).astype("<i2").tobytes()
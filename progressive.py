@@ -0,0 +1,96 @@
+"""Progressive evaluation, so that slow equations start playing almost immediately.
+
+A sonifier.Curve evaluates f at every control update before playback starts, which takes as long as f is slow.
+A ProgressiveCurve evaluates a fixed number of coarse points instead, fills in the rest by interpolation, and starts a thread which evaluates the real values.
+The thread works ahead of the play cursor first, so the block callback almost always finds exact values, and falls back on interpolated ones when it doesn't.
+
+Ticks need the exact curve.  Until the thread has finished, only x ticks, which don't depend on f, are played."""
+import threading
+from time import perf_counter
+import numpy
+import sonifier
+
+# How many points are evaluated before playback starts, whatever the duration.
+coarse_points = 64
+# How many points the refining thread evaluates at a time.  Smaller is more responsive to the cursor; larger vectorizes better.
+chunk_points = 128
+
+class ProgressiveCurve(sonifier.Curve):
+    """A sonifier.Curve which fills itself in on a background thread.
+
+Parameters are the same as for sonifier.Curve.  Call start to begin refining, and stop to give up early.
+
+live_rows is the list the block callback reads, updated in place as exact values arrive.  rows returns it.
+cursor is the update the block callback is at.  The sonifier sets it, and the thread refines from there onward.
+exact is True where the values are exact rather than interpolated.
+refined is a threading.Event set once every value is exact and events includes y and zero ticks."""
+
+    def __init__(self, f, duration, min_x, max_x, min_y, max_y, x_ticks = None, y_ticks = None, zero_ticks = False, control_interval = sonifier.block_size, stats = None):
+        start = perf_counter()
+        self.f = f
+        self.stats = stats
+        self.ticks = (x_ticks, y_ticks, zero_ticks)
+        self.grid(duration, min_x, max_x, min_y, max_y, control_interval)
+        coarse = numpy.unique(numpy.linspace(0, self.length-1, min(coarse_points, self.length)).astype(int))
+        y, defined = sonifier.evaluate(f, self.x[coarse], stats)
+        indices = numpy.arange(self.length)
+        # Interpolated points are only defined if both their neighbors are.
+        self.set_values(slice(None), numpy.interp(indices, coarse, y), numpy.interp(indices, coarse, defined.astype(float)) == 1.0)
+        self.exact = numpy.zeros(self.length, dtype = bool)
+        self.exact[coarse] = True
+        self.events = self.timeline(f, x_ticks, None, False)
+        self.live_rows = sonifier.Curve.rows(self)
+        self.cursor = 0
+        self.refined = threading.Event()
+        self.stopped = False
+        self.thread = None
+        if stats is not None:
+            stats.precompute_time += perf_counter()-start
+
+    def complete(self):
+        return self.refined.is_set()
+
+    def rows(self):
+        """The live rows.  Unlike sonifier.Curve.rows, this is the same list every time, and it changes as the thread works."""
+        return self.live_rows
+
+    def start(self):
+        self.thread = threading.Thread(target = self.refine, daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped = True
+
+    def next_chunk(self):
+        """The indices to evaluate next: the first inexact ones at or after the cursor, or before it once everything ahead is done."""
+        cursor = min(self.cursor, self.length-1)
+        ahead = numpy.flatnonzero(~self.exact[cursor:])+cursor
+        if len(ahead) == 0:
+            ahead = numpy.flatnonzero(~self.exact[:cursor])
+        return ahead[:chunk_points]
+
+    def refine(self):
+        while not self.stopped:
+            chunk = self.next_chunk()
+            if len(chunk) == 0:
+                break
+            started = perf_counter()
+            y, defined = sonifier.evaluate(self.f, self.x[chunk], self.stats)
+            self.set_values(chunk, y, defined)
+            self.exact[chunk] = True
+            # Replacing list items is atomic, so the block callback always sees a whole row.
+            rows = zip(self.out_of_range[chunk].tolist(), self.in_range[chunk].tolist(), self.defined[chunk].tolist(),
+                self.y[chunk].tolist(), self.frequency[chunk].tolist())
+            for i, row in zip(chunk.tolist(), rows):
+                self.live_rows[i] = row
+            if self.stats is not None:
+                self.stats.precompute_time += perf_counter()-started
+        if self.stopped:
+            return
+        started = perf_counter()
+        x_ticks, y_ticks, zero_ticks = self.ticks
+        if y_ticks or zero_ticks:
+            self.events = self.timeline(self.f, x_ticks, y_ticks, zero_ticks, self.stats)
+        if self.stats is not None:
+            self.stats.precompute_time += perf_counter()-started
+        self.refined.set()
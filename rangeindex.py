@@ -0,0 +1,160 @@
+"""Answering questions about a graph without evaluating it again.
+
+A Series is a graph evaluated once at a fine, even spacing.  Its RangeIndex is a segment tree of minimums and maximums, with their positions,
+so the highest or lowest point between any two values of x is found in O(log n), and a prefix count of zero crossings, so counting them is O(1)."""
+import math
+import numpy
+import autorange
+import sonifier
+
+# Points in a Series.  Fine enough to place a maximum to within a few hundredths of a percent of the x range.
+series_points = 1<<16
+
+class RangeIndex:
+    """Range queries over y, ignoring points where y is undefined.
+
+The tree is stored in arrays of 2*size entries, size being the smallest power of 2 at least len(y).  Entry 1 is the root, entry i has children 2i and 2i+1, and the leaves start at size."""
+
+    def __init__(self, y, defined):
+        self.count = len(y)
+        size = 1
+        while size < self.count:
+            size *= 2
+        self.size = size
+        self.mins = numpy.full(2*size, numpy.inf)
+        self.maxes = numpy.full(2*size, -numpy.inf)
+        self.argmins = numpy.full(2*size, -1, dtype = numpy.int64)
+        self.argmaxes = numpy.full(2*size, -1, dtype = numpy.int64)
+        usable = defined & numpy.isfinite(y)
+        self.mins[size:size+self.count] = numpy.where(usable, y, numpy.inf)
+        self.maxes[size:size+self.count] = numpy.where(usable, y, -numpy.inf)
+        self.argmins[size:size+self.count] = self.argmaxes[size:size+self.count] = numpy.arange(self.count)
+        # Build a level at a time, all of each level at once.
+        start = size//2
+        while start >= 1:
+            parents = numpy.arange(start, 2*start)
+            left, right = 2*parents, 2*parents+1
+            use_left = self.mins[left] <= self.mins[right]
+            self.mins[parents] = numpy.where(use_left, self.mins[left], self.mins[right])
+            self.argmins[parents] = numpy.where(use_left, self.argmins[left], self.argmins[right])
+            use_left = self.maxes[left] >= self.maxes[right]
+            self.maxes[parents] = numpy.where(use_left, self.maxes[left], self.maxes[right])
+            self.argmaxes[parents] = numpy.where(use_left, self.argmaxes[left], self.argmaxes[right])
+            start //= 2
+        # crossing[i] is True if the curve crosses zero between points i and i+1, or touches it at i+1.
+        both = usable[:-1] & usable[1:]
+        s0, s1 = numpy.sign(y[:-1]), numpy.sign(y[1:])
+        crossing = both & (((s0 != 0) & (s1 == 0)) | (numpy.abs(s0-s1) > 1))
+        self.crossing = crossing
+        self.crossings_before = numpy.concatenate(([0], numpy.cumsum(crossing)))
+
+    def extremes(self, first, last):
+        """Returns (minimum, index of minimum, maximum, index of maximum) for points first through last inclusive.
+
+Indices are -1 if no point in the range is defined."""
+        low, low_at, high, high_at = numpy.inf, -1, -numpy.inf, -1
+        i, j = first+self.size, last+self.size+1
+        while i < j:
+            if i&1:
+                low, low_at, high, high_at = self.combine(i, low, low_at, high, high_at)
+                i += 1
+            if j&1:
+                j -= 1
+                low, low_at, high, high_at = self.combine(j, low, low_at, high, high_at)
+            i //= 2
+            j //= 2
+        return low, low_at, high, high_at
+
+    def combine(self, node, low, low_at, high, high_at):
+        if self.mins[node] < low or (self.mins[node] == low and 0 <= self.argmins[node] < low_at):
+            low, low_at = float(self.mins[node]), int(self.argmins[node])
+        if self.maxes[node] > high or (self.maxes[node] == high and 0 <= self.argmaxes[node] < high_at):
+            high, high_at = float(self.maxes[node]), int(self.argmaxes[node])
+        if low == numpy.inf:
+            low_at = -1
+        if high == -numpy.inf:
+            high_at = -1
+        return low, low_at, high, high_at
+
+    def crossings(self, first, last):
+        """How many times the curve crosses zero between points first and last."""
+        if last <= first:
+            return 0
+        return int(self.crossings_before[last]-self.crossings_before[first])
+
+    def crossing_indices(self, first, last):
+        """The i for every crossing between points i and i+1, in order, for first <= i < last."""
+        return numpy.flatnonzero(self.crossing[first:last])+first
+
+class Series:
+    """f evaluated at series_points evenly spaced points from min_x to max_x, with a RangeIndex over it."""
+
+    def __init__(self, f, min_x, max_x, points = series_points):
+        self.f = f
+        self.min_x, self.max_x = min_x, max_x
+        self.x = numpy.linspace(min_x, max_x, points)
+        self.y, self.defined = sonifier.evaluate(f, self.x)
+        self.index = RangeIndex(self.y, self.defined)
+        # joined[i] is True if the curve may be drawn as a straight line from point i to i+1: both are defined and finite, and there's no pole between them.
+        usable = self.defined & numpy.isfinite(self.y)
+        self.usable = usable
+        self.joined = usable[:-1] & usable[1:]
+        self.joined[autorange.poles(f, self.x, self.y, self.defined)] = False
+
+    def position(self, x):
+        """The index of the point nearest x, clamped to the series."""
+        step = (self.max_x-self.min_x)/(len(self.x)-1)
+        return int(min(max(round((x-self.min_x)/step), 0), len(self.x)-1))
+
+    def span(self, min_x, max_x):
+        """The first and last indices of the points from min_x to max_x, or of the nearest point if there are none in between."""
+        step = (self.max_x-self.min_x)/(len(self.x)-1)
+        # Allow for rounding error, so that the ends of the series and points exactly on min_x and max_x are included.
+        first = max(math.ceil((min_x-self.min_x)/step-1e-9), 0)
+        last = min(math.floor((max_x-self.min_x)/step+1e-9), len(self.x)-1)
+        if first > last:
+            first = last = self.position((min_x+max_x)/2)
+        return first, last
+
+    def extremes(self, min_x, max_x):
+        """Returns ((x, y) of the minimum, (x, y) of the maximum) between min_x and max_x.  Either is None if y is undefined everywhere there."""
+        low, low_at, high, high_at = self.index.extremes(*self.span(min_x, max_x))
+        if low_at < 0:
+            return None, None
+        return (float(self.x[low_at]), low), (float(self.x[high_at]), high)
+
+    def zeros(self, min_x, max_x):
+        """Returns (how many times y crosses zero between min_x and max_x, an array of roughly where)."""
+        first, last = self.span(min_x, max_x)
+        count = self.index.crossings(first, last)
+        i = self.index.crossing_indices(first, last)
+        # Interpolate between the points on either side.
+        y0, y1 = self.y[i], self.y[i+1]
+        fraction = numpy.where(y1 != y0, y0/numpy.where(y1 != y0, y0-y1, 1), 1.0)
+        return count, self.x[i]+fraction*(self.x[i+1]-self.x[i])
+
+    def __call__(self, x):
+        """Interpolate between the points of the series, so that it can be graphed in place of f.
+
+x outside the series gives nan, as do undefined and infinite points and anywhere between two points which aren't joined, such as either side of a pole."""
+        x = numpy.asarray(x, dtype = float)
+        step = (self.max_x-self.min_x)/(len(self.x)-1)
+        position = (x-self.min_x)/step
+        inside = (x >= self.min_x) & (x <= self.max_x)
+        below = numpy.clip(numpy.floor(numpy.where(inside, position, 0)), 0, len(self.x)-1).astype(numpy.int64)
+        above = numpy.minimum(below+1, len(self.x)-1)
+        fraction = position-below
+        on_point = fraction <= 0
+        defined = inside & numpy.where(on_point, self.usable[below], self.joined[numpy.minimum(below, len(self.joined)-1)])
+        with numpy.errstate(invalid = "ignore", over = "ignore"):
+            values = numpy.where(on_point, self.y[below], self.y[below]+(self.y[above]-self.y[below])*fraction)
+        return numpy.where(defined, values, numpy.nan)
+
+    def source(self, min_x, max_x, points):
+        """What to graph from min_x to max_x at points points: the series itself if it has at least that many points there, otherwise f."""
+        if min_x < self.min_x or max_x > self.max_x:
+            return self.f
+        first, last = self.span(min_x, max_x)
+        if last-first+1 < points:
+            return self.f
+        return self
@@ -0,0 +1,136 @@
+"""A persistent cache of rendered files.
+
+Entries are named by a hash of everything which affects the rendered audio: the parsed expression, the graph's settings, the engine and the engine's version.
+A hit is a hard link to the cached file, or a copy if links aren't possible.
+
+Several processes may share a cache directory.  Entries are written to a temporary file and renamed into place, so a reader never sees half an entry,
+and we tolerate entries disappearing underneath us because another process evicted them."""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+default_limit = 512*1024**2
+
+def default_directory():
+    """The cache directory: $AUDIOGRAPH_CACHE if set, otherwise .cache/audiograph in the home directory."""
+    directory = os.environ.get("AUDIOGRAPH_CACHE")
+    if directory:
+        return directory
+    return os.path.join(os.path.expanduser("~"), ".cache", "audiograph")
+
+class RenderCache:
+    """A directory of rendered files, kept under limit bytes by evicting the least recently used.
+
+A limit of 0 disables the cache."""
+
+    def __init__(self, directory, limit = default_limit):
+        self.directory = directory
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.limit > 0
+
+    def key(self, expression, settings, engine, engine_version):
+        """The key for a render.  expression should be the srepr of the parsed sympy expression."""
+        description = json.dumps({"expression": expression, "settings": settings,
+            "engine": engine, "engine_version": engine_version}, sort_keys = True)
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    def path(self, key, extension):
+        return os.path.join(self.directory, key+extension)
+
+    def entries(self):
+        """Returns a list of (path, size, last used) for every entry."""
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if name.startswith("."):
+                # In-progress writes.
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def fetch(self, key, extension, destination):
+        """If we have key, put it at destination and return True."""
+        if not self.enabled:
+            return False
+        path = self.path(key, extension)
+        try:
+            # Mark it as recently used.
+            os.utime(path)
+            place(path, destination)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def temporary(self, extension):
+        """A temporary path in the cache directory to render into.  Pass it to store when done."""
+        os.makedirs(self.directory, exist_ok = True)
+        fd, path = tempfile.mkstemp(suffix = extension, prefix = ".", dir = self.directory)
+        os.close(fd)
+        return path
+
+    def store(self, key, extension, temporary, destination):
+        """Move a finished render from temporary into the cache, and put it at destination."""
+        path = self.path(key, extension)
+        # mkstemp makes files only we can read.
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+        place(path, destination)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until we're under the limit."""
+        entries = sorted(self.entries(), key = lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        for path, entry_size, used in entries:
+            if size <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def clear(self):
+        for path, size, used in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Returns (entries, total size in bytes)."""
+        entries = self.entries()
+        return len(entries), sum(entry[1] for entry in entries)
+
+def place(path, destination):
+    """Put a hard link to path at destination, or a copy if we can't link.
+
+We go through a temporary name so that destination is replaced rather than overwritten in place, which would change the cached file too."""
+    if os.path.exists(destination) and os.path.samefile(path, destination):
+        return
+    directory = os.path.dirname(os.path.abspath(destination))
+    fd, temporary = tempfile.mkstemp(prefix = ".", dir = directory)
+    os.close(fd)
+    os.remove(temporary)
+    try:
+        os.link(path, temporary)
+    except OSError:
+        shutil.copyfile(path, temporary)
+    os.replace(temporary, destination)
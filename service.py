@@ -0,0 +1,382 @@
+"""A long-running render service, started with audiograph.py --serve.
+
+Other programs send it equations as JSON and get back rendered audio, without paying for starting audiograph, importing sympy and starting Libaudioverse every time.
+It speaks just enough HTTP/1.0 for that, on a TCP port or a Unix socket:
+
+POST /render with a JSON object: equation, plus any of the parameters of sonifier.Sonifier.__init__ and format ("wav", "ogg" or "agc", a control file; see controlfile), engine ("realtime" or "offline") and backend (see .help backend).
+Parameters which are left out have the same defaults as at the prompt.  The response is the file.
+GET /status: counts of requests, as JSON.
+
+Renders happen on a pool of worker processes, each with sympy imported before the first request reaches it.  A worker starts Libaudioverse only for its first realtime render, so offline renders work without it.
+If a worker dies, the renders it leaves unfinished get 503 and the pool is replaced with a fresh one.
+At most workers+queue_limit renders are accepted at once; any more are turned away with 503, so that a burst of requests can't pile up unbounded work.
+A client which doesn't send its whole request within request_timeout seconds gets 408.
+Errors are JSON objects with an error key.
+
+LocalClient talks to a Service through a socket pair, which exercises all of this without any network."""
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import contextlib
+import io
+import functools
+import json
+import math
+import multiprocessing
+import numbers
+import os
+import socket
+import tempfile
+import backends
+import sonifier
+
+default_host = "127.0.0.1"
+default_port = 8765
+default_workers = 2
+# Renders which may wait for a worker, beyond those running.
+default_queue_limit = 8
+# Limits on what one request can ask for.
+max_body = 64*1024
+max_equation = 1000
+max_duration = 600.0
+max_header_lines = 64
+# Seconds a client has to send its whole request, so that a stalled one can't hold a connection open forever.
+request_timeout = 30.0
+# Rendered files are read from disk and written this many bytes at a time, waiting for the client to keep up.
+write_chunk = 64*1024
+formats = {"wav": "audio/wav", "ogg": "audio/ogg", "agc": "application/octet-stream"}
+# The parameters of sonifier.Sonifier.__init__ a request may set, and their types.
+parameters = {
+    "duration": numbers.Real, "min_x": numbers.Real, "max_x": numbers.Real, "min_y": numbers.Real, "max_y": numbers.Real,
+    "x_ticks": numbers.Real, "y_ticks": numbers.Real, "zero_ticks": bool, "hrtf": bool, "axis_ticks": bool,
+    "block_size": numbers.Integral, "control_interval": numbers.Integral,
+}
+# Parameters which may be null, to turn them off.
+nullable = {"x_ticks", "y_ticks"}
+statuses = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable"}
+
+class RequestError(Exception):
+    """A request we won't render.  status is the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        # Both go in args, so that errors from worker processes unpickle.
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+# The Ui used by a worker process, made by initialize_worker, and its sonifier.AudioEngine, made by the first realtime render.
+worker_ui = None
+worker_engine = None
+
+def initialize_worker():
+    global worker_ui
+    import sympy
+    import ui
+    worker_ui = ui.Ui()
+
+@functools.lru_cache(maxsize = None)
+def defaults():
+    """The settings a request starts from: those of a new Ui."""
+    import ui
+    return ui.Ui().graph_settings()
+
+def render(request):
+    """Render a validated request in a worker.  Returns the path of the rendered file, which the caller must remove, or raises RequestError."""
+    global worker_engine
+    import ui
+    worker_ui.backend = request.get("backend", "auto")
+    settings = worker_ui.graph_settings()
+    settings.update((name, value) for name, value in request.items() if name in parameters)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        compiled = worker_ui.compiled_all(request["equation"])
+    if compiled is None:
+        raise RequestError(400, output.getvalue().strip())
+    f = compiled[0].f if len(compiled) == 1 else [c.f for c in compiled]
+    # Control files are always made by the offline engine.
+    engine = "offline" if request.get("format") == "agc" else request.get("engine", "realtime")
+    audio_engine = None
+    if engine == "realtime":
+        if worker_engine is not None and worker_engine.block_size != settings["block_size"]:
+            worker_engine.shutdown()
+            worker_engine = None
+        if worker_engine is None:
+            worker_engine = sonifier.AudioEngine(block_size = settings["block_size"])
+        audio_engine = worker_engine
+    try:
+        graph = ui.graph_for(f, engine, settings, audio_engine = audio_engine)
+    except ValueError as e:
+        raise RequestError(400, str(e))
+    fd, path = tempfile.mkstemp(suffix = "."+request.get("format", "wav"))
+    os.close(fd)
+    try:
+        graph.write_file(path)
+        graph.shutdown()
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+def validate(request):
+    """Check a request before it takes up a worker.  Raises RequestError."""
+    if not isinstance(request, dict):
+        raise RequestError(400, "The request must be a JSON object.")
+    equation = request.get("equation")
+    if not isinstance(equation, str) or not equation.strip():
+        raise RequestError(400, "equation must be a non-empty string.")
+    if len(equation) > max_equation:
+        raise RequestError(413, "equation can be at most {} characters.".format(max_equation))
+    for name, value in request.items():
+        if name in {"equation", "format", "engine", "backend"}:
+            continue
+        if name not in parameters:
+            raise RequestError(400, "Unknown parameter {}.".format(name))
+        if value is None and name in nullable:
+            continue
+        # JSON booleans are ints to Python, and ints are fine where reals are.
+        if not isinstance(value, parameters[name]) or (isinstance(value, bool) and parameters[name] is not bool):
+            raise RequestError(400, "{} has the wrong type.".format(name))
+        # Python's json accepts NaN and Infinity.
+        if parameters[name] is numbers.Real and not math.isfinite(value):
+            raise RequestError(400, "{} must be finite.".format(name))
+    if request.get("format", "wav") not in formats:
+        raise RequestError(400, "format must be one of {}.".format(", ".join(formats)))
+    engine = request.get("engine", "realtime")
+    if engine not in {"realtime", "offline"}:
+        raise RequestError(400, "engine must be realtime or offline.")
+    if engine == "offline" and request.get("format", "wav") == "ogg":
+        raise RequestError(400, "The offline engine can't write ogg.")
+    if request.get("backend", "auto") not in backends.names+["auto"]:
+        raise RequestError(400, "backend must be auto or one of {}.".format(", ".join(backends.names)))
+    settings = dict(defaults())
+    settings.update((name, value) for name, value in request.items() if name in parameters)
+    if not 1.0 <= settings["duration"] <= max_duration:
+        raise RequestError(413, "duration must be from 1 to {} seconds.".format(max_duration))
+    for low, high in (("min_x", "max_x"), ("min_y", "max_y")):
+        if settings[low] >= settings[high]:
+            raise RequestError(400, "{} must be less than {}.".format(low, high))
+        if not math.isfinite(settings[high]-settings[low]):
+            raise RequestError(400, "The range from {} to {} is too wide.".format(low, high))
+    try:
+        sonifier.check_resolution(settings["block_size"], settings["control_interval"])
+        for name, low, high in (("x_ticks", "min_x", "max_x"), ("y_ticks", "min_y", "max_y")):
+            sonifier.check_ticks(settings[name], settings[low], settings[high], settings["duration"], settings["control_interval"], name)
+    except ValueError as e:
+        raise RequestError(400, str(e))
+
+class Service:
+    """Accepts render requests and runs them on a pool of worker processes."""
+
+    def __init__(self, workers = default_workers, queue_limit = default_queue_limit):
+        self.workers = workers
+        self.limit = workers+queue_limit
+        self.pool = self.make_pool()
+        # Requests being rendered or waiting for a worker.
+        self.active = 0
+        self.served = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def make_pool(self):
+        # Workers come from a fork server, which is a fresh interpreter holding none of this process's file descriptors.
+        # Forking this process would give workers copies of the open client sockets, which would keep those connections from closing while the workers live.
+        # The fork server imports this module once, so that every worker doesn't.
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["service"])
+        return concurrent.futures.ProcessPoolExecutor(max_workers = self.workers, initializer = initialize_worker, mp_context = context)
+
+    async def replace_pool(self, broken):
+        """Replace the pool broken, after a worker died, unless that's already been done, and start the new workers."""
+        if self.pool is not broken:
+            return
+        broken.shutdown(wait = False)
+        self.pool = self.make_pool()
+        await asyncio.get_running_loop().run_in_executor(None, self.warm)
+
+    def warm(self):
+        """Start every worker now, rather than on the first requests."""
+        for future in [self.pool.submit(int) for i in range(self.workers)]:
+            future.result()
+
+    def status(self):
+        return {"workers": self.workers, "limit": self.limit, "active": self.active,
+            "served": self.served, "failed": self.failed, "rejected": self.rejected}
+
+    async def render(self, request):
+        """Render request, a decoded JSON object.  Returns (status, content type, body).
+
+On success, body is the path of the rendered file rather than its bytes, and the caller must remove it."""
+        try:
+            validate(request)
+            if self.active >= self.limit:
+                self.rejected += 1
+                raise RequestError(503, "Too many requests.  Try again later.")
+            self.active += 1
+            pool = self.pool
+            try:
+                data = await asyncio.get_running_loop().run_in_executor(pool, render, request)
+            except concurrent.futures.process.BrokenProcessPool:
+                # A worker died, perhaps killed for running out of memory, and the pool won't take any more work.
+                await self.replace_pool(pool)
+                raise RequestError(503, "A worker stopped unexpectedly.  Try again.")
+            finally:
+                self.active -= 1
+        except RequestError as e:
+            if e.status != 503:
+                self.failed += 1
+            return e.status, "application/json", json.dumps({"error": str(e)}).encode("utf-8")
+        except Exception as e:
+            self.failed += 1
+            return 500, "application/json", json.dumps({"error": "Couldn't render: {}".format(e)}).encode("utf-8")
+        self.served += 1
+        return 200, formats[request.get("format", "wav")], data
+
+    async def respond(self, method, path, body):
+        """Handle one request.  Returns (status, content type, body)."""
+        if path == "/status":
+            if method != "GET":
+                return 405, "application/json", json.dumps({"error": "Use GET."}).encode("utf-8")
+            return 200, "application/json", json.dumps(self.status()).encode("utf-8")
+        if path != "/render":
+            return 404, "application/json", json.dumps({"error": "Not found."}).encode("utf-8")
+        if method != "POST":
+            return 405, "application/json", json.dumps({"error": "Use POST."}).encode("utf-8")
+        try:
+            request = json.loads(body.decode("utf-8"))
+        except ValueError:
+            return 400, "application/json", json.dumps({"error": "The body isn't JSON."}).encode("utf-8")
+        return await self.render(request)
+
+    async def handle_connection(self, reader, writer):
+        """Read one HTTP request from reader, and write the response to writer."""
+        rendered = None
+        try:
+            try:
+                method, path, body = await asyncio.wait_for(read_request(reader), request_timeout)
+            except RequestError as e:
+                status, content_type, data = e.status, "application/json", json.dumps({"error": str(e)}).encode("utf-8")
+            except asyncio.TimeoutError:
+                status, content_type, data = 408, "application/json", json.dumps({"error": "The request took more than {} seconds to arrive.".format(request_timeout)}).encode("utf-8")
+            else:
+                status, content_type, data = await self.respond(method, path, body)
+            if isinstance(data, str):
+                # A rendered file, streamed from disk so that it's never in memory whole.
+                rendered = data
+                size = os.path.getsize(rendered)
+            else:
+                size = len(data)
+            writer.write("HTTP/1.0 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n".format(
+                status, statuses[status], content_type, size).encode("ascii"))
+            if rendered is None:
+                writer.write(data)
+            else:
+                loop = asyncio.get_running_loop()
+                with open(rendered, "rb") as f:
+                    while True:
+                        chunk = await loop.run_in_executor(None, f.read, write_chunk)
+                        if not chunk:
+                            break
+                        writer.write(chunk)
+                        await writer.drain()
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            if rendered is not None:
+                os.remove(rendered)
+
+    def close(self):
+        self.pool.shutdown()
+
+async def read_request(reader):
+    """Returns (method, path, body) for the HTTP request on reader.  Raises RequestError if it's malformed or too big."""
+    line = await reader.readline()
+    words = line.decode("latin-1").split()
+    if len(words) != 3:
+        raise RequestError(400, "Malformed request line.")
+    method, path = words[0], words[1]
+    length = 0
+    for i in range(max_header_lines):
+        line = await reader.readline()
+        if line in {b"\r\n", b"\n", b""}:
+            break
+        name, sep, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            try:
+                length = int(value)
+            except ValueError:
+                raise RequestError(400, "Malformed Content-Length.")
+    else:
+        raise RequestError(400, "Too many headers.")
+    if length > max_body:
+        raise RequestError(413, "The body can be at most {} bytes.".format(max_body))
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method, path, body
+
+async def serve(service, host = default_host, port = default_port, path = None):
+    """Serve until cancelled, on host and port, or on the Unix socket at path if given."""
+    if path is not None:
+        server = await asyncio.start_unix_server(service.handle_connection, path = path)
+        print("Serving on", path)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        print("Serving on http://{}:{}".format(host, port))
+    async with server:
+        await server.serve_forever()
+
+def main(args):
+    """Run the service from audiograph.py's command line arguments after --serve.
+
+Syntax: --serve [--port <port>] [--host <host>] [--socket <path>] [--workers <n>] [--queue <n>]"""
+    options = {"--port": str(default_port), "--host": default_host, "--socket": None,
+        "--workers": str(default_workers), "--queue": str(default_queue_limit)}
+    if len(args)%2 != 0 or any(name not in options for name in args[::2]):
+        print(main.__doc__.splitlines()[-1])
+        return 1
+    options.update(zip(args[::2], args[1::2]))
+    service = Service(int(options["--workers"]), int(options["--queue"]))
+    service.warm()
+    try:
+        asyncio.run(serve(service, options["--host"], int(options["--port"]), options["--socket"]))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+class LocalClient:
+    """Talks to a Service over a socket pair, for testing without a network.
+
+Each call makes a new connection, and waits for the whole response."""
+
+    def __init__(self, service):
+        self.service = service
+
+    async def request(self, method, path, body = b""):
+        """Returns (status, content type, body)."""
+        client, server = socket.socketpair()
+        server_reader, server_writer = await asyncio.open_connection(sock = server)
+        handler = asyncio.ensure_future(self.service.handle_connection(server_reader, server_writer))
+        reader, writer = await asyncio.open_connection(sock = client)
+        writer.write("{} {} HTTP/1.0\r\nContent-Length: {}\r\n\r\n".format(method, path, len(body)).encode("ascii")+body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        await handler
+        head, sep, data = response.partition(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split()[1])
+        headers = dict(line.split(": ", 1) for line in lines[1:])
+        return status, headers.get("Content-Type"), data
+
+    async def render(self, **request):
+        return await self.request("POST", "/render", json.dumps(request).encode("utf-8"))
+
+    async def status(self):
+        status, content_type, data = await self.request("GET", "/status")
+        return json.loads(data.decode("utf-8"))
@@ -1,5 +1,19 @@
-import libaudioverse
+import atexit
+import bisect
+import numbers
+import threading
+from time import perf_counter
+import numpy
+import events
+import instrumentation
 
+# Importing Libaudioverse is slow, so this is None until initialize is called.
+libaudioverse = None
+# Render jobs make engines on their own threads, so initialize can be called from several at once.
+_initialize_lock = threading.Lock()
+
+# Bump this whenever a change alters what graphs sound like, so that cached renders are thrown out.
+version = 2
 main_start_frequency = 130.8 # C3, 1 octave below Middle c.
 main_volume = 0.3
 undefined_noise_volume = 0.3
@@ -9,10 +23,28 @@ semitone_range = 32 # We graph over 3 octaves.
 hrtf_width = 1
 hrtf_height = 1
 hrtf_listener_offset = 0.9
+# The default block size.  Graphs can use others; see check_resolution.
 block_size = 128
 # HRTF only works well at 44100.
 sr = 44100
 block_duration = block_size/sr
+# Fading in and out when the graph enters or leaves the y range takes this long, whatever the block size.
+fade_samples = 64
+fade_duration = fade_samples/sr
+# When a curve is resampled from an earlier one, points are interpolated only if that's off by at most this fraction of the y range.  A thousandth is 3 cents.
+resample_tolerance = 1e-3
+
+def initialize():
+    """Import and initialize Libaudioverse, if we haven't already.  It is shut down at exit.
+
+AudioEngine calls this, so nothing else needs to unless it uses Libaudioverse directly."""
+    global libaudioverse
+    with _initialize_lock:
+        if libaudioverse is None:
+            import libaudioverse as lav
+            lav.initialize()
+            atexit.register(lav.shutdown)
+            libaudioverse = lav
 
 def compute_frequencies(value, min_y, max_y):
     """Returns the frequency of the tone.
@@ -23,32 +55,298 @@ This function does not error check. min_y < value < max_y, or else. Being silent
     multiplier = semitone**semitones
     return main_start_frequency*multiplier
 
-class Sonifier:
-    """Sonify a graph.
+def check_resolution(block_size, control_interval):
+    """Raise ValueError unless a block size and control interval, both in samples, can be used together.
 
-This class supports outputting to the sound card or a wave file. See __init__'s documentation for info on how to use it.
+Controls are updated every control_interval samples, so it has to divide the block size evenly.
+It can't be shorter than a fade, because a fade has to finish before the next control update can start another."""
+    if block_size < 1 or control_interval < 1:
+        raise ValueError("The block size and control interval must be positive.")
+    if block_size%control_interval:
+        raise ValueError("The control interval must divide the block size.")
+    if control_interval < fade_samples:
+        raise ValueError("The control interval must be at least {} samples.".format(fade_samples))
 
-Every instance makes its own Libaudioverse server."""
+def check_ticks(spacing, low, high, duration, control_interval, name):
+    """Raise ValueError unless ticks every spacing, over the range from low to high, are at most one per control update when a graph crosses the range evenly.
 
+Tickers tick at most once per control update anyway, so a finer spacing is almost certainly a mistake.  spacing can be None, for no ticks.
+name is what to call the ticks in the message."""
+    if spacing is None:
+        return
+    if not spacing > 0:
+        raise ValueError("{} must be positive.".format(name))
+    finest = (high-low)*control_interval/(duration*sr)
+    if spacing < finest:
+        raise ValueError("{} must be at least {:.3g} with this range, duration and control interval.".format(name, finest))
 
-    def __init__(self, f, duration, min_x, max_x, min_y, max_y, x_ticks = None, y_ticks = None, zero_ticks = False, hrtf = False, axis_ticks = False):
-        """Parameters:
+def evaluate(f, xs, stats = None):
+    """Evaluate f at every value in the array xs.
 
-f: A callable. Given a value for x, return a value for y.
-duration: The total duration of the graph. We reach max_x at duration seconds, then stop.
-min_x, max_x: The range of the X axis.
-min_y, max_y: The range of the y axis.
-x_ticks: If set to a value besides None, tick for every time we cross a multiple of the value.
-y_ticks: x_ticks, but for y.
-zero_ticks: tick when y crosses zero.
-hrtf: If True, use HRTF panning.
-axis_ticks: If True, tick for crossing x=0 or y=0.
+Returns (ys, defined).  ys is an array of floats.  defined is a boolean array which is False wherever f raised, returned something that isn't a real number, or returned nan.  Undefined entries of ys are 0.
+Infinities count as defined: they're just out of range.
 
-x_ticks and y_ticks exist to allow representing graph lines through audio.
-The visual equivalent of these values is the setting which allows one to specify the size of grid squares.
-As this class graphs, it will produce distinct ticks as the value of f crosses multiples of x_ticks or y_ticks."""
-        # This is around 3 milliseconds.  We can probably increase the resolution further.
-        self.server = libaudioverse.Server(block_size = block_size, sample_rate = sr)
+f should accept NumPy arrays, as sympy's lambdify does with the numpy module.  If it doesn't, we fall back to calling it once per element.
+If stats is an instrumentation.Stats, the time spent here and the exceptions f raised at single points are recorded in it."""
+    with instrumentation.Timer(stats, "evaluation_time"):
+        ys, defined = _evaluate(f, xs, stats)
+    if stats is not None:
+        stats.evaluations += len(xs)
+    return ys, defined
+
+def _evaluate(f, xs, stats):
+    try:
+        with numpy.errstate(all = "ignore"):
+            ys = numpy.asarray(f(xs))
+        if ys.shape == ():
+            # Constant expressions give back a scalar.
+            ys = numpy.full(xs.shape, ys[()])
+        if ys.shape != xs.shape or ys.dtype == object:
+            raise ValueError("f didn't vectorize")
+        if numpy.iscomplexobj(ys):
+            defined = ys.imag == 0
+            ys = ys.real
+        else:
+            defined = numpy.ones(xs.shape, dtype = bool)
+        ys = ys.astype(float)
+    except Exception:
+        # Not recorded: functions which evaluate one point at a time refuse arrays on purpose.
+        ys = numpy.zeros(xs.shape)
+        defined = numpy.zeros(xs.shape, dtype = bool)
+        for i, x in enumerate(xs):
+            try:
+                with numpy.errstate(all = "ignore"):
+                    tmp = f(float(x))
+            except Exception as e:
+                # We can't do anything reasonable here.
+                if stats is not None:
+                    stats.record_exception(e)
+                continue
+            # Ints and NumPy scalars are fine.  Complex results are defined where they're real, as for arrays.
+            if isinstance(tmp, numbers.Complex) and not isinstance(tmp, numbers.Real):
+                if tmp.imag != 0:
+                    continue
+                tmp = tmp.real
+            if isinstance(tmp, numbers.Real):
+                ys[i] = tmp
+                defined[i] = True
+    defined &= ~numpy.isnan(ys)
+    ys[~defined] = 0.0
+    return ys, defined
+
+def resample(x, y, defined, new_x, tolerance):
+    """Interpolate the samples (x, y, defined) of a curve at new_x, which is sorted, as x is.
+
+Returns (y, defined, unknown).  unknown is True where interpolating isn't good enough and f has to be evaluated:
+outside the samples, next to undefined or infinite ones, and where the curvature of the samples says a straight line between them would be off by more than tolerance.
+Points which land on a sample take its value."""
+    usable = defined & numpy.isfinite(y)
+    # How far a straight line between neighboring samples could be off, estimated from second differences.
+    curvature = numpy.full(len(x), numpy.inf)
+    if len(x) >= 3:
+        with numpy.errstate(invalid = "ignore"):
+            second = numpy.abs(y[:-2]-2*y[1:-1]+y[2:])
+        second[~(usable[:-2] & usable[1:-1] & usable[2:])] = numpy.inf
+        curvature[1:-1] = second
+        curvature[0], curvature[-1] = second[0], second[-1]
+    left = numpy.clip(numpy.searchsorted(x, new_x, side = "right")-1, 0, len(x)-2)
+    x0, x1 = x[left], x[left+1]
+    t = (new_x-x0)/(x1-x0)
+    tiny = 1e-9
+    on_left = numpy.abs(t) <= tiny
+    on_right = numpy.abs(t-1) <= tiny
+    inside = (t >= 0) & (t <= 1)
+    error = numpy.maximum(curvature[left], curvature[left+1])/8
+    smooth = inside & usable[left] & usable[left+1] & (error <= tolerance)
+    with numpy.errstate(invalid = "ignore"):
+        new_y = numpy.where(smooth, y[left]+(y[left+1]-y[left])*t, 0.0)
+    new_defined = smooth.copy()
+    for hit, index in ((on_left, left), (on_right, left+1)):
+        new_y[hit] = y[index[hit]]
+        new_defined[hit] = defined[index[hit]]
+    unknown = ~(smooth | on_left | on_right)
+    return new_y, new_defined, unknown
+
+def reusable(curves, f, min_x, max_x):
+    """The first of curves which a Curve of f from min_x to max_x can reuse values from, or None.
+
+Only the function and the x range have to match.  See Curve."""
+    for curve in curves or ():
+        if curve.f is f and curve.min_x == min_x and curve.max_x == max_x and curve.complete():
+            return curve
+
+class Curve:
+    """The whole graph, computed ahead of time with one entry per control update.
+
+The block callback has about 3 milliseconds to do its work, which isn't enough to call into arbitrary sympy expressions reliably.
+So we evaluate everything here, before playback starts, and the callback only indexes into these arrays.
+
+Parameters have the same meaning as for Sonifier.__init__.
+control_interval is the number of samples between control updates.  step is the same in seconds.
+
+Attributes, all arrays with one entry per control update:
+times: the time of the update.
+x: the value of x at that time.
+y: the value of f(x).  Where f is undefined, this is the middle of the y range.
+defined: True where f(x) is defined.
+out_of_range: True where y is outside [min_y, max_y].  The graph is silent there.
+in_range: True where y is strictly inside (min_y, max_y).
+frequency: the frequency of the main tone.
+
+events is an events.Timeline of every tick, at the exact time the curve crosses it.
+
+If stats is an instrumentation.Stats, the time taken is recorded in it.
+
+previous is an earlier Curve of the same f over the same x range, or None.  Graphing the same equation again after changing settings reuses what it can from it:
+the y range only changes the mapping to pitch and which ticks are audible, so f isn't evaluated at all;
+tick spacing only needs the crossings of the new spacing to be found;
+duration and control interval change where f is sampled, so previous is resampled, and f is evaluated only where interpolating isn't accurate enough.  See resample.
+
+first and count make a window onto the curve: the arrays then only hold count updates, starting at update first, and events only has the ticks between them.
+length is still the length of the whole curve, and index still gives indices into the whole curve; subtract first to index the arrays.
+Windows which overlap by one update have every tick exactly once between them.  offline.Streamer uses this to graph in constant memory."""
+
+    def __init__(self, f, duration, min_x, max_x, min_y, max_y, x_ticks = None, y_ticks = None, zero_ticks = False, control_interval = block_size, stats = None,
+        previous = None, first = 0, count = None):
+        start = perf_counter()
+        self.f = f
+        self.grid(duration, min_x, max_x, min_y, max_y, control_interval, first, count)
+        if previous is None:
+            y, defined = evaluate(f, self.x, stats)
+            self.set_values(slice(None), y, defined)
+        else:
+            self.reuse(previous, stats)
+        self.events = self.timeline(f, x_ticks, y_ticks, zero_ticks, stats)
+        if stats is not None:
+            stats.precompute_time += perf_counter()-start
+
+    def reuse(self, previous, stats = None):
+        """Fill in the values from previous, evaluating f only where it has to be."""
+        if previous.length == self.length and previous.step == self.step and previous.duration == self.duration:
+            self.set_values(slice(None), previous.y, previous.defined)
+            self.crossings = dict(previous.crossings)
+            return
+        y, defined, unknown = resample(previous.x, previous.y, previous.defined, self.x, (self.max_y-self.min_y)*resample_tolerance)
+        if unknown.any():
+            y[unknown], defined[unknown] = evaluate(self.f, self.x[unknown], stats)
+        self.set_values(slice(None), y, defined)
+        # Crossings are found between samples, so a coarser curve could miss some a finer one found, but not the other way around.
+        # Either curve may go a little past max_x, but nothing past the end of the graph is played.
+        if previous.length >= self.length:
+            self.crossings = dict(previous.crossings)
+
+    def complete(self):
+        """Whether every value is exact, so that later curves can reuse them."""
+        return True
+
+    def grid(self, duration, min_x, max_x, min_y, max_y, control_interval, first = 0, count = None):
+        """Set up the arrays, without evaluating anything."""
+        self.duration = duration
+        self.min_x, self.max_x = min_x, max_x
+        self.min_y, self.max_y = min_y, max_y
+        self.control_interval = control_interval
+        self.step = control_interval/sr
+        # Crossings found for y and zero ticks, by events.timeline.
+        self.crossings = {}
+        # One update past the end, so that the final fade out has somewhere to happen.
+        self.length = int(numpy.ceil(duration/self.step))+1
+        if count is None:
+            count = self.length-first
+        self.first = first
+        self.times = numpy.arange(first, first+count)*self.step
+        self.x = min_x+(self.times/duration)*(max_x-min_x)
+        self.y = numpy.zeros(count)
+        self.defined = numpy.zeros(count, dtype = bool)
+        self.out_of_range = numpy.zeros(count, dtype = bool)
+        self.in_range = numpy.zeros(count, dtype = bool)
+        self.frequency = numpy.full(count, main_start_frequency)
+
+    def set_values(self, indices, y, defined):
+        """Store f at the updates given by indices, an index array or slice, and everything which depends on it."""
+        min_y, max_y = self.min_y, self.max_y
+        middle = min_y+(max_y-min_y)/2
+        y = numpy.where(defined, y, middle)
+        self.y[indices] = y
+        self.defined[indices] = defined
+        out_of_range = (y < min_y) | (y > max_y)
+        self.out_of_range[indices] = out_of_range
+        self.in_range[indices] = (min_y < y) & (y < max_y)
+        frequency = numpy.full(len(y), main_start_frequency)
+        frequency[~out_of_range] = compute_frequencies(y[~out_of_range], min_y, max_y)
+        self.frequency[indices] = frequency
+
+    def timeline(self, f, x_ticks, y_ticks, zero_ticks, stats = None):
+        """Find every tick in the curve as it stands, returning an events.Timeline."""
+        return events.timeline(f, self, self.duration, self.min_x, self.max_x, self.min_y, self.max_y, x_ticks, y_ticks, zero_ticks,
+            lambda f, xs: evaluate(f, xs, stats), lambda levels: compute_frequencies(levels, self.min_y, self.max_y), self.crossings)
+
+    def index(self, time):
+        """The control update for a time in seconds."""
+        return min(int(round(time/self.step)), self.length-1)
+
+    def rows(self):
+        """Everything the block callback needs, as a list with one tuple per control update.
+
+The tuples are (out_of_range, in_range, defined, y, frequency).
+Indexing NumPy arrays one element at a time is slow, so the callback uses this instead."""
+        return list(zip(self.out_of_range.tolist(), self.in_range.tolist(), self.defined.tolist(),
+            self.y.tolist(), self.frequency.tolist()))
+
+def set_at(node, name, offset, value):
+    """Set a property of node, offset seconds into the current block.
+
+Updates at the start of a block are immediate.  Later ones ramp from the previous update, which ended at or before the start of this one,
+so a property moves in straight lines between the values the curve gives it."""
+    if offset == 0:
+        setattr(node, name, value)
+    else:
+        getattr(node, name).linear_ramp_to_value(offset, value)
+
+class Voice:
+    """A tone and a noise for one curve of a multigraph.MultiSonifier, with their own panner, playing through an AudioEngine.
+
+timbre is the name of the Libaudioverse node class for the tone."""
+
+    def __init__(self, engine, timbre):
+        server = engine.server
+        self.tone = getattr(libaudioverse, timbre)(server)
+        self.noise = libaudioverse.NoiseNode(server)
+        self.noise.noise_type = libaudioverse.NoiseTypes.pink
+        self.panner = libaudioverse.MultipannerNode(server, "default")
+        self.tone.connect(0, self.panner, 0)
+        self.noise.connect(0, self.panner, 0)
+        engine.connect_output(self.panner)
+        self.mute()
+
+    def mute(self):
+        self.tone.mul = 0
+        self.noise.mul = 0
+        self.panner.mul = 0
+
+# Tones for the voices of a multigraph.MultiSonifier, in order.  The first matches the main tone.
+timbres = ("AdditiveTriangleNode", "AdditiveSquareNode", "AdditiveSawNode", "SineNode")
+
+class AudioEngine:
+    """A Libaudioverse server and the node graph a Sonifier plays through.
+
+Building a server and its nodes takes time, and opening the audio device for every graph glitches.
+An engine is built once and reused: each Sonifier reconfigures it and swaps in its own block callback.
+The HRTF and non-HRTF routes are both built up front, and the one not in use is muted.
+
+The block size can't be changed once the server exists, so graphs with another block size need another engine.
+
+server is the Libaudioverse server to build on, or None to make one.  mixer.Channel passes the server it shares with other channels."""
+
+    def __init__(self, block_size = block_size, server = None):
+        initialize()
+        self.block_size = block_size
+        if server is None:
+            server = libaudioverse.Server(block_size = block_size, sample_rate = sr)
+        self.server = server
+        self.setup()
+
+    def setup(self):
+        """Build the node graph."""
         self.main_tone = libaudioverse.AdditiveTriangleNode(self.server)
         self.main_tone.frequency = main_start_frequency
         self.main_tone.mul = main_volume
@@ -63,15 +361,14 @@ As this class graphs, it will produce distinct ticks as the value of f crosses m
         self.source = libaudioverse.SourceNode(self.server, self.environment)
         self.main_tone.connect(0, self.panner, 0)
         self.main_tone.connect(0, self.source, 0)
-        if hrtf:
-            self.main_noise.connect(0, self.source, 0)
-            self.undefined_noise.connect(0, self.source, 0)
-            self.environment.connect(0, self.server)
-            self.environment.panning_strategy = libaudioverse.PanningStrategies.hrtf
-            self.environment.position = (0, 0, hrtf_listener_offset)
-        else:
-            self.undefined_noise.connect(0, self.panner, 0)
-            self.panner.connect(0, self.server)
+        # Both routes are always connected.  configure mutes the one we aren't using.
+        self.main_noise.connect(0, self.source, 0)
+        self.undefined_noise.connect(0, self.source, 0)
+        self.connect_output(self.environment)
+        self.environment.panning_strategy = libaudioverse.PanningStrategies.hrtf
+        self.environment.position = (0, 0, hrtf_listener_offset)
+        self.undefined_noise.connect(0, self.panner, 0)
+        self.connect_output(self.panner)
         # These are for the small ticks. We don't necessarily use them, but we get them going anyway so that we can if we want.
         self.x_ticker = libaudioverse.AdditiveSquareNode(self.server)
         self.y_ticker = libaudioverse.AdditiveSawNode(self.server)
@@ -86,18 +383,119 @@ As this class graphs, it will produce distinct ticks as the value of f crosses m
         self.x_ticker.connect(0, self.source, 0)
         self.y_ticker.connect(0, self.source, 0)
         self.zero_ticker.connect(0, self.source, 0)
-        self.prev_x = min_x
-        self.prev_y = min_y+(max_y-min_y)/2
-        try:
-            tmp = f(min_x)
-            if isinstance(tmp, float):
-                self.prev_y = tmp
-        except:
-            pass
-        if self.prev_y < 0: self.prev_y_sign = -1
-        elif self.prev_y == 0: self.prev_y_sign = 0
-        else: self.prev_y_sign = 1
-        self.server.set_block_callback(self.model_update)
+        # Voices for graphing several curves at once.  Made as needed by voices, and kept muted when not in use.
+        self.voice_list = []
+        self.playing = False
+
+    def voices(self, count):
+        """Returns count Voices, making any we don't have yet."""
+        while len(self.voice_list) < count:
+            self.voice_list.append(Voice(self, timbres[len(self.voice_list)%len(timbres)]))
+        return self.voice_list[:count]
+
+    def connect_output(self, node):
+        """Connect node to where this engine's audio goes: the server, for an engine of its own."""
+        node.connect(0, self.server)
+
+    def set_block_callback(self, callback):
+        """Make callback the block callback, or stop calling one if it's None."""
+        self.server.set_block_callback(callback)
+
+    def spread(self, position):
+        """Where in the stereo field a graph at position should play, both from -1 at the left to 1 at the right.  A graph on an engine of its own uses all of it."""
+        return position
+
+    def configure(self, hrtf):
+        """Put every node back the way a new graph expects, and select a route."""
+        self.set_block_callback(None)
+        self.main_tone.frequency = main_start_frequency
+        self.main_tone.mul = main_volume
+        self.undefined_noise.mul = 0
+        self.main_noise.mul = 0.005 if hrtf else 0
+        for ticker in (self.x_ticker, self.y_ticker, self.zero_ticker):
+            ticker.mul = 0
+        self.x_ticker.frequency = 115
+        for voice in self.voice_list:
+            voice.mute()
+        self.environment.mul = 1.0 if hrtf else 0.0
+        self.panner.mul = 0.0 if hrtf else 1.0
+
+    def release(self):
+        """Stop the current graph, leaving the device open for the next one."""
+        self.set_block_callback(None)
+        self.environment.mul = 0
+        self.panner.mul = 0
+        self.main_tone.mul = 0
+        self.undefined_noise.mul = 0
+        for voice in self.voice_list:
+            voice.mute()
+
+    def to_audio_device(self):
+        if not self.playing:
+            self.server.set_output_device(channels = 2, mixahead = 10)
+            self.playing = True
+
+    def shutdown(self):
+        if self.playing:
+            self.server.clear_output_device()
+            self.playing = False
+        # the following is necessary to avoid a circular reference.
+        self.set_block_callback(None)
+
+class Sonifier:
+    """Sonify a graph.
+
+This class supports outputting to the sound card or a wave file. See __init__'s documentation for info on how to use it.
+
+Sonifiers play through an AudioEngine.  Pass one in to reuse it for graph after graph; otherwise, every instance makes its own."""
+
+
+    def __init__(self, f, duration, min_x, max_x, min_y, max_y, x_ticks = None, y_ticks = None, zero_ticks = False, hrtf = False, axis_ticks = False,
+        block_size = block_size, control_interval = None, progressive = False, engine = None, previous = None):
+        """Parameters:
+
+f: A callable. Given a value for x, return a value for y.
+duration: The total duration of the graph. We reach max_x at duration seconds, then stop.
+min_x, max_x: The range of the X axis.
+min_y, max_y: The range of the y axis.
+x_ticks: If set to a value besides None, tick for every time we cross a multiple of the value.
+y_ticks: x_ticks, but for y.
+zero_ticks: tick when y crosses zero.
+hrtf: If True, use HRTF panning.
+axis_ticks: If True, tick for crossing x=0 or y=0.
+block_size: The server's block size, in samples.  Larger blocks mean fewer block callbacks.
+control_interval: Samples between updates of the tone, panning and fades.  Defaults to block_size.
+Updates inside a block are scheduled as automation, so pitch moves as smoothly with large blocks as with small ones.  See check_resolution.
+progressive: If True, start playing after evaluating f at a few points, and fill in the rest while playing.  See the progressive module.
+engine: The AudioEngine to play through.  If None, we make one, which is shut down with us.  Its block size must be block_size.
+previous: Curves of earlier graphs.  If one is of f over the same x range, its values are reused rather than evaluating f again, and progressive is ignored.  See Curve.
+
+x_ticks and y_ticks exist to allow representing graph lines through audio.
+The visual equivalent of these values is the setting which allows one to specify the size of grid squares.
+As this class graphs, it will produce distinct ticks as the value of f crosses multiples of x_ticks or y_ticks."""
+        control_interval = self.attach(engine, block_size, control_interval, hrtf)
+        # Do all the math now, rather than in the block callback.
+        reused = reusable(previous, f, min_x, max_x)
+        settings = dict(duration = duration, min_x = min_x, max_x = max_x, min_y = min_y, max_y = max_y,
+            x_ticks = x_ticks, y_ticks = y_ticks, zero_ticks = zero_ticks, control_interval = control_interval, stats = self.stats)
+        if reused is not None:
+            # Reusing is quicker than even progressive evaluation starts.
+            progressive = False
+            self.curve = Curve(f, previous = reused, **settings)
+        elif progressive:
+            import progressive as progressive_module
+            self.curve = progressive_module.ProgressiveCurve(f, **settings)
+        else:
+            self.curve = Curve(f, **settings)
+        self.progressive = progressive
+        self.rows = self.curve.rows()
+        self.updates_per_block = block_size//control_interval
+        # The first event in curve.events which hasn't been scheduled yet.  A progressive curve replaces its events once it has all of them.
+        self.next_event = 0
+        self.events = self.curve.events
+        self.engine.set_block_callback(self.model_update)
+        if progressive:
+            self.curve.start()
         # We start not faded out.
         self.faded_out = False
         # Copy everything.
@@ -113,97 +511,178 @@ As this class graphs, it will produce distinct ticks as the value of f crosses m
         self.zero_ticks = zero_ticks
         self.axis_ticks = axis_ticks
         self.finished = False
+        # How far into the graph the last block callback was, and whether to stop early.  See progress and cancel.
+        self.elapsed = 0.0
+        self.cancelled = False
+
+    def attach(self, engine, block_size, control_interval, hrtf):
+        """Set up to play through engine, or a new AudioEngine if it's None.  Returns the control interval, with the default filled in."""
+        if control_interval is None:
+            control_interval = block_size
+        check_resolution(block_size, control_interval)
+        if engine is None:
+            engine = AudioEngine(block_size = block_size)
+            self.owns_engine = True
+        else:
+            if engine.block_size != block_size:
+                raise ValueError("The engine's block size is {}, not {}.".format(engine.block_size, block_size))
+            self.owns_engine = False
+        self.engine = engine
+        engine.configure(hrtf)
+        self.server = engine.server
+        self.main_tone = engine.main_tone
+        self.main_noise = engine.main_noise
+        self.undefined_noise = engine.undefined_noise
+        self.panner = engine.panner
+        self.environment = engine.environment
+        self.source = engine.source
+        self.x_ticker = engine.x_ticker
+        self.y_ticker = engine.y_ticker
+        self.zero_ticker = engine.zero_ticker
+        # The server's clock keeps running between graphs, so we measure time from our first block.
+        self.start_time = None
+        self.block_size = block_size
+        self.block_duration = block_size/sr
+        self.control_interval = control_interval
+        self.stats = instrumentation.Stats(self.block_duration)
+        return control_interval
 
     def model_update(self, server, time):
+        start = perf_counter()
+        try:
+            self.update(time)
+        finally:
+            self.stats.record_callback(perf_counter()-start)
+
+    def update(self, time):
+        """The work of the block callback, for the block starting at time."""
+        if self.start_time is None:
+            self.start_time = time
+        time -= self.start_time
+        self.elapsed = time
         if self.hrtf:
             fade_target = self.environment
         else:
             fade_target = self.panner
+        if self.cancelled:
+            fade_target.mul.linear_ramp_to_value(fade_duration, 0.0)
+            self.engine.set_block_callback(None)
+            return
         normalized_time = time/self.duration
         if normalized_time >= 1.0:
             # Schedule a fade out on the panner.
             fade_target.mul.linear_ramp_to_value(0.2, 0.0)
-            self.server.set_block_callback(None)
+            self.engine.set_block_callback(None)
             self.finished = True
-        normalized_time = time/self.duration
-        x_range = self.max_x-self.min_x
-        x_offset = normalized_time*x_range
-        x = self.min_x+x_offset
-        y = self.min_y+(self.max_y-self.min_y)/2
-        evaluated = False
-        try:
-            tmp = self.f(x)
-            if isinstance(tmp, float):
-                evaluated = True
-                y = tmp
-        except Exception:
-            # We can't do anything reasonable here.
-            pass
-        if (y < self.min_y or y > self.max_y) and not self.faded_out:
+        self.schedule_events(time)
+        first = self.curve.index(time)
+        if self.progressive:
+            self.curve.cursor = first
+        for i in range(self.updates_per_block):
+            row = self.rows[min(first+i, self.curve.length-1)]
+            self.update_controls(row, time+i*self.curve.step, i*self.curve.step, fade_target)
+        # Position is a vector, which can't be automated, so it moves once per block.
+        out_of_range, in_range, evaluated, y, main_freq = self.rows[first]
+        if not out_of_range:
+            normalized_y = (y-self.min_y)/(self.max_y-self.min_y)
+            self.source.position = (self.engine.spread(2*normalized_time-1)/2, normalized_y-0.5, 0)
+
+    def update_controls(self, row, time, offset, fade_target):
+        """Apply one control update from the curve, offset seconds into the current block."""
+        out_of_range, in_range, evaluated, y, main_freq = row
+        if out_of_range and not self.faded_out:
             # Do a fast fade out.
-            fade_target.mul.linear_ramp_to_value(block_duration/2, 0.0)
+            self.fade(fade_target, offset, 1.0, 0.0)
             self.faded_out = True
             return
-        elif (y < self.min_y or y > self.max_y):
+        elif out_of_range:
             # If we accidentally update the oscillators, they can get set to odd and very expensive values.
             return
-        elif (self.min_y < y and y < self.max_y) and self.faded_out:
-            fade_target.mul.linear_ramp_to_value(block_duration/2, 1.0)
+        elif in_range and self.faded_out:
+            self.fade(fade_target, offset, 0.0, 1.0)
             self.faded_out = False
         if evaluated:
-            main_freq = compute_frequencies(y, self.min_y, self.max_y)
-            self.main_tone.frequency = main_freq
-            self.undefined_noise.mul = 0
-            self.main_tone.mul = main_volume
+            set_at(self.main_tone, "frequency", offset, main_freq)
+            set_at(self.undefined_noise, "mul", offset, 0)
+            set_at(self.main_tone, "mul", offset, main_volume)
         else:
-            self.undefined_noise.mul = undefined_noise_volume
-            self.main_tone.mul = 0
-        self.panner.azimuth = -(180/2)+normalized_time*180
-        normalized_y = (y-self.min_y)/(self.max_y-self.min_y)
-        self.source.position = (normalized_time-0.5, normalized_y-0.5, 0)
-        # Ticks.
-        if self.x_ticks:
-            prev = self.prev_x//self.x_ticks
-            now = x//self.x_ticks
-            if now != prev:
-                self.x_ticker.mul = 0.0
-                self.x_ticker.reset()
-                self.x_ticker.mul.linear_ramp_to_value(0.005, 0.5)
-                self.x_ticker.mul.linear_ramp_to_value(0.05, 0.0)
-        self.prev_x = x
-        if evaluated:
-            if self.y_ticks:
-                prev = self.prev_y//self.y_ticks
-                now = y//self.y_ticks
-                if now != prev:
-                    self.y_ticker.mul = 0.0
-                    self.y_ticker.reset()
-                    self.y_ticker.frequency = main_freq
-                    self.y_ticker.mul.linear_ramp_to_value(0.005, 0.5)
-                    self.y_ticker.mul.linear_ramp_to_value(0.05, 0.0)
-            if y < 0: y_sign = -1
-            elif y == 0: y_sign = 0
-            else: y_sign = 1
-            if self.zero_ticks:
-                if ((self.prev_y_sign != 0 and y_sign == 0) or
-                   ((abs(self.prev_y_sign-y_sign)) > 1)):
-                    self.zero_ticker.mul = 0.0
-                    self.zero_ticker.reset()
-                    self.zero_ticker.frequency = main_freq
-                    self.zero_ticker.mul.linear_ramp_to_value(0.05, 0.7)
-                    self.zero_ticker.mul.linear_ramp_to_value(0.1, 0.0)
-                    self.zero_ticker.frequency.linear_ramp_to_value(0.07, main_freq**semitone)
-            self.prev_y_sign = y_sign
-            self.prev_y = y
+            set_at(self.undefined_noise, "mul", offset, undefined_noise_volume)
+            set_at(self.main_tone, "mul", offset, 0)
+        set_at(self.panner, "azimuth", offset, (180/2)*self.engine.spread(2*time/self.duration-1))
+
+    def fade(self, node, offset, start, end):
+        """Fade node's mul from start to end, beginning offset seconds into the current block."""
+        if offset > 0:
+            # Automation starts now, so hold until the offset.
+            node.mul.linear_ramp_to_value(offset, start)
+        node.mul.linear_ramp_to_value(offset+fade_duration, end)
+
+    def current_events(self):
+        """The events.Timeline to play ticks from."""
+        return self.curve.events
+
+    def schedule_events(self, time):
+        """Schedule every tick which happens during the block starting at time, at its exact offset into the block.
+
+Automation times are relative to now, so a tick starts with a ramp which holds its ticker silent until the offset.
+Ticks in out of range blocks are scheduled too: they're silenced by the fade along with everything else.
+Each ticker fires at most once per block: a later tick on it in the same block would only cut the first one off."""
+        timeline = self.current_events()
+        times = timeline.time_list
+        if timeline is not self.events:
+            self.events = timeline
+            self.next_event = bisect.bisect_left(times, time)
+        end = time+self.block_duration
+        fired = set()
+        while self.next_event < len(times) and times[self.next_event] < end:
+            i = self.next_event
+            self.next_event += 1
+            kind = timeline.kind_list[i]
+            if kind in fired:
+                continue
+            fired.add(kind)
+            offset = max(times[i]-time, 0.0)
+            frequency = timeline.frequency_list[i]
+            if kind == events.x_tick:
+                self.fire(self.x_ticker, offset, 0.005, 0.05, 0.5)
+            elif kind == events.y_tick:
+                self.y_ticker.frequency = frequency
+                self.fire(self.y_ticker, offset, 0.005, 0.05, 0.5)
+            else:
+                self.zero_ticker.frequency = frequency
+                self.zero_ticker.frequency.linear_ramp_to_value(offset, frequency)
+                self.zero_ticker.frequency.linear_ramp_to_value(offset+0.07, frequency**semitone)
+                self.fire(self.zero_ticker, offset, 0.05, 0.1, 0.7)
+
+    def fire(self, ticker, offset, attack, release, peak):
+        """Schedule one tick on ticker, starting offset seconds from now."""
+        ticker.mul = 0.0
+        ticker.reset()
+        ticker.mul.linear_ramp_to_value(offset, 0.0)
+        ticker.mul.linear_ramp_to_value(offset+attack, peak)
+        ticker.mul.linear_ramp_to_value(offset+release, 0.0)
 
     def write_file(self, file):
         """Output to a file. .wav or .ogg."""
         self.server.write_file(path = file, channels = 2, duration = self.duration+0.5)
 
     def to_audio_device(self):
-        self.server.set_output_device(channels = 2, mixahead = 10)
+        self.engine.to_audio_device()
+
+    def progress(self):
+        """How much of the graph has been played or rendered, from 0 to 1."""
+        if self.finished:
+            return 1.0
+        return min(self.elapsed/self.duration, 1.0)
+
+    def cancel(self):
+        """Stop the graph: it fades out at the next block, and stops updating.  A file being written finishes, but silently: the caller should throw it away."""
+        self.cancelled = True
 
     def shutdown(self):
-        self.server.clear_output_device()
-        # the following is necessary to avoid a circular reference.
-        self.server.set_block_callback(None)
+        if self.progressive:
+            self.curve.stop()
+        if self.owns_engine:
+            self.engine.shutdown()
+        else:
+            self.engine.release()
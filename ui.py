@@ -1,11 +1,39 @@
-"""This file implements the UI, using the helper modules."""
+"""This file implements the UI, using the helper modules.
+
+Sympy is slow to import, so it's only imported when an equation needs it.  See fastpath."""
+import asyncio
+import json
+import math
+import os
 import sys
 import traceback
 import command_parser
 import sonifier
-import sympy
-from sympy.utilities.lambdify import lambdify, lambdastr
-from sympy.parsing import sympy_parser
+import offline
+import batch
+import render_cache
+import expression_cache
+import fastpath
+import jobs
+import datasource
+import multigraph
+import rangeindex
+import autorange
+import backends
+import controlfile
+
+def graph_for(f, engine, settings, audio_engine = None, progressive = False, previous = None):
+    """Make a graph of f with the given engine and settings.  See Ui.make_graph.
+
+f can be a list of callables, to graph several curves at once.
+previous is a list of sonifier.Curve from earlier graphs to reuse values from.  Only the realtime engine uses it."""
+    if isinstance(f, list):
+        if engine == "offline":
+            raise ValueError("The offline engine can only graph one equation at a time.")
+        return multigraph.MultiSonifier(fs = f, engine = audio_engine, previous = previous, **settings)
+    if engine == "offline":
+        return offline.Renderer(f = f, **settings)
+    return sonifier.Sonifier(f = f, engine = audio_engine, progressive = progressive, previous = previous, **settings)
 
 class Ui(command_parser.CommandParserBase):
 
@@ -22,17 +50,57 @@ class Ui(command_parser.CommandParserBase):
         self.x_ticks = None
         self.y_ticks = None
         self.zero_ticks = False
-        self.x_symbol, self.y_symbol = sympy.symbols("x, y")
+        self.block_size = sonifier.block_size
+        self.control_interval = sonifier.block_size
+        # Playing only; files are always computed in full.
+        self.progressive = False
+        # The datasource.DataSource loaded with .data, if any.
+        self.data = None
+        self._x_symbol = None
         self.current_graph = None
+        # The curves of the last graph played, so that playing the same equation again with different settings doesn't start from scratch.  See sonifier.Curve.
+        self.last_curves = None
+        # Made when the first graph is played, then reused for every graph after it.
+        self.audio_engine = None
         self.debug = False
+        self.engine = "realtime"
+        # The instrumentation.Stats of the most recent graph, and whether .file saves them next to each render.
+        self.last_stats = None
+        self.stats_json = False
+        self.workers = 1
+        self.cache = render_cache.RenderCache(render_cache.default_directory())
+        self.expressions = expression_cache.ExpressionCache()
+        self.expressions_path = None
+        # "auto", or one of backends.names.  See .help backend.
+        self.backend = "auto"
+        # The backend the most recently compiled equation was compiled with.
+        self.last_backend = None
+        # The binary file object .file - writes to.  None means the process's standard output, even while print is redirected.
+        self.pipe = None
+        # The jobs.JobQueue .file renders on.  Only exists while the interactive command loop runs; otherwise .file renders before returning.
+        self.jobs = None
+        # What .play, .zoom, .seek and .where work on: the f of the last graph played from scratch and its x range,
+        # the range .zoom narrowed that to, if any, and a rangeindex.Series of f, made when first needed.
+        self.navigation = None
+        self.navigation_range = None
+        self.zoomed = None
+        self.series = None
 
+    @property
+    def x_symbol(self):
+        if self._x_symbol is None:
+            import sympy
+            self._x_symbol = sympy.Symbol("x")
+        return self._x_symbol
 
     def parse(self, equation):
+        from sympy.parsing import sympy_parser
         return sympy_parser.parse_expr(equation, transformations = 
             sympy_parser.standard_transformations + (sympy_parser.implicit_multiplication,
                 sympy_parser.function_exponentiation))
 
-    def make_graph(self, equation):
+    def expression(self, equation):
+        """Parse an equation and check that it only uses x.  Prints an error and returns None if it doesn't."""
         sym = self.parse(equation)
         if len(sym.free_symbols) > 1 or (len(sym.free_symbols) == 1 and self.x_symbol not in sym.free_symbols):
             symbols = set(sym.free_symbols)-{self.x_symbol}
@@ -40,21 +108,196 @@ class Ui(command_parser.CommandParserBase):
             print(" ".join((str(i) for i in sorted(list(symbols)))))
             print("Expressions must only use the variable x.")
             return
-        f = lambdify((self.x_symbol, ), sym)
-        return sonifier.Sonifier(f = f, duration = self.duration, min_x = self.min_x,
+        return sym
+
+    def compiled(self, equation):
+        """Returns the expression_cache.Compiled for an equation, or prints an error and returns None.
+
+Equations we've seen before, or which parse to an expression we've seen before, come from self.expressions.
+Equations fastpath understands are compiled without sympy, unless a backend other than numpy was asked for.
+Unless the backend is auto, the equation and form are cached prefixed with it, so that each backend has its own entries."""
+        prefix = "" if self.backend == "auto" else self.backend+":"
+        compiled = self.expressions.get(prefix+equation)
+        if compiled is None:
+            compiled = self.compile_uncached(equation, prefix)
+        if compiled is not None:
+            self.last_backend = compiled.backend
+        return compiled
+
+    def compile_uncached(self, equation, prefix):
+        """The part of compiled which happens when the equation as typed isn't in the cache."""
+        if self.backend in {"auto", "numpy"}:
+            fast = fastpath.compile(equation)
+            if fast is not None:
+                form, source, f = fast
+                compiled = self.expressions.get_form(form)
+                if compiled is None:
+                    compiled = expression_cache.Compiled(form, f, source)
+                self.expressions.put(prefix+equation, compiled)
+                return compiled
+        import sympy
+        sym = self.expression(equation)
+        if sym is None:
+            return
+        form = prefix+sympy.srepr(sym)
+        compiled = self.expressions.get_form(form)
+        if compiled is None:
+            if self.backend == "auto":
+                backend, raw = backends.choose(sym, self.x_symbol)
+            else:
+                backend, raw = self.backend, backends.generate(sym, self.x_symbol, self.backend)
+            compiled = expression_cache.Compiled(form, raw, backend = backend)
+        self.expressions.put(prefix+equation, compiled)
+        return compiled
+
+    def compiled_all(self, equation):
+        """Returns a list of expression_cache.Compiled, one for each of the equations separated by ; in equation, or prints an error and returns None."""
+        equations = [e.strip() for e in equation.split(";") if e.strip()]
+        if not equations:
+            print("There's no equation.")
+            return
+        compiled = []
+        for e in equations:
+            c = self.compiled(e)
+            if c is None:
+                return
+            compiled.append(c)
+        return compiled
+
+    def compile(self, equation):
+        """Turn an equation into a callable, or print an error and return None.
+
+The callable accepts NumPy arrays, so that the whole graph can be evaluated at once."""
+        compiled = self.compiled(equation)
+        if compiled is None:
+            return
+        return compiled.f
+
+    def graph_settings(self):
+        """The current settings, as keyword arguments for sonifier.Sonifier."""
+        return dict(duration = self.duration, min_x = self.min_x,
             max_x = self.max_x, min_y = self.min_y, max_y = self.max_y,
-            hrtf = self.hrtf, x_ticks = self.x_ticks, y_ticks = self.y_ticks, zero_ticks = self.zero_ticks)
+            hrtf = self.hrtf, x_ticks = self.x_ticks, y_ticks = self.y_ticks, zero_ticks = self.zero_ticks,
+            block_size = self.block_size, control_interval = self.control_interval)
+
+    def settings(self):
+        """A snapshot of everything which affects how a graph is rendered, as a dict.  See restore."""
+        settings = self.graph_settings()
+        settings["engine"] = self.engine
+        settings["debug"] = self.debug
+        settings["cache"] = self.cache
+        settings["stats_json"] = self.stats_json
+        settings["backend"] = self.backend
+        # The loaded data, as (path, column), since the file's open handles can't be copied to another process.
+        settings["data"] = None if self.data is None else (self.data.path, self.data.column)
+        return settings
+
+    def restore(self, settings):
+        """Apply a snapshot from settings.  Loaded data is opened again, unless it's the same file and column that's already loaded."""
+        for name, value in settings.items():
+            if name == "data":
+                if value is None:
+                    self.data = None
+                elif self.data is None or (self.data.path, self.data.column) != tuple(value):
+                    self.data = datasource.DataSource(*value)
+            else:
+                setattr(self, name, value)
+
+    def make_graph(self, equation, engine = "realtime", audio_engine = None, progressive = False):
+        """Make a graph for equation.
+
+engine is "realtime" for a sonifier.Sonifier or "offline" for an offline.Renderer.  Only the realtime engine can play to the sound card.
+Several equations separated by ; make a multigraph.MultiSonifier, which is realtime only.
+audio_engine and progressive are passed on to sonifier.Sonifier."""
+        compiled = self.compiled_all(equation)
+        if compiled is None:
+            return
+        f = compiled[0].f if len(compiled) == 1 else [c.f for c in compiled]
+        return graph_for(f, engine, self.graph_settings(), audio_engine = audio_engine, progressive = progressive)
+
+    async def run_async(self):
+        self.jobs = jobs.JobQueue(self.workers)
+        try:
+            await super().run_async()
+            if self.jobs.running or self.jobs.queued:
+                print("Waiting for {} job(s) to finish.".format(self.jobs.running+len(self.jobs.queued)))
+                await self.jobs.wait()
+        except asyncio.CancelledError:
+            # Ctrl-C.  Don't keep the process alive finishing renders nobody will wait for.
+            for id in list(self.jobs.jobs):
+                self.jobs.cancel(id)
+            raise
+        finally:
+            self.jobs = None
+
+    def stop_graph(self):
+        """Stop the current graph, and return the audio engine the next one should play through."""
+        if self.current_graph is not None:
+            self.current_graph.shutdown()
+            self.current_graph = None
+        if self.audio_engine is not None and self.audio_engine.block_size != self.block_size:
+            self.audio_engine.shutdown()
+            self.audio_engine = None
+        if self.audio_engine is None:
+            self.audio_engine = sonifier.AudioEngine(block_size = self.block_size)
+        return self.audio_engine
+
+    def play(self, f, **changes):
+        """Play f to the sound card, with the current settings except for changes."""
+        audio_engine = self.stop_graph()
+        settings = self.graph_settings()
+        settings.update(changes)
+        self.current_graph = graph_for(f, "realtime", settings, audio_engine = audio_engine, progressive = self.progressive, previous = self.last_curves)
+        self.last_curves = getattr(self.current_graph, "curves", [self.current_graph.curve])
+        self.last_stats = self.current_graph.stats
+        self.current_graph.to_audio_device()
+
+    def navigate(self, f):
+        """Make f, graphed over the current x range, what .play, .zoom, .seek and .where work on."""
+        self.navigation = f
+        self.navigation_range = (self.min_x, self.max_x)
+        self.zoomed = None
+        self.series = None
+
+    def navigation_series(self):
+        """The rangeindex.Series for what we're navigating, evaluating it the first time.  For several curves, it's of the first."""
+        if self.series is None:
+            f = self.navigation[0] if isinstance(self.navigation, list) else self.navigation
+            self.series = rangeindex.Series(f, *self.navigation_range)
+        return self.series
+
+    def view(self):
+        """The x range being navigated: the zoomed range, or the whole graph."""
+        return self.zoomed if self.zoomed is not None else self.navigation_range
+
+    def ticks_fit(self, min_x, max_x, duration):
+        """Whether the x and y ticks are coarse enough for playing from min_x to max_x over duration seconds.  If not, prints why.  See sonifier.check_ticks."""
+        try:
+            sonifier.check_ticks(self.x_ticks, min_x, max_x, duration, self.control_interval, "x ticks")
+            sonifier.check_ticks(self.y_ticks, self.min_y, self.max_y, duration, self.control_interval, "y ticks")
+        except ValueError as e:
+            print(e)
+            return False
+        return True
+
+    def play_range(self, min_x, max_x, duration):
+        """Play what we're navigating from min_x to max_x over duration seconds, from the series when it's fine enough."""
+        f = self.navigation
+        if not isinstance(f, list):
+            points = int(duration*sonifier.sr/self.control_interval)+1
+            f = self.navigation_series().source(min_x, max_x, points)
+        self.play(f, min_x = min_x, max_x = max_x, duration = duration)
 
     def do_default(self, argument):
         try:
             print("Graphing ", argument)
-            if self.current_graph is not None:
-                self.current_graph.shutdown()
-            self.current_graph = self.make_graph(argument)
-            if self.current_graph is None:
+            compiled = self.compiled_all(argument)
+            if compiled is None:
                 # We couldn't parse it.
                 return
-            self.current_graph.to_audio_device()
+            f = compiled[0].f if len(compiled) == 1 else [c.f for c in compiled]
+            self.navigate(f)
+            self.play(f)
         except Exception as e:
             if self.debug:
                 exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -65,6 +308,10 @@ class Ui(command_parser.CommandParserBase):
     def quit_hook(self):
         if self.current_graph:
             self.current_graph.shutdown()
+        if self.audio_engine is not None:
+            self.audio_engine.shutdown()
+        if self.expressions_path is not None:
+            self.expressions.save(self.expressions_path)
 
     def do_xrange(self, argument):
         """Set the range for x.
@@ -96,12 +343,33 @@ Floating point arguments are allowed."""
 Syntax:
 .yrange: Show the current range for y.
 .yrange <min> <max>: configure us to show values of the function between y=min and y=max.
+.yrange auto: Fit the range to the last graph, over the current x range.
+.yrange auto <equation>: Fit the range to equation, over the current x range.
 
-Floating point arguments are allowed."""
+Floating point arguments are allowed.
+Fitting ignores poles and the spikes beside them, so that the rest of the graph isn't squashed flat."""
         if len(argument) == 0:
             print("Range is {} <= y <= {}".format(self.min_y, self.max_y))
             return
         words = argument.split()
+        if words[0] == "auto":
+            equation = argument[len("auto"):].strip()
+            if equation:
+                compiled = self.compiled_all(equation)
+                if compiled is None:
+                    return
+                f = compiled[0].f if len(compiled) == 1 else [c.f for c in compiled]
+            elif self.navigation is None:
+                print("Nothing has been graphed yet.  Use .yrange auto <equation>.")
+                return
+            else:
+                f = self.navigation
+            fitted = self.fit_y_range(f)
+            if fitted is None:
+                return
+            self.min_y, self.max_y = fitted
+            print("Range is {} <= y <= {}".format(self.min_y, self.max_y))
+            return
         try:
             min = float(words[0])
             max = float(words[1])
@@ -114,6 +382,20 @@ Floating point arguments are allowed."""
         self.min_y = min
         self.max_y = max
 
+    def fit_y_range(self, f):
+        """Returns a y range which fits f over the current x range, or prints an error and returns None.  See autorange."""
+        if isinstance(f, datasource.DataSource):
+            if math.isnan(f.min):
+                print("The data is undefined everywhere, so there's no range to fit.")
+                return None
+            # The summary already has the exact extremes.  The range is strict, and a flat series still needs some room.
+            margin = (f.max-f.min)*0.01 or 1.0
+            return f.min-margin, f.max+margin
+        fitted = autorange.y_range(f, self.min_x, self.max_x)
+        if fitted is None:
+            print("The graph is undefined everywhere from x = {} to {}, so there's no range to fit.".format(self.min_x, self.max_x))
+        return fitted
+
     def do_duration(self, argument):
         """Set the duration of the graph.
 syntax:
@@ -137,15 +419,578 @@ syntax:
         
 syntax:
 .file <name> <equation>: Graph equation to file name.
+.file auto <name> <equation>: The same, with the y range fitted to equation.  The fitted range is only used for this file.  See .help yrange.
+.file - <equation>: Write the graph to standard output as a .wav, as it's rendered, for piping to a player or another program.  Also works with auto.
+
+The file name must not contain spaces and must end in .wav, .ogg or .agc.  It will be written to the current working directory.
+The offline engine can only write .wav files.  See .help engine.
+.agc files are control files: the pitches, volumes, panning and ticks of the graph rather than its audio, about a hundredth of the size of a .wav.
+They're always made with the offline engine, and render to the same audio it would write, with python controlfile.py <file.agc> <file.wav>.
+Use data as the equation to graph the file loaded with .data.
+Several equations separated by ; are graphed together, as when playing them.
 
-The file name must not contain spaces and must end in .wav or .ogg.  It will be written to the current working directory."""
+Writing to standard output always uses the offline engine and one equation, and isn't cached.  It finishes before the next command runs.
+It renders a second at a time, so memory use doesn't depend on the duration.  Run python audiograph.py --stdout to keep everything else off standard output.
+
+At the prompt, files render in the background while you keep working.  See .help jobs."""
+        fit = argument.startswith("auto ")
+        if fit:
+            argument = argument[len("auto "):].lstrip()
         fname, sep, equation = argument.partition(" ")
         if len(fname) == 0 or len(equation) == 0:
             print("Invalid syntax. See .help file.")
-        graph = self.make_graph(equation)
-        graph.write_file(fname)
-        graph.shutdown()
+            return
+        engine = self.engine
+        stream = fname == "-"
+        if stream or fname.lower().endswith(controlfile.extension):
+            engine = "offline"
+        elif engine == "offline" and not fname.lower().endswith(".wav"):
+            print("The offline engine can only write .wav files. Use .engine realtime for .ogg.")
+            return
+        settings = self.graph_settings()
+        key = extension = None
+        if equation == "data":
+            if self.data is None:
+                print("No data is loaded.  See .help data.")
+                return
+            # Data files are cheap to graph again and expensive to hash, so they aren't cached.
+            f = self.data
+        else:
+            compiled = self.compiled_all(equation)
+            if compiled is None:
+                return
+            if len(compiled) > 1 and stream:
+                print("Only one equation at a time can be written to standard output.")
+                return
+            if len(compiled) > 1 and engine == "offline":
+                print("The offline engine can only graph one equation at a time. Use .engine realtime for several, and a .wav or .ogg file.")
+                return
+            form = ";".join(c.form for c in compiled)
+            f = compiled[0].f if len(compiled) == 1 else [c.f for c in compiled]
+        if fit:
+            fitted = self.fit_y_range(f)
+            if fitted is None:
+                return
+            settings["min_y"], settings["max_y"] = fitted
+            print("Graphing {} with {} <= y <= {}".format(fname, *fitted))
+        if stream:
+            self.stream(f, settings)
+            return
+        if self.cache.enabled and equation != "data":
+            extension = os.path.splitext(fname)[1].lower()
+            engine_version = offline.version if engine == "offline" else sonifier.version
+            if extension == controlfile.extension:
+                engine_version = [engine_version, controlfile.version]
+            key = self.cache.key(form, settings, engine, engine_version)
+            if self.cache.fetch(key, extension, fname):
+                return
+        debug = self.debug
+        def work(job):
+            try:
+                self.render_file(fname, f, engine, settings, key, extension, job)
+            except Exception:
+                if debug:
+                    traceback.print_exc()
+                raise
+        if self.jobs is None:
+            work(None)
+        else:
+            self.jobs.submit(fname, work)
+
+    def render_file(self, fname, f, engine, settings, key, extension, job = None):
+        """Render f to fname, storing it in the cache under key unless key is None.
+
+If job is a jobs.Job, this is running in the background: it can be cancelled, in which case nothing is written."""
+        graph = graph_for(f, engine, settings)
+        if job is not None:
+            job.attach(graph)
+        if key is None:
+            destination = fname
+        else:
+            destination = self.cache.temporary(extension)
+        try:
+            graph.write_file(destination)
+            graph.shutdown()
+            if job is not None and job.cancelled:
+                return
+            if key is not None:
+                self.cache.store(key, extension, destination, fname)
+            self.rendered(fname, graph)
+        finally:
+            if key is not None and os.path.exists(destination):
+                os.remove(destination)
+            elif key is None and job is not None and job.cancelled and os.path.exists(destination):
+                os.remove(destination)
+
+    def stream(self, f, settings):
+        """Write f to self.pipe as a .wav, a piece at a time.  See offline.Streamer."""
+        pipe = self.pipe if self.pipe is not None else sys.__stdout__.buffer
+        graph = offline.Streamer(f = f, **settings)
+        try:
+            graph.write_file(pipe)
+            pipe.flush()
+        except BrokenPipeError:
+            # Whatever was reading stopped early, such as a player being closed.
+            print("Standard output was closed before the graph finished.")
+        self.last_stats = graph.stats
+
+    def rendered(self, fname, graph):
+        """Called after graph has been rendered to fname."""
+        self.last_stats = graph.stats
+        if self.stats_json:
+            with open(fname+".stats.json", "w") as f:
+                json.dump(graph.stats.to_dict(), f, indent = 1)
+
+    def do_stats(self, argument):
+        """Show timing for the last graph.
+
+Syntax:
+.stats: Show how long the last graph or file took to compute, and whether the block callback kept up.
+.stats json on: With every .file, also write <file>.stats.json with the same information.
+.stats json off: Stop writing .stats.json files.
+
+A callback which misses its deadline is a dropout when playing to the sound card.
+Files rendered from the cache don't have stats, because nothing was computed."""
+        words = argument.split()
+        if words == ["json", "on"]:
+            self.stats_json = True
+        elif words == ["json", "off"]:
+            self.stats_json = False
+        elif len(words) == 0:
+            if self.last_stats is None:
+                print("Nothing has been graphed yet.")
+                return
+            for line in self.last_stats.report():
+                print(line)
+        else:
+            print("Invalid syntax. See .help stats.")
+
+    def do_cache(self, argument):
+        """Manage the cache of rendered files.
+
+Syntax:
+.cache stats: Show how big the cache is and how often it has been used this session.
+.cache clear: Delete everything in the cache.
+.cache limit: Show the size limit.
+.cache limit <MB>: Set the size limit in megabytes.  0 turns the cache off.
+
+Rendering the same equation with the same settings twice copies the first render instead of rendering again.
+When the cache is over its limit, the files used least recently are deleted."""
+        words = argument.split()
+        if words == ["stats"]:
+            entries, size = self.cache.stats()
+            print("{} files, {:.1f} of {:.1f} MB, in {}".format(entries, size/1024**2, self.cache.limit/1024**2, self.cache.directory))
+            print("{} hits and {} misses this session.".format(self.cache.hits, self.cache.misses))
+        elif words == ["clear"]:
+            self.cache.clear()
+            print("Cache cleared.")
+        elif words == ["limit"]:
+            print("The cache is limited to {:.1f} MB.".format(self.cache.limit/1024**2))
+        elif len(words) == 2 and words[0] == "limit":
+            try:
+                limit = float(words[1])
+            except ValueError:
+                print("Invalid syntax. See .help cache.")
+                return
+            if limit < 0:
+                print("The limit can't be negative.")
+                return
+            self.cache.limit = int(limit*1024**2)
+            self.cache.evict()
+        else:
+            print("Invalid syntax. See .help cache.")
+
+    def run_batch(self, lines):
+        if self.workers > 1:
+            batch.run(self, lines, self.workers)
+        else:
+            super().run_batch(lines)
+
+    def do_workers(self, argument):
+        """Set how many files .batch renders at once.
+
+Syntax:
+.workers: Show the number of workers.
+.workers <number>: Render up to number files at once.
+
+With more than 1 worker, .batch renders the .file lines of a script in parallel, each with the settings in effect on its line.  Output is still printed in script order.
+At the prompt, this is also how many background jobs run at once.  See .help jobs."""
+        if len(argument) == 0:
+            print("Batch scripts use {} worker(s).".format(self.workers))
+            return
+        try:
+            workers = int(argument)
+        except ValueError:
+            print("Invalid syntax. See .help workers.")
+            return
+        if workers < 1:
+            print("There must be at least 1 worker.")
+            return
+        self.workers = workers
+        if self.jobs is not None:
+            self.jobs.set_workers(workers)
+
+    def do_jobs(self, argument):
+        """Show files being rendered in the background.
+
+Syntax:
+.jobs: List every job, with how far along running jobs are.
+.jobs clear: Forget finished jobs.
+
+.file renders in the background, so you can keep graphing while files are written.  Jobs are numbered, and .cancel stops them."""
+        if self.jobs is None:
+            print("There are no background jobs outside the interactive prompt.")
+            return
+        if argument == "clear":
+            self.jobs.clear()
+        elif len(argument) == 0:
+            lines = self.jobs.report()
+            if not lines:
+                print("No jobs.")
+            for line in lines:
+                print(line)
+        else:
+            print("Invalid syntax. See .help jobs.")
+
+    def do_cancel(self, argument):
+        """Cancel background jobs.
+
+Syntax:
+.cancel <id>: Cancel the job with this number.  See .jobs.
+.cancel all: Cancel every job which hasn't finished.
+
+A cancelled job doesn't write its file."""
+        if self.jobs is None:
+            print("There are no background jobs outside the interactive prompt.")
+            return
+        if argument == "all":
+            ids = list(self.jobs.jobs)
+        else:
+            try:
+                ids = [int(argument)]
+            except ValueError:
+                print("Invalid syntax. See .help cancel.")
+                return
+        cancelled = [id for id in ids if self.jobs.cancel(id)]
+        if argument != "all" and not cancelled:
+            print("There is no unfinished job {}.".format(argument))
+
+    def do_expressions(self, argument):
+        """Manage the cache of compiled equations.
+
+Syntax:
+.expressions stats: Show how often equations were found already compiled.
+.expressions clear: Forget every compiled equation.
+.expressions save on: Keep compiled equations between sessions.
+.expressions save off: Stop keeping compiled equations between sessions.
+
+Graphing an equation you've already entered, or another way of writing the same thing, skips parsing and compiling it."""
+        words = argument.split()
+        if words == ["stats"]:
+            e = self.expressions
+            print("{} equations and {} expressions cached.".format(len(e.equations), len(e.forms)))
+            print("{} hits, {} hits on another way of writing the same expression, and {} misses this session.".format(e.hits, e.form_hits, e.misses))
+            if self.expressions_path is not None:
+                print("Saving to", self.expressions_path)
+        elif words == ["clear"]:
+            self.expressions.clear()
+            if self.expressions_path is not None and os.path.exists(self.expressions_path):
+                os.remove(self.expressions_path)
+            print("Expression cache cleared.")
+        elif words == ["save", "on"]:
+            self.expressions_path = expression_cache.default_path()
+            self.expressions.load(self.expressions_path)
+        elif words == ["save", "off"]:
+            self.expressions_path = None
+        else:
+            print("Invalid syntax. See .help expressions.")
+
+    def do_backend(self, argument):
+        """Choose how equations are compiled.
+
+Syntax:
+.backend: Show the current backend, and the one the last equation was compiled with.
+.backend auto: Time the backends which sound the same on a sample of points, and use the fastest.  The default.
+.backend numpy: Evaluate the whole graph at once with NumPy.
+.backend cse: The same, but compute repeated parts of the equation once.  Helps with big equations.
+.backend math: Evaluate one point at a time with Python's math module.  Division by zero and overflow are undefined rather than out of range.
+.backend mpmath: Evaluate one point at a time with 30 digits of precision.  Slow, but accurate next to singularities.
+
+Equations are compiled again for a new backend the first time they're graphed with it."""
+        if argument == "auto" or argument in backends.names:
+            self.backend = argument
+        elif len(argument) == 0:
+            print("The backend is {}.".format(self.backend))
+            if self.last_backend is not None:
+                print("The last equation was compiled with {}.".format(self.last_backend))
+        else:
+            print("Invalid syntax. See .help backend.")
+
+    def do_engine(self, argument):
+        """Choose how .file renders.
+
+Syntax:
+.engine: Show the current engine.
+.engine realtime: Render with Libaudioverse, exactly as graphs sound when played.
+.engine offline: Render directly, many times faster than realtime.
+
+The offline engine approximates Libaudioverse's oscillators and panning closely but not exactly, and only writes .wav files.  HRTF is approximated with ordinary panning."""
+        if argument in {"realtime", "offline"}:
+            self.engine = argument
+        elif len(argument) == 0:
+            print("Rendering files with the {} engine.".format(self.engine))
+        else:
+            print("Invalid syntax. See .help engine.")
+
+
+    def do_blocksize(self, argument):
+        """Set the block size.
+
+Syntax:
+.blocksize: Show the block size and control interval.
+.blocksize <samples>: Process audio in blocks of this many samples.
+
+Larger blocks use less CPU, because there are fewer block callbacks, at the cost of latency.
+The control interval is set to match, unless it still divides the new block size.  See .help control."""
+        if len(argument) == 0:
+            print("Blocks are {} samples, and controls are updated every {} samples.".format(self.block_size, self.control_interval))
+            return
+        try:
+            block_size = int(argument)
+        except ValueError:
+            print("Invalid syntax. See .help blocksize.")
+            return
+        control_interval = self.control_interval
+        if block_size < 1 or block_size%control_interval:
+            control_interval = block_size
+        try:
+            sonifier.check_resolution(block_size, control_interval)
+        except ValueError as e:
+            print(e)
+            return
+        self.block_size = block_size
+        self.control_interval = control_interval
 
+    def do_control(self, argument):
+        """Set how often the tone, panning and fades are updated.
+
+Syntax:
+.control: Show the control interval.
+.control <samples>: Update controls every this many samples.  It must divide the block size.
+
+Updates inside a block are scheduled ahead of time, so a large block size with a small control interval sounds as smooth as small blocks, for less CPU.
+For example, .blocksize 1024 and .control 128 sound like the defaults."""
+        if len(argument) == 0:
+            print("Controls are updated every {} samples, {:.0f} times a second.".format(self.control_interval, sonifier.sr/self.control_interval))
+            return
+        try:
+            control_interval = int(argument)
+        except ValueError:
+            print("Invalid syntax. See .help control.")
+            return
+        try:
+            sonifier.check_resolution(self.block_size, control_interval)
+        except ValueError as e:
+            print(e)
+            return
+        self.control_interval = control_interval
+
+    def do_progressive(self, argument):
+        """Start playing slow equations before they're fully computed.
+
+Syntax:
+.progressive: Show whether progressive mode is on.
+.progressive on: Play after computing a few points, and compute the rest while playing.
+.progressive off: Compute the whole graph before playing.
+
+With progressive mode on, the first sound takes about as long whatever the equation.  Until the graph is fully computed, parts of it may be approximate and only x ticks play.
+Files are always computed in full."""
+        if argument in {"on", "off"}:
+            self.progressive = argument == "on"
+        elif len(argument) == 0:
+            print("Progressive mode is {}.".format("on" if self.progressive else "off"))
+        else:
+            print("Invalid syntax. See .help progressive.")
+
+    def do_data(self, argument):
+        """Graph recorded data from a file.
+
+Syntax:
+.data: Show what's loaded.
+.data <file>: Load a file, set the x and y ranges to cover it, and play it.
+.data <file> <column>: The same, for a column of a CSV file other than the last.  Columns count from 0.
+.data play: Play the loaded data again, with the current settings.
+.data off: Forget the loaded data.
+
+Files can be .npy, raw .f32 or .f64, or .csv and .txt with one row per point.  x is the number of the point, starting from 0.
+Files of any size work: they're never read into memory whole.  The first time a file is loaded, a summary of it is saved next to it, which takes a few seconds for hundreds of millions of points.
+Use data as the equation for .file to write it to a file."""
+        words = argument.split()
+        if len(words) == 0:
+            if self.data is None:
+                print("No data is loaded.")
+            else:
+                print("{}: {} points, from {} to {}.".format(self.data.path, self.data.count, self.data.min, self.data.max))
+            return
+        if words == ["off"]:
+            self.data = None
+            return
+        if words != ["play"]:
+            if len(words) > 2:
+                print("Invalid syntax. See .help data.")
+                return
+            try:
+                column = int(words[1]) if len(words) == 2 else -1
+                data = datasource.DataSource(words[0], column)
+            except (OSError, ValueError) as e:
+                print("Couldn't load {}: {}".format(words[0], e))
+                return
+            self.data = data
+            self.min_x, self.max_x = 0, max(data.count-1, 1)
+            self.min_y, self.max_y = self.fit_y_range(data)
+            print("Loaded {} points.  x is from {} to {}, and y from {} to {}.".format(data.count, self.min_x, self.max_x, self.min_y, self.max_y))
+        elif self.data is None:
+            print("No data is loaded.")
+            return
+        try:
+            self.navigate(self.data)
+            self.play(self.data)
+        except Exception:
+            if self.debug:
+                traceback.print_exc()
+            else:
+                print("Couldn't play the data.")
+
+    def do_play(self, argument):
+        """Play the last graph again.
+
+Syntax:
+.play: Play the last graph, or the part of it .zoom chose, with the current settings.
+
+The equation isn't parsed or compiled again.  To graph it over a different x range, use .zoom, or .xrange and enter it again."""
+        if self.navigation is None:
+            print("Nothing has been graphed yet.")
+            return
+        try:
+            min_x, max_x = self.view()
+            self.play_range(min_x, max_x, self.duration)
+        except Exception:
+            if self.debug:
+                traceback.print_exc()
+            else:
+                print("Couldn't play the graph.")
+
+    def do_zoom(self, argument):
+        """Play part of the last graph.
+
+Syntax:
+.zoom: Show the part being played.
+.zoom <min> <max>: Play the last graph from x=min to x=max, over the whole duration.
+.zoom out: Go back to the whole graph, and play it.
+The zoom is refused if the x or y ticks would be finer than one per control update over the new range.  See .help xticks.
+
+Zooming reuses the values computed for .where, so it starts almost at once unless the part is too small for them to be fine enough, when the equation is evaluated over just that part."""
+        if self.navigation is None:
+            print("Nothing has been graphed yet.")
+            return
+        words = argument.split()
+        if len(words) == 0:
+            min_x, max_x = self.view()
+            print("Playing {} <= x <= {}".format(min_x, max_x))
+            return
+        if words == ["out"]:
+            zoomed = None
+            min_x, max_x = self.navigation_range
+        else:
+            try:
+                min_x, max_x = float(words[0]), float(words[1])
+            except (ValueError, IndexError):
+                print("Couldn't parse.  See .help zoom for syntax.")
+                return
+            if min_x >= max_x:
+                print("Error: min must be strictly less than max.")
+                return
+            zoomed = (min_x, max_x)
+        if not self.ticks_fit(min_x, max_x, self.duration):
+            return
+        self.zoomed = zoomed
+        self.do_play("")
+
+    def do_seek(self, argument):
+        """Play the last graph from a point.
+
+Syntax:
+.seek <x>: Play from x to the end of the graph, or of the part .zoom chose, at the speed it normally plays at.
+Like .zoom, this is refused if the ticks would be too fine over the shorter duration."""
+        if self.navigation is None:
+            print("Nothing has been graphed yet.")
+            return
+        try:
+            x = float(argument)
+        except ValueError:
+            print("Couldn't parse.  See .help seek for syntax.")
+            return
+        min_x, max_x = self.view()
+        if not min_x <= x < max_x:
+            print("x must be at least {} and less than {}.".format(min_x, max_x))
+            return
+        duration = self.duration*(max_x-x)/(max_x-min_x)
+        if not self.ticks_fit(x, max_x, duration):
+            return
+        try:
+            self.play_range(x, max_x, duration)
+        except Exception:
+            if self.debug:
+                traceback.print_exc()
+            else:
+                print("Couldn't play the graph.")
+
+    def do_where(self, argument):
+        """Find things on the last graph.
+
+Syntax:
+.where max: Where the last graph is highest.
+.where min: Where it is lowest.
+.where zeros: Where it crosses 0.
+.where <max|min|zeros> <min x> <max x>: The same, between two values of x.
+
+Without x values, this looks at the part .zoom chose, or the whole graph.  For several equations, it looks at the first.
+The graph is evaluated once, at 65536 points, the first time it's needed.  After that, each answer is found without evaluating it again.
+Positions are accurate to about 1/65536 of the x range the equation was entered with."""
+        if self.navigation is None:
+            print("Nothing has been graphed yet.")
+            return
+        words = argument.split()
+        if len(words) not in {1, 3} or words[0] not in {"max", "min", "zeros"}:
+            print("Invalid syntax. See .help where.")
+            return
+        min_x, max_x = self.view()
+        if len(words) == 3:
+            try:
+                min_x, max_x = float(words[1]), float(words[2])
+            except ValueError:
+                print("Couldn't parse.  See .help where for syntax.")
+                return
+        series = self.navigation_series()
+        # The series only covers the range the graph was entered with.
+        min_x, max_x = max(min_x, series.min_x), min(max_x, series.max_x)
+        if min_x >= max_x:
+            print("That's outside the graph, which is from x = {} to x = {}.".format(series.min_x, series.max_x))
+            return
+        if words[0] == "zeros":
+            count, where = series.zeros(min_x, max_x)
+            if count == 0:
+                print("y doesn't cross 0 between x = {} and x = {}.".format(min_x, max_x))
+                return
+            shown = ", ".join("{:.6g}".format(x) for x in where[:10])
+            print("y crosses 0 {} time{}, near x = {}{}".format(count, "" if count == 1 else "s", shown, "..." if count > 10 else "."))
+            return
+        lowest, highest = series.extremes(min_x, max_x)
+        if lowest is None:
+            print("y is undefined everywhere between x = {} and x = {}.".format(min_x, max_x))
+            return
+        x, y = highest if words[0] == "max" else lowest
+        print("The {} is y = {:.6g}, at x = {:.6g}.".format("maximum" if words[0] == "max" else "minimum", y, x))
 
     def do_eval(self, argument):
         """Evaluate the argument with sympy and display.
@@ -155,6 +1000,7 @@ syntax:
         if len(argument) == 0:
             print("Invalid syntax. See .help eval for details.")
             return
+        import sympy
         try:
             sym = self.parse(argument)
             sympy.simplify(sym)
@@ -173,6 +1019,7 @@ syntax:
 .xticks: Show if x ticks are on or off.
 .xticks off: Turn x ticks off.
 .xticks <number>: Tick when we cross a x value that is a multiple of <number>.
+Ticks can't be closer than one per control update would be, crossing the x range evenly.  See .help control.
 
 This command is equivalent to setting how axises are shown on a sighted graphing calculator."""
         if argument == "off":
@@ -187,6 +1034,11 @@ This command is equivalent to setting how axises are shown on a sighted graphing
             except:
                 print("Invalid syntax. See .help xticks for details.")
                 return
+            try:
+                sonifier.check_ticks(x_ticks, self.min_x, self.max_x, self.duration, self.control_interval, "x ticks")
+            except ValueError as e:
+                print(e)
+                return
             self.x_ticks = x_ticks
 
     def do_yticks(self, argument):
@@ -196,6 +1048,7 @@ syntax:
 .yticks: Show if y ticks are on or off.
 .yticks off: Turn y ticks off.
 .yticks <number>: Tick when we cross a y value that is a multiple of <number>.
+Ticks can't be closer than one per control update would be, crossing the y range evenly.  See .help control.
 
 This command is equivalent to setting how axises are shown on a sighted graphing calculator."""
         if argument == "off":
@@ -210,6 +1063,11 @@ This command is equivalent to setting how axises are shown on a sighted graphing
             except:
                 print("Invalid syntax. See .help yticks for details.")
                 return
+            try:
+                sonifier.check_ticks(y_ticks, self.min_y, self.max_y, self.duration, self.control_interval, "y ticks")
+            except ValueError as e:
+                print(e)
+                return
             self.y_ticks = y_ticks
 
     def do_0ticks(self, argument):